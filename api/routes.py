@@ -1,17 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from database.connection import get_async_session
 from database.models import SensorReading, Sensor, Event, Employee, Role, Location, EquipmentSetting
 from datetime import datetime, timedelta
 from sqlalchemy import func, select
 from api.schemas import SensorData, AlertData, SensorOverview
 import sqlalchemy as sa
+from processing.live_buffer import live_readings
+from processing.backtest import run_backtest, parse_stored_value
+from processing.compression import CompressionSettings, interpolate, reading_compressor
+from processing.thresholds import threshold_cache
+import numpy as np
+from processing.pipeline_state import (consumer_snapshot, lag_snapshot, statistics_snapshot,
+                                       statistics_snapshot_all)
+from database.query_limits import (ClientDisconnected, QueryRejected, cancel_on_disconnect, heavy_queries,
+                                   is_statement_timeout, set_statement_timeout, wait_disconnected)
+from config import config
 
 from mqtt.client import logger
 
 router = APIRouter()
 
+# Статус ответа клиенту, отключившемуся до ответа (соглашение nginx, в журналы и метрики)
+CLIENT_CLOSED_REQUEST = 499
+
+
+async def run_heavy_query(request: Request, db: AsyncSession, endpoint: str, timeout: float,
+                          query: Callable[[], Awaitable]):
+    """Тяжелый запрос отчета: допуск по очереди, лимит времени в БД, отмена при отключении клиента"""
+    async def admitted():
+        async with heavy_queries.slot(endpoint):
+            await set_statement_timeout(db, timeout)
+            return await query()
+
+    try:
+        return await cancel_on_disconnect(admitted(), wait_disconnected(request.is_disconnected), endpoint)
+    except QueryRejected:
+        raise HTTPException(status_code=503, detail="Сервер занят другими отчетами, повторите запрос позже",
+                            headers={"Retry-After": str(int(heavy_queries.queue_timeout) or 1)})
+    except ClientDisconnected:
+        logger.info(f"Клиент отключился, запрос {endpoint} отменен")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except Exception as e:
+        if is_statement_timeout(e):
+            logger.warning(f"Запрос {endpoint} прерван по лимиту времени {timeout} с")
+            raise HTTPException(status_code=504, detail=f"Запрос выполнялся дольше {timeout:g} с, сократите период")
+        raise
+
+
 @router.get("/sensors", response_model=List[SensorOverview])
 async def get_sensors(db: AsyncSession = Depends(get_async_session)):
     """Получение списка всех датчиков"""
@@ -49,14 +86,147 @@ async def get_sensor_data(
     return readings
 
 
+# Ограничение числа точек сетки интерполяции в одном ответе
+MAX_INTERPOLATION_POINTS = 10000
+
+
+@router.get("/sensors/{sensor_id}/interpolated")
+async def get_sensor_interpolated_data(
+        sensor_id: int,
+        from_time: Optional[datetime] = None,
+        to_time: Optional[datetime] = None,
+        step_seconds: float = Query(60, gt=0),
+        db: AsyncSession = Depends(get_async_session)
+):
+    """Значения датчика на равномерной сетке, восстановленные по сжатым показаниям
+
+    Для swinging door значения между сохраненными точками восстанавливаются
+    линейно, для одной зоны нечувствительности - последним значением.
+    """
+    to_time = to_time or datetime.now()
+    from_time = from_time or to_time - timedelta(days=1)
+    if (to_time - from_time).total_seconds() / step_seconds > MAX_INTERPOLATION_POINTS:
+        raise HTTPException(status_code=400, detail="Слишком много точек, увеличьте step_seconds")
+
+    columns = (SensorReading.time, SensorReading.value)
+    inside = select(*columns).where(
+        SensorReading.sensor_id == sensor_id, SensorReading.time >= from_time, SensorReading.time <= to_time
+    )
+    # Соседние точки за границами периода нужны для интерполяции на краях
+    before = select(*columns).where(SensorReading.sensor_id == sensor_id, SensorReading.time < from_time) \
+        .order_by(SensorReading.time.desc()).limit(1)
+    after = select(*columns).where(SensorReading.sensor_id == sensor_id, SensorReading.time > to_time) \
+        .order_by(SensorReading.time).limit(1)
+
+    points = {}
+    for query in (before, inside, after):
+        for time, raw in (await db.execute(query)).all():
+            value = parse_stored_value(raw)
+            if value is not None:
+                points[time.timestamp()] = value
+
+    # Показание, удерживаемое компрессором, еще не записано в БД
+    pending = reading_compressor.pending(sensor_id)
+    if pending is not None and pending.time <= to_time:
+        points.setdefault(pending.seconds, pending.value)
+
+    times = np.array(sorted(points), dtype=np.float64)
+    values = np.array([points[time] for time in times], dtype=np.float64)
+    grid = np.arange(from_time.timestamp(), to_time.timestamp() + step_seconds / 2, step_seconds)
+    mode = CompressionSettings.for_sensor(await threshold_cache.get(sensor_id)).interpolation
+    result = interpolate(times, values, grid, mode)
+
+    return {
+        "sensor_id": sensor_id,
+        "interpolation": mode,
+        "step_seconds": step_seconds,
+        "stored_points": len(times),
+        "times": (grid * 1000).astype(np.int64).tolist(),
+        "values": [None if np.isnan(value) else float(value) for value in result]
+    }
+
+
+@router.get("/sensors/{sensor_id}/live")
+async def get_sensor_live_data(sensor_id: int, minutes: float = Query(15, gt=0, le=1440)):
+    """Последние показания датчика из буфера в памяти (без запросов к БД)"""
+    times, values = live_readings.window(sensor_id, minutes=minutes)
+    return {
+        "sensor_id": sensor_id,
+        "minutes": minutes,
+        "times": times.tolist(),
+        "values": values.tolist()
+    }
+
+
+@router.get("/sensors/{sensor_id}/statistics")
+async def get_sensor_statistics(sensor_id: int):
+    """Скользящая статистика датчика из памяти"""
+    stats = statistics_snapshot(sensor_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Статистика по датчику еще не накоплена")
+    return stats
+
+
+@router.get("/ingest/lag")
+async def get_ingest_lag(sensor_id: Optional[int] = None):
+    """Сквозная задержка доставки показаний (время приема минус время измерения)"""
+    if sensor_id is None:
+        return lag_snapshot()
+    lag = lag_snapshot(sensor_id)
+    if lag is None:
+        raise HTTPException(status_code=404, detail="Показания датчика еще не поступали")
+    return lag
+
+
+@router.get("/kafka/consumer")
+async def get_consumer_metrics():
+    """Отставание консьюмера Kafka по партициям, скорость по топикам и задержки обработки"""
+    return consumer_snapshot()
+
+
+@router.get("/sensors/{sensor_id}/backtest")
+async def backtest_sensor_thresholds(
+        request: Request,
+        sensor_id: int,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+        from_time: Optional[datetime] = None,
+        to_time: Optional[datetime] = None,
+        db: AsyncSession = Depends(get_async_session)
+):
+    """Сколько оповещений дали бы предлагаемые уставки за период (по умолчанию за 30 дней)"""
+    if min_value is None and max_value is None:
+        raise HTTPException(status_code=400, detail="Укажите min_value и/или max_value")
+    if min_value is not None and max_value is not None and min_value >= max_value:
+        raise HTTPException(status_code=400, detail="min_value должно быть меньше max_value")
+    to_time = to_time or datetime.now()
+    from_time = from_time or to_time - timedelta(days=30)
+    return await run_heavy_query(request, db, "backtest", config.DB_STATEMENT_TIMEOUT_BACKTEST,
+                                 lambda: run_backtest(sensor_id, min_value, max_value, from_time, to_time,
+                                                      session=db))
+
+
+@router.get("/statistics/live")
+async def get_live_statistics():
+    """Скользящая статистика по всем датчикам из памяти"""
+    return statistics_snapshot_all()
+
+
 @router.get("/alerts")
 async def get_alerts(
+    request: Request,
     from_time: Optional[datetime] = None,
     to_time: Optional[datetime] = None,
     event_type: Optional[str] = None,
     db: AsyncSession = Depends(get_async_session)
 ):
     """Получение списка оповещений с возможностью фильтрации"""
+    return await run_heavy_query(request, db, "alerts", config.DB_STATEMENT_TIMEOUT_ALERTS,
+                                 lambda: select_alerts(db, from_time, to_time, event_type))
+
+
+async def select_alerts(db: AsyncSession, from_time: Optional[datetime], to_time: Optional[datetime],
+                        event_type: Optional[str]):
     try:
         # Проверяем наличие событий без фильтров
         check_query = sa.select(sa.func.count(Event.id))
@@ -122,17 +292,23 @@ async def get_alerts(
                 "description": row.Event.description if hasattr(row.Event, 'description') else 
                               (row.Event.message if hasattr(row.Event, 'message') else "Нет описания"),
                 "sensor_id": row.Event.sensor_id,
-                "sensor_name": row.sensor_name or "Неизвестно"
+                "sensor_name": row.sensor_name or "Неизвестно",
+                "count": row.Event.count or 1,
+                "peak_value": row.Event.peak_value,
+                "status": row.Event.status
             }
             for row in alerts
         ]
     except Exception as e:
+        if is_statement_timeout(e):
+            raise
         logger.error(f"Ошибка получения оповещений: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/statistics/production")
 async def get_production_statistics(
+        request: Request,
         from_time: Optional[datetime] = None,
         to_time: Optional[datetime] = None,
         db: AsyncSession = Depends(get_async_session)
@@ -142,7 +318,11 @@ async def get_production_statistics(
         from_time = datetime.now() - timedelta(days=7)
     if not to_time:
         to_time = datetime.now()
+    return await run_heavy_query(request, db, "production_statistics", config.DB_STATEMENT_TIMEOUT_PRODUCTION,
+                                 lambda: select_production_statistics(db, from_time, to_time))
 
+
+async def select_production_statistics(db: AsyncSession, from_time: datetime, to_time: datetime):
     # Получение данных о количестве бутылок
     bottle_query = select(
         func.date_trunc('day', SensorReading.time).label('date'),
@@ -328,7 +508,7 @@ async def get_latest_sensor_data(db: AsyncSession = Depends(get_async_session)):
         ]
     except Exception as e:
         logger.error(f"Ошибка получения данных датчиков: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
 
 def extract_numeric_value(value_str):
     """Извлекает числовое значение из строки или JSON"""
@@ -1,15 +1,59 @@
 from pathlib import Path
+from typing import Dict
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 BASE_DIR = Path(__file__).parent
 
 
 class Settings(BaseSettings):
+    # Роль процесса: ingest (MQTT -> Kafka), consumer (Kafka -> БД), web (панель и API) или all
+    SERVICE_ROLE: str = "all"
+    WEB_HOST: str = "0.0.0.0"
+    WEB_PORT: int = 8000
+    # Пред-форкнутых воркеров роли web (в роли all всегда один). Состояние конвейера в памяти
+    # (буферы показаний, статистика) каждый воркер читает из KAFKA_STATE_TOPIC; кеши уставок
+    # и пользователей у каждого воркера свои, их сброс передается остальным воркерам
+    WEB_WORKERS: int = 1
+    WEB_HTTP: str = "auto"  # реализация HTTP uvicorn: auto (httptools, если установлен), h11, httptools
+    WEB_FANOUT_MAX_BUFFER: int = 8 * 1024 * 1024  # байт в очереди к отстающему воркеру до пропуска сообщений
+    EVENT_LOOP: str = "auto"  # цикл событий: auto (uvloop, если установлен), uvloop, asyncio
+    METRICS_PORT: int = 9100  # /metrics процессов без веб-роли, 0 - не открывать
+    SHUTDOWN_TIMEOUT: float = 30.0  # секунды на завершение каждой роли при остановке
+
     DB_HOST: str
     DB_PORT: int
     DB_USER: str
     DB_PASS: str
     DB_NAME: str
+    DB_ECHO: bool = False  # вывод всех SQL-запросов в журнал (только для отладки)
+    # Пул соединений одного процесса (у каждого воркера веб-роли свой пул)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 60  # секунды ожидания свободного соединения
+    DB_POOL_RECYCLE: int = -1  # секунды жизни соединения, -1 - без ограничения
+    # Переопределения параметров пула по ролям (JSON в переменной окружения), например
+    # {"web": {"pool_size": 10, "max_overflow": 20}, "ingest": {"pool_size": 2}}
+    DB_POOL_ROLES: Dict[str, Dict[str, int]] = {}
+    DB_PGBOUNCER: bool = False  # подключение через PgBouncer (без кеша подготовленных запросов)
+    # Поиск соединений, удерживаемых сессиями дольше порога
+    DB_LEAK_THRESHOLD: float = 30.0  # секунды
+    DB_LEAK_CHECK_INTERVAL: float = 5.0  # секунды между проверками
+    DB_LEAK_CAPTURE_STACK: bool = False  # сохранять стек получения соединения (дороже на каждом запросе)
+    # Лимиты времени выполнения запросов (statement_timeout) по эндпоинтам, секунды; 0 - без лимита
+    DB_STATEMENT_TIMEOUT_ALERTS: float = 15.0  # /api/alerts
+    DB_STATEMENT_TIMEOUT_PRODUCTION: float = 30.0  # /api/statistics/production
+    DB_STATEMENT_TIMEOUT_BACKTEST: float = 60.0  # /api/sensors/{id}/backtest
+    DB_STATEMENT_TIMEOUT_STREAMS: float = 5.0  # генераторы рассылки WebSocket/SSE
+    # Допуск тяжелых запросов отчетов: одновременно в процессе и ожидание в очереди, секунды
+    DB_HEAVY_QUERY_CONCURRENCY: int = 2
+    DB_HEAVY_QUERY_QUEUE_TIMEOUT: float = 10.0
+    DB_DISCONNECT_POLL_INTERVAL: float = 0.5  # секунды между проверками отключения HTTP-клиента
+
+    # Журналирование: уровень, ограничение частоты записей горячего пути
+    LOG_LEVEL: str = "INFO"
+    LOG_RATE_LIMIT_INTERVAL: float = 10.0  # секунды окна ограничения
+    LOG_RATE_LIMIT_BURST: int = 5  # записей с одним шаблоном за окно
+    LOG_DEBUG_SAMPLE_RATE: float = 0.01  # доля выводимых DEBUG-записей горячего пути
 
     MQTT_BROKER: str
     MQTT_PORT: int
@@ -20,10 +64,98 @@ class Settings(BaseSettings):
     KAFKA_BOOTSTRAP_SERVERS: str
     KAFKA_MAX_BATCH_SIZE: int
     KAFKA_LINGER_MS: int
+    KAFKA_CONSUMER_MAX_RECORDS: int = 500  # сообщений в одной выборке консьюмера
+    # Повторная обработка сообщений консьюмером и топик недоставленных сообщений
+    KAFKA_MAX_RETRIES: int = 3
+    KAFKA_RETRY_BACKOFF: float = 0.5  # секунды перед первым повтором, далее удваивается
+    KAFKA_RETRY_BACKOFF_MAX: float = 10.0
+    KAFKA_DEAD_LETTER_TOPIC: str = "dead_letter"
+    # Состояние конвейера в памяти (буферы показаний, статистика, задержки, метрики консьюмера):
+    # процессы с консьюмером публикуют его в топик, процессы роли web без консьюмера читают
+    KAFKA_STATE_TOPIC: str = "pipeline_state"
+    PIPELINE_STATE_INTERVAL: float = 1.0  # секунды между публикациями
+    PIPELINE_STATE_REPLAY: int = 3600  # секунды истории топика, читаемые веб-процессом при запуске (окна графиков)
+    PIPELINE_STATE_EXPIRE: float = 30.0  # секунды без публикаций, после которых снимки источника не учитываются
 
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    # Кеш проверенных токенов и пользователей
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_USER_CACHE_TTL: int = 300
+
+    # Емкость кольцевого буфера последних показаний на датчик
+    LIVE_BUFFER_CAPACITY: int = 3600
+
+    # Скользящая статистика по датчикам
+    STATS_WINDOW_SECONDS: int = 300
+    STATS_WINDOW_MAX_POINTS: int = 10000
+    STATS_EWMA_ALPHA: float = 0.2
+
+    # Время измерения: допустимое опоздание показаний для потоковой статистики
+    # и максимальный сдвиг времени устройства в будущее относительно приема, секунды
+    STREAM_ALLOWED_LATENESS: int = 10
+    EVENT_TIME_MAX_SKEW: int = 300
+
+    # Сжатие показаний при приеме (значения по умолчанию, переопределяются в EquipmentSetting)
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_DEADBAND: float = 0.0  # абсолютная зона нечувствительности
+    COMPRESSION_DEADBAND_PERCENT: float = 0.0  # зона нечувствительности, % от значения
+    COMPRESSION_DEVIATION_FRACTION: float = 0.005  # допуск swinging door, доля диапазона уставок
+    COMPRESSION_MAX_INTERVAL: int = 600  # секунды, контрольная запись не реже
+
+    # Кеш уставок оборудования, секунды
+    THRESHOLD_CACHE_TTL: int = 60
+
+    # Потоковое обнаружение аномалий
+    ANOMALY_DETECTION_ENABLED: bool = True
+    ANOMALY_MIN_SAMPLES: int = 30
+    ANOMALY_ZSCORE_LIMIT: float = 4.0
+    ANOMALY_EWMA_LAMBDA: float = 0.2
+    ANOMALY_EWMA_LIMIT: float = 3.0
+    ANOMALY_CUSUM_K: float = 0.5
+    ANOMALY_CUSUM_H: float = 5.0
+    # Допустимая скорость изменения: доля диапазона уставок в секунду
+    ANOMALY_MAX_RATE_FRACTION: float = 0.5
+
+    # Дедупликация оповещений
+    ALERT_HYSTERESIS_FRACTION: float = 0.02  # доля диапазона уставок
+    ALERT_REALERT_INTERVAL: int = 300  # секунды
+    ALERT_UPDATE_INTERVAL: int = 30  # секунды между обновлениями счетчика в БД
+
+    # Составные правила по нескольким датчикам (JSON-файл относительно корня проекта)
+    ALERT_RULES_FILE: str = "alert_rules.json"
+    ALERT_RULE_MAX_AGE: int = 60  # секунды, после которых показание входа считается устаревшим
+
+    # Проверка уставок по истории
+    BACKTEST_CHUNK_SIZE: int = 50000  # строк в порции чтения истории
+    BACKTEST_MAX_ALERTS: int = 1000  # оповещений в ответе
+
+    # Выборочная трассировка сообщений от MQTT до рассылки клиентам
+    TRACE_SAMPLE_RATE: float = 0.001  # доля сообщений в выборке, 0 - трассировка отключена
+    TRACE_BUFFER_SIZE: int = 1000  # завершенных трассировок в памяти
+    TRACE_TIMEOUT: float = 10.0  # секунды ожидания рассылки до принудительного завершения
+    TRACE_EXPORT_FILE: str = ""  # файл OTLP/JSON относительно корня проекта, пусто - без экспорта
+
+    # Мониторинг цикла событий
+    LOOP_MONITOR_INTERVAL: float = 0.1  # секунды между пробуждениями зонда
+    LOOP_SLOW_CALLBACK_THRESHOLD: float = 0.25  # блокировка дольше порога фиксируется со стеком
+    PROFILE_MAX_SECONDS: int = 60  # максимальная длительность профилирования по запросу
+
+    # Локальный спул сообщений на время недоступности Kafka или БД
+    SPOOL_ENABLED: bool = True
+    SPOOL_DIR: str = "spool"  # каталог относительно корня проекта
+    SPOOL_SEGMENT_BYTES: int = 64 * 1024 * 1024  # размер сегментного файла
+    SPOOL_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # предел объема на диске для одного спула
+    # fsync пачкой: спул БД сбрасывается на диск до фиксации смещений Kafka, а MQTT-брокер
+    # получает подтверждение при приеме (до записи в спул Kafka), поэтому при падении процесса
+    # роли ingest теряются записи за последние SPOOL_FSYNC_INTERVAL секунд (не больше
+    # SPOOL_FSYNC_BATCH записей); SPOOL_FSYNC_BATCH=1 - fsync каждой записи без потерь на диске
+    SPOOL_FSYNC_BATCH: int = 1000  # записей между fsync
+    SPOOL_FSYNC_INTERVAL: float = 1.0  # секунды между fsync
+    SPOOL_REPLAY_BATCH: int = 500  # записей в порции воспроизведения
+    SPOOL_RETRY_INTERVAL: int = 5  # секунды между проверками недоступного получателя
+
     @property
     def DATABASE_URL(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
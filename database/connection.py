@@ -1,5 +1,7 @@
 from database.models import Employee, Role, Sensor, SensorReading, EquipmentSetting, Location, Event
-from database.data_base import async_session, engine, Base
+from database import data_base
+from database.data_base import async_session, Base
+from database.query_limits import is_statement_timeout
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,8 +13,11 @@ def connection(func):
             try:
                 return await func(session, *args, **kwargs)
             except Exception as e:
-                logger.error(f"Error in {func.__name__}: {e}")
                 await session.rollback()
+                # Прерывание по statement_timeout - не ошибка функции: вызывающий пропускает результат
+                if is_statement_timeout(e):
+                    raise
+                logger.error(f"Error in {func.__name__}: {e}")
             finally:
                 await session.close()
     return wrapper
@@ -28,5 +33,5 @@ async def get_async_session():
 
 
 async def create_tables():
-    async with engine.begin() as conn:
+    async with data_base.get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
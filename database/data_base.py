@@ -1,13 +1,88 @@
 from sqlalchemy import func
 from datetime import datetime
+from typing import Optional
+from uuid import uuid4
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncEngine, async_sessionmaker, create_async_engine, AsyncSession
 from config import config
+from database.pool import InstrumentedQueuePool, pool_monitor
+from database.query_limits import watch_statement_timeouts
 
-engine = create_async_engine(url=config.DATABASE_URL, echo=True, pool_size=5, max_overflow=10, pool_timeout=60)
-async_session = async_sessionmaker(engine, class_=AsyncSession)
+# Параметры пула, которые можно переопределить для роли процесса в DB_POOL_ROLES
+POOL_PARAMETERS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle")
+
+
+def pool_settings(role: str) -> dict:
+    """Параметры пула соединений для роли: общие значения и переопределения роли"""
+    settings = {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+    }
+    settings.update({key: value for key, value in config.DB_POOL_ROLES.get(role, {}).items()
+                     if key in POOL_PARAMETERS})
+    return settings
+
+
+def create_engine(role: str) -> AsyncEngine:
+    connect_args = {}
+    if config.DB_PGBOUNCER:
+        # PgBouncer в режиме transaction: подготовленные запросы asyncpg не переживают
+        # смену серверного соединения, поэтому кеши отключаются, а имена уникальны
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    new_engine = create_async_engine(url=config.DATABASE_URL, echo=config.DB_ECHO, poolclass=InstrumentedQueuePool,
+                                     connect_args=connect_args, **pool_settings(role))
+    pool_monitor.attach(new_engine)
+    watch_statement_timeouts(new_engine)
+    return new_engine
+
+
+class LazySessionmaker(async_sessionmaker):
+    """Фабрика сессий, создающая движок при первой сессии, если роль его еще не настроила
+
+    Так работают и отдельные точки входа (python -m processing.backtest,
+    database.init_db), не вызывающие configure_engine.
+    """
+
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
+
+
+# Движок создается при запуске роли (configure_engine) или при первом обращении к БД
+# (get_engine), до этого None; другие модули получают его через get_engine, а не импортом значения
+engine: Optional[AsyncEngine] = None
+async_session = LazySessionmaker(class_=AsyncSession)
+
+
+def get_engine() -> AsyncEngine:
+    """Текущий движок; при первом обращении создается с параметрами роли из SERVICE_ROLE"""
+    if engine is None:
+        configure_engine(config.SERVICE_ROLE)
+    return engine
+
+
+def configure_engine(role: str) -> AsyncEngine:
+    """Пул соединений для роли, выбранной при запуске (--role)
+
+    Вызывается до первого обращения к БД: движок создается с параметрами
+    роли, фабрика сессий переключается на него. Пред-форкнутые воркеры
+    создают собственный пул; если движок уже был, он освобождается без
+    закрытия соединений (унаследованные при fork принадлежат родителю).
+    """
+    global engine
+    if engine is not None:
+        engine.sync_engine.dispose(close=False)
+    engine = create_engine(role)
+    async_session.configure(bind=engine)
+    return engine
 
 
 class Base(AsyncAttrs, DeclarativeBase):
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
-    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())
@@ -7,8 +7,10 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import select
 
-from database.connection import engine, async_session
+from database import data_base
+from database.connection import async_session
 from database.models import Base, Employee, Role, Sensor, SensorReading, Event, Location, EquipmentSetting
+from web.auth import hash_password
 
 
 logging.basicConfig(level=logging.INFO,
@@ -69,7 +71,7 @@ SENSORS = [
 
 async def create_tables():
     """Создание всех таблиц в базе данных"""
-    async with engine.begin() as conn:
+    async with data_base.get_engine().begin() as conn:
         # Удаляем существующие таблицы, если указан флаг пересоздания
         # await conn.run_sync(Base.metadata.drop_all)
 
@@ -78,6 +80,40 @@ async def create_tables():
         logger.info("Таблицы созданы успешно")
 
 
+# Колонки, добавленные в существующие таблицы (create_all не изменяет созданные таблицы)
+ADDED_COLUMNS = [
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS count INTEGER DEFAULT 1",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS peak_value DOUBLE PRECISION",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS direction VARCHAR",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS status VARCHAR",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS cleared_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE sensor_readings ADD COLUMN IF NOT EXISTS ingest_time TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE equipment_settings ADD COLUMN IF NOT EXISTS deadband DOUBLE PRECISION",
+    "ALTER TABLE equipment_settings ADD COLUMN IF NOT EXISTS deadband_percent DOUBLE PRECISION",
+    "ALTER TABLE equipment_settings ADD COLUMN IF NOT EXISTS compression_deviation DOUBLE PRECISION",
+    "ALTER TABLE equipment_settings ADD COLUMN IF NOT EXISTS max_interval DOUBLE PRECISION",
+]
+
+# Индексы, добавленные в существующие таблицы; до уникального индекса открытых оповещений
+# дубли, созданные предыдущими версиями, закрываются (остается последнее событие)
+ADDED_INDEXES = [
+    """UPDATE events SET status = 'cleared', cleared_at = COALESCE(last_seen, timestamp)
+       WHERE status = 'open' AND id NOT IN (
+           SELECT MAX(id) FROM events WHERE status = 'open' GROUP BY sensor_id, alert_type)""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS uq_events_open_alert ON events (sensor_id, alert_type)
+       WHERE status = 'open'""",
+]
+
+
+async def upgrade_tables():
+    """Добавление новых колонок и индексов в таблицы, созданные предыдущими версиями"""
+    async with data_base.get_engine().begin() as conn:
+        for statement in ADDED_COLUMNS + ADDED_INDEXES:
+            await conn.execute(text(statement))
+        logger.info("Структура таблиц обновлена")
+
+
 async def create_roles():
     """Создание ролей в системе"""
     async with async_session() as session:
@@ -133,7 +169,7 @@ async def create_employees(roles):
                 role_name = emp_data.pop("role")
                 # Хешируем пароль
                 password = emp_data.pop("password")
-                hashed_password = password
+                hashed_password = hash_password(password)
 
                 # Создаем сотрудника
                 employee = Employee(
@@ -478,6 +514,7 @@ async def main():
     try:
         # Создаем таблицы
         await create_tables()
+        await upgrade_tables()
 
         # Создаем роли
         roles = await create_roles()
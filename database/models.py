@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
@@ -62,7 +62,8 @@ class SensorReading(Base):
     id = Column(Integer, primary_key=True)
     sensor_id = Column(Integer, ForeignKey("sensors.id"), nullable=False)
     value = Column(String, nullable=False)  # Изменили на String вместо Float
-    time = Column(DateTime, default=datetime.datetime.now)
+    time = Column(DateTime, default=datetime.datetime.now)  # время измерения на устройстве
+    ingest_time = Column(DateTime, default=datetime.datetime.now)  # время приема системой
 
     # Отношения
     sensor = relationship("Sensor", back_populates="readings")
@@ -75,6 +76,11 @@ class EquipmentSetting(Base):
     sensor_id = Column(Integer, ForeignKey('sensors.id'))
     max_value = Column(Float)
     min_value = Column(Float)
+    # Сжатие показаний при приеме (пусто - значения по умолчанию из конфигурации)
+    deadband = Column(Float)
+    deadband_percent = Column(Float)
+    compression_deviation = Column(Float)
+    max_interval = Column(Float)  # секунды
 
     sensor = relationship("Sensor", back_populates="settings")
 
@@ -89,6 +95,19 @@ class Event(Base):
     message = Column(String, nullable=False)
     value = Column(String)
     location_id = Column(Integer, ForeignKey("location.id"))
+    # Агрегация повторяющихся нарушений в одно событие
+    count = Column(Integer, default=1)
+    peak_value = Column(Float)
+    direction = Column(String)
+    status = Column(String)  # open / cleared
+    last_seen = Column(DateTime)
+    cleared_at = Column(DateTime)
+
+    # Не больше одного открытого оповещения каждого типа по датчику (защита от дублей между процессами)
+    __table_args__ = (
+        Index("uq_events_open_alert", "sensor_id", "alert_type", unique=True,
+              postgresql_where=text("status = 'open'")),
+    )
 
     # Отношения
     sensor = relationship("Sensor",
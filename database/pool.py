@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+import traceback
+from typing import Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from config import config
+from processing.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+db_pool_wait_seconds = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Ожидание соединения из пула БД",
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+)
+db_pool_timeouts = registry.counter("db_pool_checkout_timeouts_total", "Соединение из пула БД не получено за pool_timeout")
+db_pool_long_held = registry.counter("db_pool_long_held_total", "Соединения БД, удерживаемые дольше порога")
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул asyncpg с измерением времени ожидания свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            db_pool_wait_seconds.observe(time.perf_counter() - started)
+
+
+class Checkout:
+    """Выданное соединение: когда и кому"""
+
+    __slots__ = ("started", "owner", "stack", "reported")
+
+    def __init__(self, started: float, owner: str, stack: Optional[str]):
+        self.started = started
+        self.owner = owner
+        self.stack = stack
+        self.reported = False
+
+    def to_dict(self, now: float) -> dict:
+        return {"held_seconds": now - self.started, "owner": self.owner, "stack": self.stack}
+
+
+def _current_owner() -> str:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is None:
+        return "?"
+    coro = task.get_coro()
+    return f"{task.get_name()}:{getattr(coro, '__qualname__', coro)}"
+
+
+class PoolMonitor:
+    """Учет выданных соединений пула и поиск удерживаемых дольше порога
+
+    Соединение, которое сессия держит дольше leak_threshold секунд (открытая
+    транзакция в долгоживущем обработчике, незакрытая сессия), попадает в
+    журнал один раз с владельцем - задачей asyncio, получившей соединение,
+    а при capture_stack - и со стеком в момент получения.
+    """
+
+    def __init__(self, leak_threshold: float, capture_stack: bool = False):
+        self.leak_threshold = leak_threshold
+        self.capture_stack = capture_stack
+        self.engine = None
+        self._checkouts: Dict[int, Checkout] = {}
+
+    def attach(self, engine):
+        """Подключение к пулу движка (вызывается при создании движка)"""
+        self.engine = engine
+        self._checkouts.clear()
+        event.listen(engine.sync_engine, "checkout", self._on_checkout)
+        event.listen(engine.sync_engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        stack = "".join(traceback.format_stack(limit=20)[:-2]) if self.capture_stack else None
+        self._checkouts[id(connection_record)] = Checkout(time.monotonic(), _current_owner(), stack)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self._checkouts.pop(id(connection_record), None)
+
+    def long_held(self) -> List[Checkout]:
+        deadline = time.monotonic() - self.leak_threshold
+        return [checkout for checkout in list(self._checkouts.values()) if checkout.started < deadline]
+
+    def check(self):
+        """Запись в журнал соединений, впервые превысивших порог"""
+        now = time.monotonic()
+        for checkout in self.long_held():
+            if checkout.reported:
+                continue
+            checkout.reported = True
+            db_pool_long_held.inc()
+            logger.warning(f"Соединение БД удерживается {now - checkout.started:.1f} с: {checkout.owner}"
+                           + (f"\n{checkout.stack}" if checkout.stack else ""))
+
+    async def run(self, interval: float):
+        """Периодическая проверка удерживаемых соединений"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Ошибка проверки пула БД: {e}")
+
+    def _pool(self):
+        return self.engine.sync_engine.pool if self.engine is not None else None
+
+    def snapshot(self) -> dict:
+        pool = self._pool()
+        now = time.monotonic()
+        return {
+            "size": pool.size() if pool is not None else 0,
+            "in_use": pool.checkedout() if pool is not None else 0,
+            "idle": pool.checkedin() if pool is not None else 0,
+            "overflow": max(pool.overflow(), 0) if pool is not None else 0,
+            "timeout_seconds": pool.timeout() if pool is not None else None,
+            "checkout_wait": db_pool_wait_seconds.snapshot(),
+            "checkout_timeouts": db_pool_timeouts.value,
+            "leak_threshold_seconds": self.leak_threshold,
+            "long_held": [checkout.to_dict(now) for checkout in self.long_held()]
+        }
+
+
+# Глобальный учет соединений пула, подключается к движку в database.data_base
+pool_monitor = PoolMonitor(leak_threshold=config.DB_LEAK_THRESHOLD, capture_stack=config.DB_LEAK_CAPTURE_STACK)
+
+
+def _pool_value(name: str):
+    def value() -> float:
+        pool = pool_monitor._pool()
+        if pool is None:
+            return 0
+        return max(getattr(pool, name)(), 0)
+    return value
+
+
+registry.gauge("db_pool_size", "Постоянных соединений в пуле БД", function=_pool_value("size"))
+registry.gauge("db_pool_connections_in_use", "Выданных соединений пула БД", function=_pool_value("checkedout"))
+registry.gauge("db_pool_connections_idle", "Свободных соединений в пуле БД", function=_pool_value("checkedin"))
+registry.gauge("db_pool_overflow", "Соединений сверх pool_size", function=_pool_value("overflow"))
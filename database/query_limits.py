@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import config
+from processing.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE query_canceled: запрос прерван сервером по statement_timeout
+QUERY_CANCELED = "57014"
+
+db_statement_timeouts = registry.counter("db_statement_timeouts_total", "Запросов БД, прерванных по statement_timeout")
+db_queries_cancelled = registry.counter("db_queries_cancelled_total", "Запросов БД, отмененных после отключения клиента",
+                                        labelnames=("endpoint",))
+db_heavy_query_wait_seconds = registry.histogram(
+    "db_heavy_query_wait_seconds", "Ожидание допуска тяжелого запроса к БД",
+    (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+db_heavy_queries_rejected = registry.counter("db_heavy_queries_rejected_total",
+                                             "Тяжелых запросов, не дождавшихся допуска", labelnames=("endpoint",))
+
+
+class QueryRejected(Exception):
+    """Тяжелый запрос не получил допуск за queue_timeout"""
+
+
+class ClientDisconnected(Exception):
+    """Клиент отключился, запрос отменен"""
+
+
+def is_statement_timeout(error: BaseException) -> bool:
+    """Ошибка БД - прерывание запроса по statement_timeout (по SQLSTATE, сообщение сервера локализовано)"""
+    while error is not None:
+        if getattr(error, "sqlstate", None) == QUERY_CANCELED:
+            return True
+        error = getattr(error, "orig", None) or error.__cause__
+    return False
+
+
+def watch_statement_timeouts(engine):
+    """Подсчет запросов, прерванных по statement_timeout (вызывается при создании движка)"""
+    def on_error(context):
+        if is_statement_timeout(context.original_exception):
+            db_statement_timeouts.inc()
+    event.listen(engine.sync_engine, "handle_error", on_error)
+
+
+async def set_statement_timeout(session: AsyncSession, seconds: float):
+    """Лимит времени выполнения запросов сессии до конца текущей транзакции
+
+    SET LOCAL действует только в транзакции, поэтому значение не остается на
+    соединении пула и корректно работает через PgBouncer в режиме transaction.
+    Сессия начинает транзакцию этим запросом; после commit лимит снимается.
+    """
+    if seconds <= 0 or session.bind.dialect.name != "postgresql":
+        return
+    # SET не принимает параметры запроса, значение - целое число миллисекунд
+    await session.execute(sa.text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+
+
+def with_statement_timeout(seconds: float, func: Callable[..., Awaitable]):
+    """Генератор данных с лимитом времени запросов в переданной ему сессии"""
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        await set_statement_timeout(db, seconds)
+        return await func(db, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+class AdmissionLimiter:
+    """Ограничение числа одновременно выполняемых тяжелых запросов процесса
+
+    Отчеты за большие периоды занимают соединения пула на секунды; без
+    ограничения несколько таких запросов забирают весь пул, и запросы живого
+    дашборда ждут соединения. Сверх limit запросы ждут в очереди не дольше
+    queue_timeout секунд, затем отклоняются (QueryRejected).
+    """
+
+    def __init__(self, limit: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.running: Dict[str, int] = {}
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            db_heavy_queries_rejected.labels(endpoint).inc()
+            raise QueryRejected(f"Нет допуска для {endpoint} за {self.queue_timeout} с") from None
+        finally:
+            self.waiting -= 1
+            db_heavy_query_wait_seconds.observe(time.perf_counter() - started)
+        self.running[endpoint] = self.running.get(endpoint, 0) + 1
+        try:
+            yield
+        finally:
+            self.running[endpoint] -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_timeout_seconds": self.queue_timeout,
+            "running": {endpoint: count for endpoint, count in self.running.items() if count},
+            "waiting": self.waiting,
+            "wait": db_heavy_query_wait_seconds.snapshot()
+        }
+
+
+# Глобальный допуск тяжелых запросов (отчеты API); у каждого воркера веб-роли свой
+heavy_queries = AdmissionLimiter(limit=config.DB_HEAVY_QUERY_CONCURRENCY,
+                                 queue_timeout=config.DB_HEAVY_QUERY_QUEUE_TIMEOUT)
+
+registry.gauge("db_heavy_queries_running", "Выполняющихся тяжелых запросов к БД",
+               function=lambda: sum(heavy_queries.running.values()))
+registry.gauge("db_heavy_queries_waiting", "Тяжелых запросов в очереди допуска",
+               function=lambda: heavy_queries.waiting)
+
+
+async def wait_disconnected(is_disconnected: Callable[[], Awaitable[bool]],
+                            interval: float = config.DB_DISCONNECT_POLL_INTERVAL):
+    """Ожидание отключения клиента опросом (например, Request.is_disconnected)"""
+    while not await is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def cancel_on_disconnect(work: Awaitable, disconnected: Awaitable, endpoint: str):
+    """Выполнение work с отменой при завершении disconnected
+
+    Отмена задачи, ожидающей ответа asyncpg, отправляет серверу запрос отмены,
+    поэтому запрос в БД прерывается, а не дорабатывает впустую. disconnected -
+    корутина или задача, которая завершается при отключении клиента; переданная
+    задача не отменяется и может использоваться повторно.
+    """
+    owned = not isinstance(disconnected, asyncio.Future)
+    watcher = asyncio.ensure_future(disconnected)
+    task = asyncio.ensure_future(work)
+    try:
+        await asyncio.wait([task, watcher], return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if owned:
+            watcher.cancel()
+    if task.done():
+        return task.result()
+
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    db_queries_cancelled.labels(endpoint).inc()
+    raise ClientDisconnected(endpoint)
@@ -1,40 +1,137 @@
-import json
 import asyncio
-from aiokafka import AIOKafkaConsumer
+import time
+from typing import Dict, Optional
+from aiokafka import AIOKafkaConsumer, TopicPartition
 from config import config
-from processing.data_processor import process_data
+from processing.data_processor import ProcessingError, ingest_data
+from kafka.dead_letter import send_to_dead_letter
+from kafka.metrics import CONSUMER_GROUP_ID, consumer_metrics
+from processing.tracing import TRACEPARENT_HEADER, tracer
+from processing.log_limits import hot_logger
+from processing.spool import db_spool
 import logging
 
 logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
 
 
-async def consume_messages(topics):
-    """Асинхронный консьюмер для Kafka топиков"""
-    consumer = AIOKafkaConsumer(
-        *topics,
-        bootstrap_servers=config.KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-        group_id="pet_bottle_monitoring"
-    )
+async def handle_message(msg):
+    """Обработка одного сообщения с повторами и отправкой в топик недоставленных
 
-    try:
-        await consumer.start()
-        logger.info(f"Kafka консьюмер запущен для топиков: {topics}")
+    Ошибка в содержимом сообщения сразу отправляет его в топик недоставленных,
+    прочие ошибки повторяются до KAFKA_MAX_RETRIES раз с экспоненциальной паузой.
+    """
+    traceparent = next((value.decode() for key, value in msg.headers or () if key == TRACEPARENT_HEADER), None)
+    trace = tracer.resume(traceparent, "kafka.message", topic=msg.topic) if traceparent else None
+    if trace is not None and msg.timestamp:
+        trace.add_span("kafka.consume", msg.timestamp * 1_000_000, time.time_ns(),
+                       partition=msg.partition, offset=msg.offset)
+
+    with tracer.activate(trace):
+        await _handle_with_retries(msg)
+
+
+async def _handle_with_retries(msg):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            # Асинхронная обработка сообщения (при недоступности БД - через спул)
+            with tracer.span("process", path="kafka", attempt=attempt):
+                await ingest_data(msg.topic, msg.value)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retryable = not isinstance(e, ProcessingError) or e.retryable
+            if not retryable or attempt > config.KAFKA_MAX_RETRIES:
+                await send_to_dead_letter(msg, e, attempt)
+                consumer_metrics.dead_letters.inc()
+                return
+            consumer_metrics.retries.inc()
+            delay = min(config.KAFKA_RETRY_BACKOFF * 2 ** (attempt - 1), config.KAFKA_RETRY_BACKOFF_MAX)
+            hot_log.warning("Ошибка обработки сообщения %s:%s:%s (попытка %d), повтор через %s с: %s",
+                            msg.topic, msg.partition, msg.offset, attempt, delay, e)
+            await asyncio.sleep(delay)
+
+
+async def consume_messages(topics, stop: Optional[asyncio.Event] = None):
+    """Асинхронный консьюмер для Kafka топиков
 
-        async for msg in consumer:
-            logger.debug(f"Получено сообщение из {msg.topic}: {msg.value}")
+    Ошибка одного сообщения не останавливает консьюмер; при потере связи с Kafka
+    консьюмер переподключается. Автофиксация отключена: смещения фиксируются
+    явно после обработки каждой выборки и только для обработанных сообщений,
+    поэтому после падения процесса необработанные сообщения выборки (в том
+    числе ожидающие повтора) будут получены снова. После установки stop
+    консьюмер дообрабатывает текущее сообщение, фиксирует смещения и отключается.
+    """
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        consumer = AIOKafkaConsumer(
+            *topics,
+            bootstrap_servers=config.KAFKA_BOOTSTRAP_SERVERS,
+            # Значение передается байтами: process_data разбирает его один раз по схеме топика
+            group_id=CONSUMER_GROUP_ID,
+            enable_auto_commit=False
+        )
+        # Следующее смещение после обработанных, еще не зафиксированных сообщений
+        processed: Dict[TopicPartition, int] = {}
 
-            # Асинхронная обработка сообщения
-            await process_data(msg.topic, msg.value)
+        try:
+            await consumer.start()
+            logger.info(f"Kafka консьюмер запущен для топиков: {topics}")
 
+            while not stop.is_set():
+                batches = await consumer.getmany(timeout_ms=1000, max_records=config.KAFKA_CONSUMER_MAX_RECORDS)
+                for partition, messages in batches.items():
+                    consumer_metrics.observe_batch(len(messages))
+                    for msg in messages:
+                        if stop.is_set():
+                            break
+                        hot_log.debug("Получено сообщение из %s: %.200r", msg.topic, msg.value)
+                        started = time.perf_counter()
+                        await handle_message(msg)
+                        processed[partition] = msg.offset + 1
+                        consumer_metrics.observe_message(msg.topic, msg.partition, msg.offset, msg.timestamp,
+                                                         started, consumer.highwater(partition))
+                await _commit_processed(consumer, processed)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при работе Kafka консьюмера: {e}")
+        finally:
+            await _commit_processed(consumer, processed)
+            await consumer.stop()
+            logger.info("Kafka консьюмер остановлен")
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=config.KAFKA_RETRY_BACKOFF_MAX)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _commit_processed(consumer, processed: Dict[TopicPartition, int]):
+    """Фиксация смещений обработанных сообщений
+
+    Фиксируются явные смещения, а не позиция консьюмера: позиция сдвигается
+    уже при получении выборки. Партиции, отобранные при перебалансировке,
+    пропускаются - их сообщения получит другой консьюмер группы. Сообщения,
+    отложенные в спул БД, сбрасываются на диск до фиксации смещений.
+    """
+    assignment = consumer.assignment()
+    offsets = {partition: offset for partition, offset in processed.items() if partition in assignment}
+    processed.clear()
+    if not offsets:
+        return
+    try:
+        await db_spool.sync()
+        await consumer.commit(offsets)
     except Exception as e:
-        logger.error(f"Ошибка при работе Kafka консьюмера: {e}")
-    finally:
-        await consumer.stop()
-        logger.info("Kafka консьюмер остановлен")
+        logger.error(f"Ошибка фиксации смещений Kafka консьюмера: {e}")
 
 
-async def start_consumers():
+async def start_consumers(stop: Optional[asyncio.Event] = None):
     """Запускает консьюмеры для всех нужных топиков"""
     topics = [
         "raw_material_data",
@@ -46,5 +143,5 @@ async def start_consumers():
     ]
 
     # Запускаем консьюмер как отдельную задачу
-    consumer_task = asyncio.create_task(consume_messages(topics))
-    return consumer_task
\ No newline at end of file
+    consumer_task = asyncio.create_task(consume_messages(topics, stop))
+    return consumer_task
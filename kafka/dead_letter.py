@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import datetime
+import logging
+from aiokafka import AIOKafkaConsumer, TopicPartition
+from config import config
+from kafka.producer import close_producer, get_producer
+
+logger = logging.getLogger(__name__)
+
+# Заголовки сообщения в топике недоставленных: откуда оно и почему не обработано.
+# Значение сообщения - исходные байты без изменений.
+HEADER_TOPIC = "dlq.topic"
+HEADER_PARTITION = "dlq.partition"
+HEADER_OFFSET = "dlq.offset"
+HEADER_ERROR = "dlq.error"
+HEADER_ATTEMPTS = "dlq.attempts"
+HEADER_FAILED_AT = "dlq.failed_at"
+
+# Группа консьюмера инструмента повторной отправки
+REPLAY_GROUP_ID = "pet_bottle_dead_letter_replay"
+
+
+def parse_headers(headers) -> dict:
+    """Заголовки Kafka в словарь строк"""
+    return {key: value.decode("utf-8", errors="replace") for key, value in headers or ()}
+
+
+async def send_to_dead_letter(msg, error: Exception, attempts: int) -> bool:
+    """Отправка необработанного сообщения в топик недоставленных"""
+    headers = [
+        (HEADER_TOPIC, msg.topic.encode()),
+        (HEADER_PARTITION, str(msg.partition).encode()),
+        (HEADER_OFFSET, str(msg.offset).encode()),
+        (HEADER_ERROR, str(error).encode("utf-8")),
+        (HEADER_ATTEMPTS, str(attempts).encode()),
+        (HEADER_FAILED_AT, datetime.datetime.now().isoformat().encode()),
+    ]
+    try:
+        producer = await get_producer()
+        await producer.send_and_wait(config.KAFKA_DEAD_LETTER_TOPIC, msg.value, key=msg.key, headers=headers)
+        logger.warning(f"Сообщение {msg.topic}:{msg.partition}:{msg.offset} отправлено в "
+                       f"{config.KAFKA_DEAD_LETTER_TOPIC} после {attempts} попыток: {error}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка отправки в {config.KAFKA_DEAD_LETTER_TOPIC}, сообщение "
+                     f"{msg.topic}:{msg.partition}:{msg.offset} потеряно: {e}; значение: {msg.value!r:.500}")
+        return False
+
+
+async def replay_dead_letters(limit=None, dry_run=False, idle_timeout=5.0) -> int:
+    """Повторная отправка сообщений из топика недоставленных в исходные топики
+
+    Переданные сообщения фиксируются в группе REPLAY_GROUP_ID, поэтому
+    повторный запуск продолжает с места остановки. В режиме dry_run сообщения
+    только выводятся, позиция не сдвигается. Работа заканчивается, когда
+    новых сообщений нет дольше idle_timeout секунд или достигнут limit.
+    """
+    consumer = AIOKafkaConsumer(
+        config.KAFKA_DEAD_LETTER_TOPIC,
+        bootstrap_servers=config.KAFKA_BOOTSTRAP_SERVERS,
+        group_id=REPLAY_GROUP_ID,
+        enable_auto_commit=False,
+        auto_offset_reset="earliest"
+    )
+    await consumer.start()
+    replayed = 0
+    try:
+        producer = None if dry_run else await get_producer()
+        while limit is None or replayed < limit:
+            batches = await consumer.getmany(timeout_ms=int(idle_timeout * 1000))
+            if not batches:
+                break
+            for partition, messages in batches.items():
+                for msg in messages:
+                    if limit is not None and replayed >= limit:
+                        break
+                    headers = parse_headers(msg.headers)
+                    target = headers.get(HEADER_TOPIC)
+                    if dry_run:
+                        print(f"{target}:{headers.get(HEADER_PARTITION)}:{headers.get(HEADER_OFFSET)} "
+                              f"[{headers.get(HEADER_FAILED_AT)}, попыток {headers.get(HEADER_ATTEMPTS)}] "
+                              f"{headers.get(HEADER_ERROR)}: {msg.value!r:.200}")
+                    elif target:
+                        await producer.send_and_wait(target, msg.value, key=msg.key)
+                    else:
+                        logger.warning(f"У сообщения {partition.partition}:{msg.offset} нет исходного топика, пропущено")
+                    replayed += 1
+                    if not dry_run:
+                        await consumer.commit({TopicPartition(msg.topic, msg.partition): msg.offset + 1})
+    finally:
+        await consumer.stop()
+        await close_producer()
+    return replayed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Повторная отправка сообщений из топика недоставленных')
+    parser.add_argument('--limit', type=int, default=None, help='Максимальное количество сообщений')
+    parser.add_argument('--dry-run', action='store_true', help='Только вывести сообщения, не отправляя их')
+    parser.add_argument('--idle-timeout', type=float, default=5.0,
+                        help='Завершить, если новых сообщений нет дольше указанного числа секунд')
+    args = parser.parse_args()
+
+    count = await replay_dead_letters(args.limit, args.dry_run, args.idle_timeout)
+    logger.info(f"{'Просмотрено' if args.dry_run else 'Отправлено повторно'} сообщений: {count}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
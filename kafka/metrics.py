@@ -0,0 +1,115 @@
+import time
+from typing import Dict, Optional, Tuple
+from processing.metrics import SIZE_BUCKETS, ThroughputMeter, registry
+
+
+class PartitionState:
+    """Позиция консьюмера в партиции"""
+
+    __slots__ = ("offset", "highwater", "consumed_at")
+
+    def __init__(self):
+        self.offset = None
+        self.highwater = None
+        self.consumed_at = None
+
+    @property
+    def lag(self) -> Optional[int]:
+        if self.offset is None or self.highwater is None:
+            return None
+        return max(self.highwater - (self.offset + 1), 0)
+
+
+class ConsumerMetrics:
+    """Метрики консьюмера Kafka: отставание по партициям, скорость по топикам,
+    размеры пакетов и задержки обработки
+
+    Обновляется из цикла консьюмера, без блокировок (один цикл событий).
+    Гистограммы и счетчики регистрируются в реестре /metrics.
+    """
+
+    def __init__(self, group_id: str):
+        self.group_id = group_id
+        self.partitions: Dict[Tuple[str, int], PartitionState] = {}
+        self.throughput: Dict[str, ThroughputMeter] = {}
+        self.messages = registry.counter("kafka_consumer_messages_total", "Обработано сообщений Kafka",
+                                         labelnames=("topic",))
+        self.batch_size = registry.histogram("kafka_consumer_batch_size", "Сообщений партиции в одной выборке",
+                                             SIZE_BUCKETS)
+        # Время обработки одного сообщения (ingest_data, включая повторы)
+        self.processing_seconds = registry.histogram("kafka_consumer_processing_seconds",
+                                                     "Время обработки сообщения Kafka")
+        # От записи сообщения в Kafka до завершения его обработки (фиксация в БД)
+        self.end_to_end_seconds = registry.histogram("kafka_consumer_end_to_end_seconds",
+                                                     "Время от записи сообщения в Kafka до конца обработки")
+        self.dead_letters = registry.counter("kafka_consumer_dead_letters_total",
+                                             "Сообщений, отправленных в топик недоставленных")
+        self.retries = registry.counter("kafka_consumer_retries_total", "Повторных попыток обработки")
+        registry.collector("gauge", "kafka_consumer_lag", "Отставание консьюмера по партиции, сообщений",
+                           self._lag_samples)
+
+    def observe_batch(self, size: int):
+        self.batch_size.observe(size)
+
+    def observe_message(self, topic: str, partition: int, offset: int, kafka_timestamp_ms: Optional[int],
+                        started: float, highwater: Optional[int]):
+        """Учет обработанного сообщения; started - time.perf_counter() до обработки"""
+        now = time.time()
+        self.processing_seconds.observe(time.perf_counter() - started)
+        if kafka_timestamp_ms is not None and kafka_timestamp_ms > 0:
+            self.end_to_end_seconds.observe(max(now - kafka_timestamp_ms / 1000, 0.0))
+
+        meter = self.throughput.get(topic)
+        if meter is None:
+            meter = self.throughput[topic] = ThroughputMeter()
+        meter.mark(1, now)
+        self.messages.labels(topic).inc()
+
+        state = self.partitions.get((topic, partition))
+        if state is None:
+            state = self.partitions[(topic, partition)] = PartitionState()
+        state.offset = offset
+        if highwater is not None:
+            state.highwater = highwater
+        state.consumed_at = now
+
+    def _lag_samples(self):
+        return [("kafka_consumer_lag", {"group": self.group_id, "topic": topic, "partition": str(partition)}, state.lag)
+                for (topic, partition), state in list(self.partitions.items()) if state.lag is not None]
+
+    def total_lag(self) -> int:
+        return sum(state.lag or 0 for state in self.partitions.values())
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {
+            "group_id": self.group_id,
+            "total_lag": self.total_lag(),
+            "partitions": [
+                {
+                    "topic": topic,
+                    "partition": partition,
+                    "offset": state.offset,
+                    "highwater": state.highwater,
+                    "lag": state.lag,
+                    "seconds_since_last_message": now - state.consumed_at if state.consumed_at else None
+                }
+                for (topic, partition), state in sorted(self.partitions.items())
+            ],
+            "topics": {
+                topic: {"messages": meter.total, "messages_per_second": meter.rate(now)}
+                for topic, meter in self.throughput.items()
+            },
+            "batch_size": self.batch_size.snapshot(),
+            "processing_seconds": self.processing_seconds.snapshot(),
+            "end_to_end_seconds": self.end_to_end_seconds.snapshot(),
+            "retries": self.retries.value,
+            "dead_letters": self.dead_letters.value
+        }
+
+
+# Группа консьюмера конвейера обработки
+CONSUMER_GROUP_ID = "pet_bottle_monitoring"
+
+# Глобальные метрики консьюмера, отдаются через /api/kafka/consumer
+consumer_metrics = ConsumerMetrics(CONSUMER_GROUP_ID)
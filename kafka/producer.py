@@ -1,34 +1,80 @@
 import json
 import asyncio
+import time
 from aiokafka import AIOKafkaProducer
 from config import config
+from processing.spool import kafka_spool
+from processing.metrics import registry
+from processing.tracing import TRACEPARENT_HEADER, tracer
+from processing.log_limits import hot_logger
 import logging
 
 logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
+
+kafka_produce_seconds = registry.histogram("kafka_produce_seconds", "Время отправки сообщения в Kafka")
+kafka_produce_errors = registry.counter("kafka_produce_errors_total", "Ошибки отправки сообщений в Kafka")
 
 # Глобальная переменная для продюсера
 _producer = None
 
+
+def _serialize(data) -> bytes:
+    return data if isinstance(data, bytes) else json.dumps(data).encode('utf-8')
+
+
 async def get_producer():
     """Создает и возвращает экземпляр Kafka продюсера"""
     global _producer
     if _producer is None:
-        _producer = AIOKafkaProducer(
+        producer = AIOKafkaProducer(
             bootstrap_servers=config.KAFKA_BOOTSTRAP_SERVERS,
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
+            # Исходные байты сообщения MQTT передаются без повторной сериализации
+            value_serializer=_serialize
         )
-        await _producer.start()
+        # Продюсер сохраняется только после успешного подключения
+        try:
+            await producer.start()
+        except Exception:
+            await producer.stop()
+            raise
+        _producer = producer
         logger.info(f"Kafka продюсер подключен к {config.KAFKA_BOOTSTRAP_SERVERS}")
     return _producer
 
 async def produce_message(topic, data):
-    """Отправляет сообщение в Kafka топик"""
+    """Отправляет сообщение в Kafka топик
+
+    Пока в спуле есть неотправленные сообщения (Kafka была недоступна),
+    новые сообщения дописываются в спул, чтобы сохранить порядок.
+    """
+    if kafka_spool.pending:
+        await kafka_spool.append(topic, _serialize(data))
+        return
     try:
         producer = await get_producer()
-        await producer.send_and_wait(topic, data)
-        logger.debug(f"Сообщение отправлено в Kafka топик {topic}: {data}")
+        # Контекст трассировки передается консьюмеру в заголовке сообщения
+        trace = tracer.current()
+        headers = [(TRACEPARENT_HEADER, trace.traceparent().encode())] if trace is not None else None
+        started = time.perf_counter()
+        await producer.send_and_wait(topic, data, headers=headers)
+        kafka_produce_seconds.observe(time.perf_counter() - started)
+        hot_log.debug("Сообщение отправлено в Kafka топик %s: %.200r", topic, data)
     except Exception as e:
-        logger.error(f"Ошибка отправки сообщения в Kafka: {e}")
+        kafka_produce_errors.inc()
+        if not kafka_spool.enabled:
+            hot_log.error("Ошибка отправки сообщения в Kafka: %s", e)
+            return
+        hot_log.error("Ошибка отправки сообщения в Kafka, сообщение отложено в спул: %s", e)
+        await kafka_spool.append(topic, _serialize(data))
+
+
+async def replay_spooled_messages(records):
+    """Отправка отложенных сообщений порцией, возвращает число отправленных"""
+    producer = await get_producer()
+    futures = [await producer.send(topic, payload) for topic, payload in records]
+    await asyncio.gather(*futures)
+    return len(records)
 
 async def close_producer():
     """Закрывает соединение с Kafka продюсером"""
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict
+from aiokafka import AIOKafkaConsumer, TopicPartition
+from aiokafka.admin import AIOKafkaAdminClient, NewTopic
+from config import config
+from kafka.producer import get_producer
+from processing.log_limits import hot_logger
+from processing.pipeline_state import PipelineStatePublisher, encode_state, pipeline_mirror
+
+logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
+
+
+async def ensure_state_topic():
+    """Создание топика состояния со сроком хранения PIPELINE_STATE_REPLAY
+
+    Старые снимки не нужны, а при автосоздании топика брокер хранил бы их
+    срок по умолчанию (неделю).
+    """
+    admin = AIOKafkaAdminClient(bootstrap_servers=config.KAFKA_BOOTSTRAP_SERVERS)
+    try:
+        await admin.start()
+        if config.KAFKA_STATE_TOPIC not in await admin.list_topics():
+            await admin.create_topics([NewTopic(
+                config.KAFKA_STATE_TOPIC, num_partitions=1, replication_factor=1,
+                topic_configs={"retention.ms": str(config.PIPELINE_STATE_REPLAY * 1000)}
+            )])
+            logger.info(f"Создан топик состояния конвейера {config.KAFKA_STATE_TOPIC}")
+    except Exception as e:
+        logger.error(f"Ошибка создания топика состояния конвейера: {e}")
+    finally:
+        await admin.close()
+
+
+async def publish_pipeline_state(stop: asyncio.Event):
+    """Публикация состояния конвейера процесса-консьюмера в KAFKA_STATE_TOPIC
+
+    Каждые PIPELINE_STATE_INTERVAL секунд и последний раз после установки stop.
+    Сообщения не откладываются в спул: это снимки, следующий заменяет прошлый.
+    """
+    await ensure_state_topic()
+    publisher = PipelineStatePublisher()
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=config.PIPELINE_STATE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        message = publisher.collect()
+        try:
+            producer = await get_producer()
+            await producer.send_and_wait(config.KAFKA_STATE_TOPIC, encode_state(message))
+        except Exception as e:
+            hot_log.error("Ошибка публикации состояния конвейера: %s", e)
+        if stop.is_set():
+            return
+
+
+async def mirror_pipeline_state(stop: asyncio.Event):
+    """Чтение состояния конвейера от консьюмеров в процессе роли web
+
+    Каждый процесс (и каждый воркер пред-форка) читает все партиции топика
+    без группы. При запуске читается история за PIPELINE_STATE_REPLAY секунд,
+    чтобы восстановить окна графиков; после переподключения чтение
+    продолжается со следующего сообщения, без повторного применения приращений.
+    """
+    pipeline_mirror.enabled = True
+    topic = config.KAFKA_STATE_TOPIC
+    positions: Dict[TopicPartition, int] = {}
+    while not stop.is_set():
+        consumer = AIOKafkaConsumer(bootstrap_servers=config.KAFKA_BOOTSTRAP_SERVERS, group_id=None,
+                                    enable_auto_commit=False)
+        try:
+            await consumer.start()
+            # Топик создается первой публикацией консьюмера
+            while topic not in await consumer.topics():
+                if stop.is_set():
+                    return
+                await asyncio.sleep(config.PIPELINE_STATE_INTERVAL)
+            partitions = [TopicPartition(topic, partition) for partition in consumer.partitions_for_topic(topic)]
+            consumer.assign(partitions)
+            await _seek_start(consumer, partitions, positions)
+            logger.info(f"Чтение состояния конвейера из топика {topic}")
+
+            while not stop.is_set():
+                batches = await consumer.getmany(timeout_ms=1000)
+                for partition, messages in batches.items():
+                    for msg in messages:
+                        try:
+                            pipeline_mirror.apply(json.loads(msg.value))
+                        except (ValueError, KeyError, TypeError) as e:
+                            hot_log.error("Некорректное сообщение состояния конвейера: %s", e)
+                        positions[partition] = msg.offset + 1
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка чтения состояния конвейера: {e}")
+        finally:
+            await consumer.stop()
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=config.KAFKA_RETRY_BACKOFF_MAX)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _seek_start(consumer, partitions, positions: Dict[TopicPartition, int]):
+    """Начальная позиция: после прочитанного или за PIPELINE_STATE_REPLAY секунд до текущего момента"""
+    unread = [partition for partition in partitions if partition not in positions]
+    for partition in partitions:
+        if partition in positions:
+            consumer.seek(partition, positions[partition])
+    if not unread:
+        return
+    since_ms = int((time.time() - config.PIPELINE_STATE_REPLAY) * 1000)
+    offsets = await consumer.offsets_for_times({partition: since_ms for partition in unread})
+    for partition in unread:
+        found = offsets.get(partition)
+        if found is not None:
+            consumer.seek(partition, found.offset)
+        else:
+            await consumer.seek_to_end(partition)
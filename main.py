@@ -1,75 +1,319 @@
+import argparse
 import asyncio
 import logging
-from mqtt.client import mqtt_client
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, List, Optional
+from mqtt.client import mqtt_client, stop_mqtt_client
 from kafka.consumer import start_consumers
-from kafka.producer import close_producer
-from database.connection import Base, engine
+from kafka.producer import close_producer, replay_spooled_messages
+from kafka.state import mirror_pipeline_state, publish_pipeline_state
+from database.data_base import configure_engine
+from database.pool import pool_monitor
 import uvicorn
+from config import config
 from web.app import app
+from web.metrics import metrics_app
+from web.websockets import manager
+from web.fanout import fanout
+from processing.data_processor import flush_compressed_readings, replay_spooled_data
+from processing.spool import db_spool, kafka_spool, run_replayer
+from processing.loop_monitor import loop_monitor
+from processing.rules import rule_engine
+from processing.log_limits import configure_logging
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 logger = logging.getLogger(__name__)
 
+# Роли процесса; в совмещенной роли all компоненты останавливаются по ходу данных
+ROLE_COMPONENTS = {
+    "ingest": ("ingest",),
+    "consumer": ("consumer",),
+    "web": ("web",),
+    "all": ("ingest", "consumer", "web"),
+}
+
+
+async def _serve_until(server: uvicorn.Server, stop: asyncio.Event, on_stop: Optional[Callable[[], None]] = None,
+                       sockets: Optional[List[socket.socket]] = None):
+    """Работа uvicorn-сервера до установки stop; сервер закрывает сокеты и дожидается запросов"""
+    server_task = asyncio.create_task(server.serve(sockets=sockets))
+    stop_task = asyncio.create_task(stop.wait())
+    await asyncio.wait([server_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+    stop_task.cancel()
+    if on_stop is not None:
+        on_stop()
+    server.should_exit = True
+    await server_task
+
 
-async def startup():
-    """Запуск всех компонентов системы"""
+async def _cancel(task: asyncio.Task):
+    """Отмена фоновой задачи (выгрузка спула продолжится при следующем запуске)"""
+    task.cancel()
     try:
-        # Запуск MQTT клиента
-        mqtt_task = asyncio.create_task(mqtt_client())
-
-        # Запуск Kafka консьюмеров
-        consumer_task = await start_consumers()
-
-        # Запуск веб-сервера
-        web_server = uvicorn.Server(
-            uvicorn.Config(
-                app=app,
-                host="0.0.0.0",
-                port=8000,
-                reload=False
-            )
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def _uvicorn_server(application, port: int) -> uvicorn.Server:
+    return uvicorn.Server(
+        uvicorn.Config(
+            app=application,
+            host=config.WEB_HOST,
+            port=port,
+            http=config.WEB_HTTP,
+            reload=False,
+            timeout_graceful_shutdown=int(config.SHUTDOWN_TIMEOUT)
         )
-        web_task = asyncio.create_task(web_server.serve())
+    )
 
-        # Ожидаем завершения всех задач
-        await asyncio.gather(mqtt_task, consumer_task, web_task)
 
-    except Exception as e:
-        logger.error(f"Ошибка запуска системы: {e}")
-    finally:
-        # Закрываем соединения при завершении
-        await close_producer()
-
-
-async def shutdown():
-    """Корректное завершение работы системы"""
-    global tasks
-    
-    # Отменяем все задачи
-    for task in tasks:
-        if not task.done():
-            task.cancel()
-    
-    # Останавливаем WebSocket задачи
-    from web.websockets import manager
-    manager.stop_all_tasks()
-    
-    # Останавливаем MQTT клиент
-    from mqtt.client import stop_mqtt_client
+async def run_ingest(stop: asyncio.Event):
+    """Прием MQTT и отправка в Kafka
+
+    Дренаж: отключение от брокера, отправка принятых сообщений, остановка
+    выгрузки спула Kafka.
+    """
+    kafka_spool.open()
+    mqtt_task = asyncio.create_task(mqtt_client())
+    replayer = asyncio.create_task(run_replayer(kafka_spool, replay_spooled_messages, stop.is_set))
+    await stop.wait()
+
     await stop_mqtt_client()
-    
-    # Закрываем Kafka продюсер
-    await close_producer()
-    
+    await mqtt_task
+    await _cancel(replayer)
+    await kafka_spool.sync()
+    logger.info("Роль ingest остановлена")
+
+
+async def run_consumer(stop: asyncio.Event, publish_state: bool = False):
+    """Обработка сообщений Kafka и запись в БД
+
+    publish_state - публиковать состояние конвейера в памяти для процессов
+    роли web (когда веб-роль работает в других процессах).
+    Дренаж: дообработка текущего сообщения, фиксация смещений, запись
+    удерживаемых компрессором показаний, остановка выгрузки спула БД,
+    последняя публикация состояния.
+    """
+    db_spool.open()
+    await rule_engine.resolve_sensors()
+    consumer_task = await start_consumers(stop)
+    replayer = asyncio.create_task(run_replayer(db_spool, replay_spooled_data, stop.is_set))
+    publisher = asyncio.create_task(publish_pipeline_state(stop)) if publish_state else None
+    await stop.wait()
+
+    await consumer_task
+    await _cancel(replayer)
+    await flush_compressed_readings()
+    await db_spool.sync()
+    if publisher is not None:
+        await publisher
+    logger.info("Роль consumer остановлена")
+
+
+async def run_web(stop: asyncio.Event, sockets: Optional[List[socket.socket]] = None, pipeline_local: bool = True):
+    """Веб-панель, API и WebSocket
+
+    sockets - слушающий сокет, открытый до fork (воркер пред-форка).
+    pipeline_local - в процессе работает компонент consumer; иначе состояние
+    конвейера в памяти (буферы, статистика, задержки) читается из KAFKA_STATE_TOPIC.
+    Дренаж: прекращение приема подключений, остановка задач трансляции,
+    закрытие WebSocket и ожидание выполняющихся запросов.
+    """
+    mirror_stop = asyncio.Event()
+    mirror_task = None if pipeline_local else asyncio.create_task(mirror_pipeline_state(mirror_stop))
+    fanout_task = asyncio.create_task(manager.run_fanout()) if fanout.enabled else None
+
+    def stop_broadcasts():
+        # Сначала обмен с воркерами, чтобы запросы других воркеров не запустили рассылку снова
+        if fanout_task is not None:
+            fanout_task.cancel()
+        manager.stop_all_tasks()
+
+    await _serve_until(_uvicorn_server(app, config.WEB_PORT), stop, on_stop=stop_broadcasts, sockets=sockets)
+    if fanout_task is not None:
+        await _cancel(fanout_task)
+    if mirror_task is not None:
+        mirror_stop.set()
+        await _cancel(mirror_task)
+    logger.info("Роль web остановлена")
+
+
+async def run_metrics(stop: asyncio.Event):
+    """/metrics для процессов без веб-роли"""
+    await _serve_until(_uvicorn_server(metrics_app, config.METRICS_PORT), stop)
+
+
+async def startup(role: str, web_sockets: Optional[List[socket.socket]] = None):
+    """Запуск компонентов роли и их поочередная остановка по сигналу"""
+    components = ROLE_COMPONENTS[role]
+    shutdown_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, shutdown_requested.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt без дренажа
+            pass
+
+    # Пул соединений с параметрами роли; контроль блокировок цикла событий и удержания соединений
+    engine = configure_engine(role)
+    loop_monitor.start()
+    pool_watch = asyncio.create_task(pool_monitor.run(config.DB_LEAK_CHECK_INTERVAL))
+    logger.info(f"Запуск роли {role}: {', '.join(components)}")
+
+    running = []
+    for component in components:
+        stop = asyncio.Event()
+        if component == "ingest":
+            # Сообщения обрабатывает только консьюмер (в роли all - этого же процесса), без двойной записи
+            task = asyncio.create_task(run_ingest(stop))
+        elif component == "consumer":
+            task = asyncio.create_task(run_consumer(stop, publish_state="web" not in components))
+        else:
+            task = asyncio.create_task(run_web(stop, web_sockets, pipeline_local="consumer" in components))
+        running.append((component, stop, task))
+    if "web" not in components and config.METRICS_PORT:
+        stop = asyncio.Event()
+        running.append(("metrics", stop, asyncio.create_task(run_metrics(stop))))
+
+    # Работаем до сигнала или до завершения любого компонента (например, веб-сервер не занял порт)
+    waiter = asyncio.create_task(shutdown_requested.wait())
+    await asyncio.wait([waiter, *(task for _, _, task in running)], return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
+    logger.info("Остановка системы")
+
+    await shutdown(running)
+    await _cancel(pool_watch)
+    await engine.dispose()
     logger.info("Система остановлена")
 
 
+async def shutdown(running):
+    """Корректное завершение работы: дренаж компонентов и закрытие соединений"""
+    for component, stop, task in running:
+        stop.set()
+        try:
+            await asyncio.wait_for(task, timeout=config.SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Компонент {component} не остановился за {config.SHUTDOWN_TIMEOUT} с, задача отменена")
+        except Exception as e:
+            logger.error(f"Ошибка компонента {component}: {e}")
+
+    # Закрываем соединения при завершении
+    await close_producer()
+    kafka_spool.close()
+    db_spool.close()
+    loop_monitor.stop()
+
+
+def _run_worker(index: int, sock: socket.socket):
+    """Дочерний процесс пред-форка: роль web на общем слушающем сокете"""
+    code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Пул соединений воркер создает свой при запуске роли (configure_engine)
+        fanout.bind_worker(index)
+        logger.info(f"Воркер {index} запущен (pid {os.getpid()})")
+        asyncio.run(startup("web", web_sockets=[sock]))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.critical(f"Неожиданная ошибка воркера {index}: {e}")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run_web_workers(workers: int):
+    """Пред-форк роли web: сокет открывается один раз, воркеры принимают подключения с него
+
+    Упавший воркер перезапускается с тем же номером. По SIGTERM/SIGINT сигнал
+    передается воркерам, и родитель ждет, пока каждый завершит свой дренаж.
+    Ответы воркеров не зависят от того, какой из них принял подключение:
+    данные групп рассылки готовит ведущий, состояние конвейера в памяти
+    каждый воркер читает из KAFKA_STATE_TOPIC, сброс кешей передается всем воркерам.
+    """
+    sock = socket.create_server((config.WEB_HOST, config.WEB_PORT), backlog=2048)
+    fanout.prepare(workers)
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def stop_workers(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(index, sock)
+        children[pid] = index
+
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+    logger.info(f"Роль web: {workers} воркеров на {config.WEB_HOST}:{config.WEB_PORT}")
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.error(f"Воркер {index} (pid {pid}) завершился с кодом {os.waitstatus_to_exitcode(status)}, перезапуск")
+        time.sleep(1)
+        if not stopping:
+            spawn(index)
+    sock.close()
+    logger.info("Все воркеры остановлены")
+
+
+def install_event_loop():
+    """Выбор реализации цикла событий до его создания"""
+    if config.EVENT_LOOP == "asyncio":
+        return
+    if uvloop is None:
+        if config.EVENT_LOOP == "uvloop":
+            logger.warning("uvloop не установлен, используется стандартный цикл событий")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Система мониторинга производства ПЭТ бутылок')
+    parser.add_argument('--role', choices=sorted(ROLE_COMPONENTS), default=config.SERVICE_ROLE,
+                        help='Роль процесса (по умолчанию SERVICE_ROLE из конфигурации)')
+    parser.add_argument('--workers', type=int, default=config.WEB_WORKERS,
+                        help='Число пред-форкнутых воркеров роли web (по умолчанию WEB_WORKERS)')
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    configure_logging()
+    args = parse_args()
+    install_event_loop()
     try:
-        # Запуск основного цикла
-        asyncio.run(startup())
+        if args.role == "web" and args.workers > 1 and hasattr(os, "fork"):
+            run_web_workers(args.workers)
+        else:
+            if args.workers > 1:
+                logger.warning("Несколько воркеров поддерживаются только для роли web в Unix, запускается один процесс")
+            asyncio.run(startup(args.role))
     except KeyboardInterrupt:
         logger.info("Получен сигнал завершения работы")
-        asyncio.run(shutdown())
     except Exception as e:
-        logger.critical(f"Неожиданная ошибка: {e}")
\ No newline at end of file
+        logger.critical(f"Неожиданная ошибка: {e}")
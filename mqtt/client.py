@@ -1,13 +1,16 @@
 import paho.mqtt.client as mqtt
 import threading
-import json
 import logging
 import time
 import queue
 import asyncio
 from config import config
+from processing.metrics import registry
+from processing.tracing import tracer
+from processing.log_limits import hot_logger
 
 logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
 
 # Глобальные переменные
 mqtt_client_instance = None
@@ -15,6 +18,11 @@ mqtt_connected = False
 stop_flag = False
 message_queue = queue.Queue()  # Очередь для хранения сообщений
 
+# Метрики приема (счетчики увеличиваются в потоке MQTT-клиента)
+mqtt_messages_received = registry.counter("mqtt_messages_received_total", "Получено сообщений MQTT")
+mqtt_bytes_received = registry.counter("mqtt_bytes_received_total", "Получено байт сообщений MQTT")
+registry.gauge("mqtt_queue_depth", "Сообщений MQTT в очереди на обработку", function=message_queue.qsize)
+
 
 # Определение соответствующего Kafka топика
 def determine_kafka_topic(mqtt_topic):
@@ -38,14 +46,20 @@ def determine_kafka_topic(mqtt_topic):
 # Обработчик сообщений - только помещает в очередь
 def on_message(client, userdata, msg):
     try:
-        payload = msg.payload.decode()
-        logger.debug(f"Получено сообщение от {msg.topic}: {payload}")
-        
-        # Помещаем сообщение в очередь для асинхронной обработки
-        message_queue.put((msg.topic, payload))
+        hot_log.debug("Получено сообщение от %s: %.200r", msg.topic, msg.payload)
+        mqtt_messages_received.inc()
+        mqtt_bytes_received.inc(len(msg.payload))
+        received_ns = time.time_ns()
+        trace = tracer.sample("mqtt.message", received_ns, topic=msg.topic)
+
+        # Помещаем в очередь исходные байты: они разбираются один раз в process_data
+        enqueued_ns = time.time_ns()
+        if trace is not None:
+            trace.add_span("mqtt.receive", received_ns, enqueued_ns, bytes=len(msg.payload))
+        message_queue.put((msg.topic, msg.payload, trace, enqueued_ns))
         
     except Exception as e:
-        logger.error(f"Ошибка обработки MQTT сообщения: {e}")
+        hot_log.error("Ошибка обработки MQTT сообщения: %s", e)
 
 
 # Остальные обработчики MQTT
@@ -95,7 +109,7 @@ def on_disconnect(client, userdata, rc):
 
 
 def on_log(client, userdata, level, buf):
-    logger.debug(f"MQTT лог: {buf}")
+    hot_log.debug("MQTT лог: %s", buf)
 
 
 # Функция для запуска MQTT клиента в отдельном потоке
@@ -155,41 +169,42 @@ def mqtt_client_thread():
         logger.error(f"Ошибка при отключении MQTT клиента: {e}")
 
 
-# Асинхронная функция для обработки сообщений из очереди
-async def process_message_queue():
+async def drain_message_queue():
+    """Отправка в Kafka всех сообщений, накопившихся в очереди
+
+    Обрабатывают сообщения только консьюмеры Kafka (в роли all - консьюмер того
+    же процесса), чтобы каждое показание попадало в БД и буферы один раз.
+    """
     from kafka.producer import produce_message
-    from processing.data_processor import process_data
-    
-    while not stop_flag:
+
+    while not message_queue.empty():
         try:
-            # Проверяем очередь
-            if not message_queue.empty():
+            topic, payload, trace, enqueued_ns = message_queue.get_nowait()
+            if trace is not None:
+                trace.add_span("queue.wait", enqueued_ns, time.time_ns())
+
+            # Определяем топик Kafka
+            kafka_topic = determine_kafka_topic(topic)
+
+            with tracer.activate(trace):
+                # Отправляем в Kafka (при недоступности - в спул)
                 try:
-                    topic, payload = message_queue.get_nowait()
-                    
-                    # Парсим данные
-                    data = json.loads(payload)
-                    
-                    # Определяем топик Kafka
-                    kafka_topic = determine_kafka_topic(topic)
-                    
-                    # Отправляем в Kafka (если доступен)
-                    try:
-                        await produce_message(kafka_topic, data)
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки в Kafka: {e}")
-                    
-                    # Обрабатываем данные напрямую (без Kafka)
-                    try:
-                        await process_data(topic, data)
-                    except Exception as e:
-                        logger.error(f"Ошибка обработки данных: {e}")
-                    
-                except json.JSONDecodeError:
-                    logger.error(f"Ошибка декодирования JSON: {payload}")
+                    with tracer.span("kafka.produce", topic=kafka_topic):
+                        await produce_message(kafka_topic, payload)
                 except Exception as e:
-                    logger.error(f"Ошибка при обработке сообщения из очереди: {e}")
-            
+                    hot_log.error("Ошибка отправки в Kafka: %s", e)
+
+        except Exception as e:
+            hot_log.error("Ошибка при обработке сообщения из очереди: %s", e)
+
+
+# Асинхронная функция для обработки сообщений из очереди
+async def process_message_queue():
+    while not stop_flag:
+        try:
+            # Разбираем все накопившиеся сообщения, прежде чем уступить цикл событий
+            await drain_message_queue()
+
             # Небольшая пауза для экономии ресурсов
             await asyncio.sleep(0.1)
             
@@ -200,6 +215,11 @@ async def process_message_queue():
 
 # Асинхронная функция для запуска MQTT клиента
 async def mqtt_client():
+    """Прием сообщений MQTT до вызова stop_mqtt_client
+
+    При остановке поток клиента отключается от брокера, а уже принятые
+    сообщения дописываются в Kafka (или в спул), прежде чем функция вернется.
+    """
     global stop_flag
 
     # Сбрасываем флаг остановки
@@ -220,19 +240,16 @@ async def mqtt_client():
     except asyncio.CancelledError:
         logger.info("Получен сигнал остановки MQTT клиента")
         stop_flag = True
-
-        # Отменяем обработчик очереди
         queue_processor.cancel()
-        try:
-            await queue_processor
-        except asyncio.CancelledError:
-            pass
-
-        # Ждем завершения потока
-        if thread.is_alive():
-            thread.join(timeout=5)
-
         raise
+    finally:
+        # Ждем отключения потока от брокера: новых сообщений в очереди больше не будет
+        await asyncio.to_thread(thread.join, 5)
+
+    # Сообщения, принятые до отключения, отправляются дальше
+    await queue_processor
+    await drain_message_queue()
+    logger.info("Очередь сообщений MQTT обработана")
 
 
 # Функция для остановки MQTT клиента
@@ -1,89 +1,534 @@
 import logging
-from sqlalchemy import select
-from database.models import EquipmentSetting, Event, Sensor
+import datetime
+from contextlib import AsyncExitStack
+from typing import Dict, Optional, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+import numpy as np
+from database.models import Event
 from database.connection import async_session
+from processing.thresholds import threshold_cache
+from processing.rules import rule_engine, RULE_ALERT_PREFIX
+from processing.live_buffer import live_readings
+from config import config
+from processing.log_limits import hot_logger
 import asyncio
 
 logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
 
+# Тип событий выхода за статические уставки
+ALERT_THRESHOLD = "warning"
 
-async def check_alert_conditions(sensor_id, value, topic=None):
-    """Проверка условий для генерации оповещений"""
+# Состояния оповещения
+STATUS_OPEN = "open"
+STATUS_CLEARED = "cleared"
+
+
+class AlertState:
+    """Состояние оповещения одного типа по одному датчику"""
+
+    __slots__ = ("event_id", "direction", "status", "count", "peak", "last_value", "first_seen", "last_seen",
+                 "flushed_at", "flushed_count", "cleared_at")
+
+    def __init__(self, event_id: int, direction: Optional[str], value: float, timestamp: datetime.datetime):
+        self.event_id = event_id
+        self.direction = direction
+        self.status = STATUS_OPEN
+        self.count = 1
+        self.peak = value
+        self.last_value = value
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.flushed_at = timestamp
+        self.flushed_count = 1
+        self.cleared_at = None
+
+    def record(self, value: float, timestamp: datetime.datetime):
+        """Учет очередного нарушения"""
+        self.count += 1
+        self.last_value = value
+        self.last_seen = timestamp
+        # Пиковое значение - самое удаленное в сторону нарушения
+        if self.direction == "low":
+            self.peak = min(self.peak, value)
+        else:
+            self.peak = max(self.peak, value)
+
+
+class AlertTracker:
+    """Отслеживание открытых оповещений: дедупликация, гистерезис и ограничение частоты записи
+
+    Пока нарушение продолжается, в таблицу событий пишется одна запись,
+    у которой обновляются счетчик и пиковое значение (не чаще update_interval).
+    Повторное нарушение в течение realert_interval после снятия переоткрывает
+    ту же запись вместо создания новой.
+
+    Проверка и создание события по ключу (датчик, тип) выполняются под
+    блокировкой ключа (lock), чтобы параллельные задачи процесса не создали
+    два открытых события. Между процессами дубли исключает частичный
+    уникальный индекс на открытые события: вставка пропускается, и процесс
+    продолжает уже открытое событие.
+    """
+
+    def __init__(self, hysteresis_fraction: float, realert_interval: float, update_interval: float):
+        self.hysteresis_fraction = hysteresis_fraction
+        self.realert_interval = realert_interval
+        self.update_interval = update_interval
+        self.states: Dict[Tuple[int, str], AlertState] = {}
+        self._restored = False
+        self._lock = asyncio.Lock()
+        self._key_locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+
+    def lock(self, key: Tuple[int, str]) -> asyncio.Lock:
+        """Блокировка оповещения (датчик, тип)"""
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        return lock
+
+    async def ensure_restored(self):
+        """Восстановление открытых оповещений из БД после перезапуска"""
+        if self._restored:
+            return
+        async with self._lock:
+            if self._restored:
+                return
+            async with async_session() as session:
+                query = select(Event).where(Event.status == STATUS_OPEN)
+                result = await session.execute(query)
+                for event in result.scalars().all():
+                    value = float(event.peak_value if event.peak_value is not None else event.value or 0)
+                    timestamp = event.last_seen or event.timestamp
+                    state = AlertState(event.id, event.direction, value, timestamp)
+                    state.count = state.flushed_count = event.count or 1
+                    self.states[(event.sensor_id, event.alert_type)] = state
+            self._restored = True
+            logger.info(f"Восстановлено {len(self.states)} открытых оповещений")
+
+    def hysteresis_margin(self, min_value: Optional[float], max_value: Optional[float], limit: float) -> float:
+        """Ширина полосы гистерезиса для снятия оповещения"""
+        if min_value is not None and max_value is not None:
+            return self.hysteresis_fraction * (max_value - min_value)
+        return self.hysteresis_fraction * abs(limit)
+
+
+alert_tracker = AlertTracker(
+    hysteresis_fraction=config.ALERT_HYSTERESIS_FRACTION,
+    realert_interval=config.ALERT_REALERT_INTERVAL,
+    update_interval=config.ALERT_UPDATE_INTERVAL
+)
+
+
+async def _flush_state(session, state: AlertState):
+    """Запись накопленного счетчика и пика в событие"""
+    await session.execute(
+        update(Event).where(Event.id == state.event_id).values(
+            count=state.count,
+            peak_value=state.peak,
+            value=str(state.last_value),
+            last_seen=state.last_seen,
+            status=state.status,
+            cleared_at=state.cleared_at
+        )
+    )
+    state.flushed_at = state.last_seen
+    state.flushed_count = state.count
+
+
+async def _open_event_ids(session, alert_type, sensor_ids) -> Dict[int, int]:
+    """Открытые события типа по датчикам: sensor_id -> id события"""
+    result = await session.execute(
+        select(Event.sensor_id, Event.id).where(
+            Event.alert_type == alert_type, Event.status == STATUS_OPEN, Event.sensor_id.in_(sensor_ids)
+        )
+    )
+    return dict(result.all())
+
+
+async def _adopt_open_event(key, state: AlertState):
+    """Продолжение открытого события, созданного другим процессом (после конфликта уникального индекса)"""
+    async with async_session() as session:
+        event_id = (await _open_event_ids(session, key[1], [key[0]])).get(key[0])
+    if event_id is not None:
+        state.event_id = event_id
+        state.status = STATUS_OPEN
+
+
+def _register_violation(key, value, timestamp, direction):
+    """Учет нарушения в состоянии трекера
+
+    Возвращает (состояние для записи в БД или None, нужно ли создать новое событие).
+    """
+    state = alert_tracker.states.get(key)
+    if state is not None and state.direction == direction:
+        quiet = (timestamp - state.last_seen).total_seconds()
+        recently_cleared = (state.status == STATUS_CLEARED and state.cleared_at is not None
+                            and (timestamp - state.cleared_at).total_seconds() < alert_tracker.realert_interval)
+
+        if state.status == STATUS_OPEN and quiet < alert_tracker.realert_interval:
+            # Продолжающееся нарушение: только счетчик и пик, запись не чаще update_interval
+            state.record(value, timestamp)
+            due = (timestamp - state.flushed_at).total_seconds() >= alert_tracker.update_interval
+            return (state if due else None), False
+
+        if recently_cleared:
+            # Дребезг около уставки: переоткрываем то же событие
+            state.status = STATUS_OPEN
+            state.cleared_at = None
+            state.record(value, timestamp)
+            return state, False
+
+    if state is not None and state.status == STATUS_OPEN:
+        # Предыдущее нарушение закончилось (или сменилось направление) - закрываем его
+        state.status = STATUS_CLEARED
+        state.cleared_at = timestamp
+        return state, True
+    return None, True
+
+
+def _threshold_cleared(state: AlertState, value: float, min_value, max_value) -> bool:
+    """Вернулось ли значение за полосу гистерезиса открытого оповещения об уставке"""
+    if state.direction == "low" and min_value is not None:
+        return value >= min_value + alert_tracker.hysteresis_margin(min_value, max_value, min_value)
+    if state.direction == "high" and max_value is not None:
+        return value <= max_value - alert_tracker.hysteresis_margin(min_value, max_value, max_value)
+    # Уставка, которую нарушало значение, удалена
+    return True
+
+
+async def raise_alert(sensor_id, alert_type, message, value, location_id=None, timestamp=None, direction=None):
+    """Регистрация нарушения с дедупликацией, возвращает True, если создано новое событие"""
+    await alert_tracker.ensure_restored()
+    timestamp = timestamp or datetime.datetime.now()
+    key = (sensor_id, alert_type)
+
+    async with alert_tracker.lock(key), async_session() as session:
+        flush_state = None
+        try:
+            flush_state, create_new = _register_violation(key, value, timestamp, direction)
+            if flush_state is not None:
+                await _flush_state(session, flush_state)
+            if not create_new:
+                if flush_state is not None:
+                    await session.commit()
+                return False
+
+            result = await session.execute(
+                insert(Event).values(
+                    sensor_id=sensor_id,
+                    alert_type=alert_type,
+                    message=message,
+                    location_id=location_id,
+                    value=str(value),
+                    timestamp=timestamp,
+                    count=1,
+                    peak_value=value,
+                    last_seen=timestamp,
+                    status=STATUS_OPEN,
+                    direction=direction
+                ).on_conflict_do_nothing().returning(Event.id)
+            )
+            event_id = result.scalar()
+            created = event_id is not None
+            if not created:
+                # Открытое событие уже создал другой процесс - продолжаем его
+                event_id = (await _open_event_ids(session, alert_type, [sensor_id])).get(sensor_id)
+            alert_tracker.states[key] = AlertState(event_id, direction, value, timestamp)
+            await session.commit()
+            if created:
+                logger.info(f"Создано оповещение: {message}, sensor_id={sensor_id}")
+            return created
+        except IntegrityError as e:
+            await session.rollback()
+            if flush_state is None or flush_state.status != STATUS_OPEN:
+                logger.error(f"Ошибка при сохранении оповещения: {e}")
+                return False
+            # Переоткрыть событие нельзя: другой процесс уже открыл новое
+            await _adopt_open_event(key, flush_state)
+            return False
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Ошибка при сохранении оповещения: {e}")
+            return False
+
+
+async def clear_alert(sensor_id, alert_type, timestamp=None):
+    """Снятие открытого оповещения"""
+    key = (sensor_id, alert_type)
+    async with alert_tracker.lock(key):
+        await _clear_alert(key, timestamp)
+
+
+async def _clear_alert(key, timestamp):
+    sensor_id, alert_type = key
+    state = alert_tracker.states.get(key)
+    if state is None or state.status != STATUS_OPEN:
+        return
+
+    state.status = STATUS_CLEARED
+    state.cleared_at = timestamp or datetime.datetime.now()
     async with async_session() as session:
         try:
-            # Получаем настройки для датчика
-            query = select(EquipmentSetting).where(EquipmentSetting.sensor_id == sensor_id)
-            result = await session.execute(query)
-            setting = result.scalars().first()
+            await _flush_state(session, state)
+            await session.commit()
+            logger.info(f"Оповещение {alert_type} по датчику {sensor_id} снято, нарушений: {state.count}")
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Ошибка при снятии оповещения: {e}")
+
+
+async def settle_alerts(sensor_id, active_types, timestamp):
+    """Снятие оповещений детектора, которые не повторялись дольше realert_interval"""
+    for (state_sensor_id, alert_type), state in list(alert_tracker.states.items()):
+        if state_sensor_id != sensor_id or alert_type == ALERT_THRESHOLD or alert_type in active_types:
+            continue
+        # Оповещения составных правил снимаются самими правилами
+        if alert_type.startswith(RULE_ALERT_PREFIX):
+            continue
+        if state.status == STATUS_OPEN and (timestamp - state.last_seen).total_seconds() >= alert_tracker.realert_interval:
+            await clear_alert(sensor_id, alert_type, timestamp)
+
+
+async def check_alert_conditions(sensor_id, value, topic=None, timestamp=None):
+    """Проверка условий для генерации оповещений"""
+    try:
+        # Получаем настройки для датчика (из кеша, без запроса на каждое показание)
+        setting = await threshold_cache.get(sensor_id)
 
-            if not setting:
-                logger.warning(f"Настройки для датчика {sensor_id} не найдены")
-                return  # Настройки не найдены, выходим
+        if not setting or (setting.min_value is None and setting.max_value is None):
+            hot_log.warning("Настройки для датчика %s не найдены", sensor_id)
+            return  # Настройки не найдены, выходим
 
-            # Список единиц измерения и нечисловых полей, которые нужно пропустить
-            skip_values = ['°C', 'mm', '%', 'bar', 'unit', 'status', 'name', 'description']
+        # Список единиц измерения и нечисловых полей, которые нужно пропустить
+        skip_values = ['°C', 'mm', '%', 'bar', 'unit', 'status', 'name', 'description']
 
-            # Проверяем, не является ли значение единицей измерения
+        # Проверяем, не является ли значение единицей измерения
+        if isinstance(value, str):
+            for skip_value in skip_values:
+                if skip_value in value:
+                    hot_log.debug("Пропускаем проверку для значения %s, содержащего %s", value, skip_value)
+                    return  # Это единица измерения, пропускаем
+
+        # Пытаемся преобразовать к числу
+        try:
+            # Очищаем значение от нечисловых символов, если это строка
             if isinstance(value, str):
-                for skip_value in skip_values:
-                    if skip_value in value:
-                        logger.debug(f"Пропускаем проверку для значения {value}, содержащего {skip_value}")
-                        return  # Это единица измерения, пропускаем
+                # Заменяем запятую на точку для корректного преобразования
+                cleaned_value = value.replace(',', '.')
+                # Оставляем только цифры, точку и знак минуса
+                cleaned_value = ''.join(c for c in cleaned_value if c.isdigit() or c in '.-')
+                numeric_value = float(cleaned_value)
+            else:
+                numeric_value = float(value)
+        except (ValueError, TypeError) as e:
+            hot_log.warning("Ошибка преобразования к числу: %s, value=%.200r", e, value)
+            return
+
+        min_value = setting.min_value
+        max_value = setting.max_value
+
+        # Проверяем условия для оповещения
+        if min_value is not None and numeric_value < min_value:
+            alert_message = f"Значение {numeric_value} ниже допустимого {min_value}"
+            await raise_alert(sensor_id, ALERT_THRESHOLD, alert_message, numeric_value,
+                              setting.location_id, timestamp, direction="low")
+            return
+        if max_value is not None and numeric_value > max_value:
+            alert_message = f"Значение {numeric_value} выше допустимого {max_value}"
+            await raise_alert(sensor_id, ALERT_THRESHOLD, alert_message, numeric_value,
+                              setting.location_id, timestamp, direction="high")
+            return
+
+        hot_log.debug("Значение %s в пределах нормы: мин=%s, макс=%s", numeric_value, min_value, max_value)
+
+        # Снимаем оповещение, только когда значение вернулось за полосу гистерезиса
+        state = alert_tracker.states.get((sensor_id, ALERT_THRESHOLD))
+        if state is not None and state.status == STATUS_OPEN and _threshold_cleared(state, numeric_value,
+                                                                                   min_value, max_value):
+            await clear_alert(sensor_id, ALERT_THRESHOLD, timestamp)
+
+    except Exception as e:
+        hot_log.error("Ошибка при проверке условий оповещения: %s", e)
+
+
+async def check_alert_conditions_batch(sensor_ids, values, timestamps):
+    """Пакетная проверка уставок для массивов (sensor_id, значение, время)
 
-            # Пытаемся преобразовать к числу
+    Уставки берутся индексированием плотных массивов кеша, нарушения
+    вычисляются NumPy за один проход. Через трекер в Python проходят только
+    нарушения и показания датчиков с открытым оповещением, новые события
+    вставляются одним запросом. Возвращает число созданных событий.
+    """
+    sensor_ids = np.asarray(sensor_ids, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if not len(sensor_ids):
+        return 0
+
+    try:
+        await alert_tracker.ensure_restored()
+        min_array, max_array, location_array = await threshold_cache.arrays()
+
+        known = (sensor_ids >= 0) & (sensor_ids < len(min_array))
+        index = np.where(known, sensor_ids, 0)
+        min_values = np.where(known, min_array[index] if len(min_array) else np.nan, np.nan)
+        max_values = np.where(known, max_array[index] if len(max_array) else np.nan, np.nan)
+
+        # Сравнение с NaN дает False, поэтому датчики без уставок не нарушают
+        with np.errstate(invalid="ignore"):
+            low = values < min_values
+            high = values > max_values
+
+        open_sensors = np.fromiter(
+            (key[0] for key, state in alert_tracker.states.items()
+             if key[1] == ALERT_THRESHOLD and state.status == STATUS_OPEN),
+            dtype=np.int64
+        )
+        candidates = np.flatnonzero(low | high | np.isin(sensor_ids, open_sensors))
+    except Exception as e:
+        hot_log.error("Ошибка при пакетной проверке условий оповещения: %s", e)
+        return 0
+
+    # Ключи пакета блокируются в одном порядке, чтобы не пересечься с raise_alert и другими пакетами
+    keys = sorted({(int(sensor_ids[i]), ALERT_THRESHOLD) for i in candidates})
+    async with AsyncExitStack() as stack:
+        for key in keys:
+            await stack.enter_async_context(alert_tracker.lock(key))
+        to_flush = {}
+        # Новые события пакета: состояние -> поля вставки (id назначается после INSERT)
+        pending = {}
+        for i in candidates:
+            sensor_id = int(sensor_ids[i])
+            value = float(values[i])
+            timestamp = timestamps[i]
+            min_value = None if np.isnan(min_values[i]) else float(min_values[i])
+            max_value = None if np.isnan(max_values[i]) else float(max_values[i])
+            key = (sensor_id, ALERT_THRESHOLD)
+
+            if not (low[i] or high[i]):
+                state = alert_tracker.states.get(key)
+                if state is not None and state.status == STATUS_OPEN and _threshold_cleared(state, value,
+                                                                                           min_value, max_value):
+                    state.status = STATUS_CLEARED
+                    state.cleared_at = timestamp
+                    to_flush[id(state)] = state
+                continue
+
+            if low[i]:
+                direction, message = "low", f"Значение {value} ниже допустимого {min_value}"
+            else:
+                direction, message = "high", f"Значение {value} выше допустимого {max_value}"
+
+            flush_state, create_new = _register_violation(key, value, timestamp, direction)
+            if flush_state is not None:
+                to_flush[id(flush_state)] = flush_state
+            if create_new:
+                state = AlertState(None, direction, value, timestamp)
+                alert_tracker.states[key] = state
+                location_id = int(location_array[sensor_ids[i]])
+                pending[id(state)] = (state, {
+                    "sensor_id": sensor_id,
+                    "alert_type": ALERT_THRESHOLD,
+                    "message": message,
+                    "location_id": location_id if location_id >= 0 else None,
+                    "timestamp": timestamp,
+                    "direction": direction
+                })
+
+        if not to_flush and not pending:
+            return 0
+
+        async with async_session() as session:
             try:
-                # Очищаем значение от нечисловых символов, если это строка
-                if isinstance(value, str):
-                    # Заменяем запятую на точку для корректного преобразования
-                    cleaned_value = value.replace(',', '.')
-                    # Оставляем только цифры, точку и знак минуса
-                    cleaned_value = ''.join(c for c in cleaned_value if c.isdigit() or c in '.-')
-                    numeric_value = float(cleaned_value)
-                else:
-                    numeric_value = float(value)
-
-                # Преобразуем граничные значения
-                min_value = float(setting.min_value) if setting.min_value is not None else None
-                max_value = float(setting.max_value) if setting.max_value is not None else None
-
-                alert_triggered = False
-                alert_message = ""
-
-                # Проверяем условия для оповещения
-                if min_value is not None and numeric_value < min_value:
-                    alert_message = f"Значение {numeric_value} ниже допустимого {min_value}"
-                    alert_triggered = True
-                    logger.warning(alert_message)
-                elif max_value is not None and numeric_value > max_value:
-                    alert_message = f"Значение {numeric_value} выше допустимого {max_value}"
-                    alert_triggered = True
-                    logger.warning(alert_message)
-                else:
-                    logger.debug(f"Значение {numeric_value} в пределах нормы: мин={min_value}, макс={max_value}")
-
-                # Если оповещение сработало, создаем запись в таблице событий
-                if alert_triggered:
-                    # Проверка существования датчика
-                    sensor_query = select(Sensor).where(Sensor.id == sensor_id)
-                    sensor_result = await session.execute(sensor_query)
-                    sensor = sensor_result.scalars().first()
-
-                    if sensor:
-                        new_event = Event(
-                            sensor_id=sensor_id,
-                            alert_type="warning",
-                            message=alert_message,
-                            location_id=sensor.location_id,
-                            value=str(numeric_value)
+                created = 0
+                if pending:
+                    opened, cleared = [], []
+                    for state, row in pending.values():
+                        # Событие пакета могло успеть накопить повторы или сняться
+                        row = {
+                            **row,
+                            "value": str(state.last_value),
+                            "count": state.count,
+                            "peak_value": state.peak,
+                            "last_seen": state.last_seen,
+                            "status": state.status,
+                            "cleared_at": state.cleared_at
+                        }
+                        (opened if state.status == STATUS_OPEN else cleared).append((state, row))
+
+                    # Снятые события (у одного датчика их в пакете может быть несколько) уникальный индекс
+                    # не затрагивает: id сопоставляются со строками по порядку вставки
+                    if cleared:
+                        result = await session.execute(
+                            insert(Event).returning(Event.id, sort_by_parameter_order=True), [row for _, row in cleared]
                         )
-                        session.add(new_event)
-                        await session.commit()
-                        logger.info(f"Создано оповещение: {alert_message}, sensor_id={sensor_id}")
-                    else:
-                        logger.warning(f"Датчик с id={sensor_id} не найден при создании оповещения")
+                        for (state, _), event_id in zip(cleared, result.scalars().all()):
+                            state.event_id = event_id
+                        created += len(cleared)
 
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Ошибка преобразования к числу: {e}, value='{value}'")
+                    # Открытое событие у датчика в пакете одно; если другой процесс уже открыл событие,
+                    # вставка пропускается уникальным индексом и продолжается существующее
+                    if opened:
+                        result = await session.execute(
+                            insert(Event).on_conflict_do_nothing().returning(Event.sensor_id, Event.id),
+                            [row for _, row in opened]
+                        )
+                        inserted = dict(result.all())
+                        skipped = [row["sensor_id"] for _, row in opened if row["sensor_id"] not in inserted]
+                        existing = await _open_event_ids(session, ALERT_THRESHOLD, skipped) if skipped else {}
+                        for state, row in opened:
+                            state.event_id = inserted.get(row["sensor_id"], existing.get(row["sensor_id"]))
+                        created += len(inserted)
 
-        except Exception as e:
-            logger.error(f"Ошибка при проверке условий оповещения: {e}")
\ No newline at end of file
+                    for state, _ in pending.values():
+                        state.flushed_at = state.last_seen
+                        state.flushed_count = state.count
+
+                for state in to_flush.values():
+                    if state.event_id is not None:
+                        await _flush_state(session, state)
+                await session.commit()
+                if created:
+                    logger.info(f"Создано оповещений пакетом: {created}")
+                return created
+            except Exception as e:
+                await session.rollback()
+                # Состояния без id не сохранены - убираем их, чтобы следующее нарушение создало событие заново
+                for state, row in pending.values():
+                    key = (row["sensor_id"], ALERT_THRESHOLD)
+                    if alert_tracker.states.get(key) is state:
+                        del alert_tracker.states[key]
+                logger.error(f"Ошибка при пакетном сохранении оповещений: {e}")
+                return 0
+
+
+async def save_anomaly_events(sensor_id, anomalies, location_id=None, timestamp=None):
+    """Сохранение аномалий потокового детектора в таблицу событий (с дедупликацией)"""
+    for anomaly in anomalies:
+        created = await raise_alert(sensor_id, anomaly["alert_type"], anomaly["message"], anomaly["value"],
+                                    location_id, timestamp, direction=anomaly.get("direction"))
+        if created:
+            hot_log.warning("%s, sensor_id=%s", anomaly["message"], sensor_id)
+
+
+async def check_rule_conditions(sensor_id, timestamp):
+    """Вычисление составных правил, в которые входит датчик, после его нового показания"""
+    try:
+        for rule, fired in rule_engine.evaluate_sensor(sensor_id, timestamp):
+            if fired is None:
+                # Нет свежих данных по входам или условие выполняется меньше duration
+                continue
+            if not fired:
+                await clear_alert(rule.sensor_id, rule.alert_type, timestamp)
+                continue
+
+            setting = await threshold_cache.get(rule.sensor_id)
+            location_id = setting.location_id if setting else None
+            last = live_readings.last(rule.sensor_id)
+            value = last[1] if last is not None else None
+            created = await raise_alert(rule.sensor_id, rule.alert_type, rule.message, value, location_id, timestamp)
+            if created:
+                logger.warning(f"Сработало составное правило {rule.name}: {rule.condition}")
+    except Exception as e:
+        hot_log.error("Ошибка при проверке составных правил: %s", e)
@@ -0,0 +1,129 @@
+import logging
+import math
+from typing import Dict, List, Optional
+from processing.statistics import RollingStatistics
+from processing.thresholds import SensorThresholds
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Типы событий детектора (отличаются от "warning" статических уставок)
+ALERT_ZSCORE = "anomaly_zscore"
+ALERT_EWMA = "anomaly_ewma"
+ALERT_CUSUM = "anomaly_cusum"
+ALERT_RATE = "anomaly_rate"
+
+
+class DetectorState:
+    """Состояние контрольных карт одного датчика (постоянный объем памяти)"""
+
+    __slots__ = ("ewma", "cusum_high", "cusum_low")
+
+    def __init__(self):
+        self.ewma = None
+        self.cusum_high = 0.0
+        self.cusum_low = 0.0
+
+
+class AnomalyDetector:
+    """Потоковое обнаружение аномалий по скользящему окну датчика
+
+    Базовая линия (среднее и СКО) берется из скользящей статистики до
+    добавления нового показания, поэтому историю из БД перечитывать не нужно.
+    Проверки: z-оценка отдельного показания (карта Шухарта), EWMA-карта,
+    двусторонний CUSUM и ограничение скорости изменения.
+    """
+
+    def __init__(self, min_samples: int, zscore_limit: float, ewma_lambda: float, ewma_limit: float,
+                 cusum_k: float, cusum_h: float, max_rate_fraction: float):
+        self.min_samples = min_samples
+        self.zscore_limit = zscore_limit
+        self.ewma_lambda = ewma_lambda
+        self.ewma_limit = ewma_limit
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.max_rate_fraction = max_rate_fraction
+        # Ширина EWMA-карты в единицах СКО в установившемся режиме
+        self._ewma_sigma_factor = math.sqrt(ewma_lambda / (2 - ewma_lambda))
+        self._states: Dict[int, DetectorState] = {}
+
+    def check(self, sensor_id: int, timestamp: float, value: float, stats: Optional[RollingStatistics],
+              thresholds: Optional[SensorThresholds] = None) -> List[dict]:
+        """Проверка показания, возвращает список обнаруженных аномалий"""
+        anomalies = []
+        state = self._states.get(sensor_id)
+        if state is None:
+            state = self._states[sensor_id] = DetectorState()
+
+        # Скорость изменения относительно диапазона уставок
+        if (stats is not None and stats.last_time is not None and timestamp > stats.last_time
+                and thresholds is not None and thresholds.range):
+            rate = (value - stats.last_value) / (timestamp - stats.last_time)
+            max_rate = self.max_rate_fraction * thresholds.range
+            if abs(rate) > max_rate:
+                anomalies.append({
+                    "alert_type": ALERT_RATE,
+                    "message": f"Скорость изменения {rate:.3f}/с превышает допустимую {max_rate:.3f}/с",
+                    "value": value,
+                    "direction": "high" if rate > 0 else "low"
+                })
+
+        if stats is None or stats.count < self.min_samples:
+            return anomalies
+
+        mean = stats.mean
+        sigma = stats.stddev
+        if not sigma:
+            return anomalies
+        z = (value - mean) / sigma
+
+        # Карта Шухарта: отдельное показание далеко от среднего окна
+        if abs(z) > self.zscore_limit:
+            anomalies.append({
+                "alert_type": ALERT_ZSCORE,
+                "message": f"Значение {value} отклоняется от среднего {mean:.3f} на {z:.1f} СКО",
+                "value": value,
+                "direction": "high" if z > 0 else "low"
+            })
+
+        # EWMA-карта: устойчивый дрейф, который не выходит за жесткие уставки
+        state.ewma = value if state.ewma is None else self.ewma_lambda * value + (1 - self.ewma_lambda) * state.ewma
+        ewma_limit = self.ewma_limit * sigma * self._ewma_sigma_factor
+        if abs(state.ewma - mean) > ewma_limit:
+            anomalies.append({
+                "alert_type": ALERT_EWMA,
+                "message": f"EWMA {state.ewma:.3f} вышла за контрольные границы {mean:.3f} ± {ewma_limit:.3f}",
+                "value": value,
+                "direction": "high" if state.ewma > mean else "low"
+            })
+
+        # CUSUM: накопленное смещение вверх или вниз
+        state.cusum_high = max(0.0, state.cusum_high + z - self.cusum_k)
+        state.cusum_low = max(0.0, state.cusum_low - z - self.cusum_k)
+        if state.cusum_high > self.cusum_h or state.cusum_low > self.cusum_h:
+            shifted_up = state.cusum_high > self.cusum_h
+            anomalies.append({
+                "alert_type": ALERT_CUSUM,
+                "message": f"CUSUM обнаружил смещение {'вверх' if shifted_up else 'вниз'} от среднего {mean:.3f}",
+                "value": value,
+                "direction": "high" if shifted_up else "low"
+            })
+            # После сигнала накопление начинается заново
+            state.cusum_high = 0.0
+            state.cusum_low = 0.0
+
+        return anomalies
+
+    def reset(self, sensor_id: int):
+        self._states.pop(sensor_id, None)
+
+
+anomaly_detector = AnomalyDetector(
+    min_samples=config.ANOMALY_MIN_SAMPLES,
+    zscore_limit=config.ANOMALY_ZSCORE_LIMIT,
+    ewma_lambda=config.ANOMALY_EWMA_LAMBDA,
+    ewma_limit=config.ANOMALY_EWMA_LIMIT,
+    cusum_k=config.ANOMALY_CUSUM_K,
+    cusum_h=config.ANOMALY_CUSUM_H,
+    max_rate_fraction=config.ANOMALY_MAX_RATE_FRACTION
+)
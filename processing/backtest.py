@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+from typing import AsyncIterator, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.connection import async_session
+from database.models import SensorReading
+from processing.alerts import alert_tracker
+from processing.payload import extract_numeric_value, loads
+from processing.thresholds import threshold_cache
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_stored_value(raw) -> Optional[float]:
+    """Числовое значение из поля SensorReading.value (число или JSON сообщения)"""
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        pass
+    try:
+        data = loads(raw)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(data, dict):
+        value = extract_numeric_value(data)
+        return float(value) if value is not None else None
+    return None
+
+
+async def stream_sensor_values(sensor_id: int, from_time: datetime.datetime, to_time: datetime.datetime,
+                               chunk_size: int, session: Optional[AsyncSession] = None
+                               ) -> AsyncIterator[Tuple[np.ndarray, np.ndarray]]:
+    """Показания датчика за период порциями по chunk_size строк (серверный курсор)
+
+    Отдает пары массивов (время в мс от эпохи, значение), история целиком
+    в память не загружается. session - сессия вызывающего (например, с лимитом
+    времени запросов), иначе открывается своя.
+    """
+    if session is None:
+        async with async_session() as session:
+            async for chunk in stream_sensor_values(sensor_id, from_time, to_time, chunk_size, session):
+                yield chunk
+        return
+
+    query = select(SensorReading.time, SensorReading.value).where(
+        SensorReading.sensor_id == sensor_id,
+        SensorReading.time >= from_time,
+        SensorReading.time <= to_time
+    ).order_by(SensorReading.time).execution_options(yield_per=chunk_size)
+    result = await session.stream(query)
+
+    async for rows in result.partitions(chunk_size):
+        times = []
+        values = []
+        for time, raw in rows:
+            value = parse_stored_value(raw)
+            if value is None or time is None:
+                continue
+            times.append(int(time.timestamp() * 1000))
+            values.append(value)
+        if values:
+            yield np.array(times, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+class ThresholdBacktest:
+    """Повторная проверка уставок по истории с той же логикой, что и у AlertTracker
+
+    Состояние оповещения (триггер Шмитта с полосой гистерезиса) вычисляется
+    векторно для каждой порции; в Python перебираются только границы эпизодов.
+    Эпизоды одного направления, разделенные паузой меньше realert_interval,
+    считаются одним оповещением, как при переоткрытии события.
+    """
+
+    def __init__(self, min_value: Optional[float], max_value: Optional[float],
+                 hysteresis_fraction: float, realert_interval: float, max_alerts: int):
+        self.min_value = min_value
+        self.max_value = max_value
+        if min_value is not None and max_value is not None:
+            margin = hysteresis_fraction * (max_value - min_value)
+            self._clear_low = min_value + margin
+            self._clear_high = max_value - margin
+        else:
+            self._clear_low = min_value + hysteresis_fraction * abs(min_value) if min_value is not None else None
+            self._clear_high = max_value - hysteresis_fraction * abs(max_value) if max_value is not None else None
+        self.realert_ms = realert_interval * 1000
+        self.max_alerts = max_alerts
+
+        self.readings = 0
+        self.violations = 0
+        self.total_alerts = 0
+        self.alerts = []
+        self.by_day = {}
+        # 1 - открыто превышение, -1 - открыто занижение, 0 - нет оповещения
+        self._state = 0
+        self._current = None
+        self._last_time = None
+
+    def _states(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Состояние оповещения после каждого показания порции"""
+        n = len(values)
+        high = values > self.max_value if self.max_value is not None else np.zeros(n, dtype=bool)
+        low = values < self.min_value if self.min_value is not None else np.zeros(n, dtype=bool)
+        upper_band = ~high & (values > self._clear_high) if self._clear_high is not None else np.zeros(n, dtype=bool)
+        lower_band = ~low & (values < self._clear_low) if self._clear_low is not None else np.zeros(n, dtype=bool)
+        holding = upper_band | lower_band
+
+        # Сигнал определен вне полос гистерезиса; в полосе сохраняется предыдущее состояние
+        signal = np.zeros(n + 1, dtype=np.int8)
+        signal[0] = self._state
+        signal[1:][high] = 1
+        signal[1:][low] = -1
+        defined = np.ones(n + 1, dtype=bool)
+        defined[1:] = ~holding
+
+        def forward_fill():
+            index = np.where(defined, np.arange(n + 1), 0)
+            np.maximum.accumulate(index, out=index)
+            return signal[index][1:]
+
+        states = forward_fill()
+        # Полоса гистерезиса у противоположной уставки снимает оповещение
+        opposite = (upper_band & (states == -1)) | (lower_band & (states == 1))
+        if opposite.any():
+            defined[1:][opposite] = True
+            signal[1:][opposite] = 0
+            states = forward_fill()
+        return states, high, low
+
+    def feed(self, times: np.ndarray, values: np.ndarray):
+        """Обработка очередной порции показаний (в порядке времени)"""
+        if not len(values):
+            return
+        states, high, low = self._states(values)
+        self.readings += len(values)
+        self.violations += int(np.count_nonzero(high | low))
+
+        previous = np.empty_like(states)
+        previous[0] = self._state
+        previous[1:] = states[:-1]
+        boundaries = np.flatnonzero(states != previous)
+
+        # Сегменты с постоянным состоянием: [начало, конец)
+        starts = np.concatenate(([0], boundaries)) if len(boundaries) == 0 or boundaries[0] != 0 else boundaries
+        ends = np.append(starts[1:], len(states))
+        for start, end in zip(starts, ends):
+            state = int(states[start])
+            if state == 0:
+                if self._current is not None and self._current["end"] is None:
+                    self._current["end"] = int(times[start])
+                continue
+            segment = values[start:end]
+            segment_violations = int(np.count_nonzero((high | low)[start:end]))
+            peak = float(segment.max() if state == 1 else segment.min())
+            if start == 0 and self._state == state and self._current is not None:
+                # Продолжение эпизода из предыдущей порции
+                self._extend(self._current, segment_violations, peak, state)
+            else:
+                self._open(int(times[start]), state, segment_violations, peak)
+
+        self._state = int(states[-1])
+        self._last_time = int(times[-1])
+
+    def _extend(self, alert: dict, violations: int, peak: float, state: int):
+        alert["count"] += violations
+        alert["peak_value"] = max(alert["peak_value"], peak) if state == 1 else min(alert["peak_value"], peak)
+
+    def _open(self, start_ms: int, state: int, violations: int, peak: float):
+        direction = "high" if state == 1 else "low"
+        current = self._current
+        if current is not None:
+            if current["end"] is None:
+                # Смена направления без возврата в норму закрывает предыдущий эпизод
+                current["end"] = start_ms
+            elif current["direction"] == direction and start_ms - current["end"] < self.realert_ms:
+                # Повтор вскоре после снятия - то же оповещение
+                current["end"] = None
+                self._extend(current, violations, peak, state)
+                return
+
+        self._current = {"start": start_ms, "end": None, "direction": direction,
+                         "count": violations, "peak_value": peak}
+        self.total_alerts += 1
+        day = datetime.datetime.fromtimestamp(start_ms / 1000).date().isoformat()
+        self.by_day[day] = self.by_day.get(day, 0) + 1
+        if len(self.alerts) < self.max_alerts:
+            self.alerts.append(self._current)
+
+    def result(self) -> dict:
+        return {
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "readings": self.readings,
+            "violations": self.violations,
+            "alerts": self.total_alerts,
+            "alerts_by_day": self.by_day,
+            "timeline": [
+                {
+                    "start": datetime.datetime.fromtimestamp(alert["start"] / 1000),
+                    "end": datetime.datetime.fromtimestamp(alert["end"] / 1000) if alert["end"] is not None else None,
+                    "direction": alert["direction"],
+                    "count": alert["count"],
+                    "peak_value": alert["peak_value"]
+                }
+                for alert in self.alerts
+            ],
+            "timeline_truncated": self.total_alerts > len(self.alerts)
+        }
+
+
+async def run_backtest(sensor_id: int, min_value: Optional[float], max_value: Optional[float],
+                       from_time: datetime.datetime, to_time: datetime.datetime,
+                       chunk_size: Optional[int] = None, session: Optional[AsyncSession] = None) -> dict:
+    """Сравнение оповещений по текущим и предлагаемым уставкам за период за один проход по истории
+
+    session - сессия для чтения истории (с лимитом времени запросов вызывающего).
+    """
+    current = await threshold_cache.get(sensor_id)
+    backtests = {
+        "candidate": ThresholdBacktest(min_value, max_value, alert_tracker.hysteresis_fraction,
+                                       alert_tracker.realert_interval, config.BACKTEST_MAX_ALERTS)
+    }
+    if current is not None and (current.min_value is not None or current.max_value is not None):
+        backtests["current"] = ThresholdBacktest(current.min_value, current.max_value,
+                                                 alert_tracker.hysteresis_fraction,
+                                                 alert_tracker.realert_interval, config.BACKTEST_MAX_ALERTS)
+
+    async for times, values in stream_sensor_values(sensor_id, from_time, to_time,
+                                                    chunk_size or config.BACKTEST_CHUNK_SIZE, session):
+        for backtest in backtests.values():
+            backtest.feed(times, values)
+
+    return {
+        "sensor_id": sensor_id,
+        "from_time": from_time,
+        "to_time": to_time,
+        **{name: backtest.result() for name, backtest in backtests.items()}
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Проверка предлагаемых уставок по истории показаний')
+    parser.add_argument('--sensor-id', type=int, required=True, help='Идентификатор датчика')
+    parser.add_argument('--min', type=float, default=None, help='Предлагаемое минимальное значение')
+    parser.add_argument('--max', type=float, default=None, help='Предлагаемое максимальное значение')
+    parser.add_argument('--days', type=float, default=30, help='Глубина истории в днях')
+    parser.add_argument('--chunk-size', type=int, default=config.BACKTEST_CHUNK_SIZE, help='Строк в порции')
+    args = parser.parse_args()
+
+    to_time = datetime.datetime.now()
+    from_time = to_time - datetime.timedelta(days=args.days)
+    result = await run_backtest(args.sensor_id, args.min, args.max, from_time, to_time, args.chunk_size)
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
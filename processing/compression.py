@@ -0,0 +1,242 @@
+import datetime
+import logging
+import math
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import numpy as np
+from processing.thresholds import SensorThresholds
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Способ восстановления значений между сохраненными точками
+INTERPOLATION_LINEAR = "linear"
+INTERPOLATION_PREVIOUS = "previous"
+
+
+class BufferedReading(NamedTuple):
+    """Показание, ожидающее решения о записи в sensor_readings"""
+    time: datetime.datetime
+    value: float
+    payload: str
+    ingest_time: datetime.datetime
+
+    @property
+    def seconds(self) -> float:
+        return self.time.timestamp()
+
+
+class CompressionSettings(NamedTuple):
+    """Параметры сжатия одного датчика"""
+    deadband: float
+    deadband_percent: float
+    deviation: float
+    max_interval: float
+
+    @property
+    def deadband_enabled(self) -> bool:
+        return self.deadband > 0 or self.deadband_percent > 0
+
+    @property
+    def interpolation(self) -> str:
+        # Без допуска swinging door хранятся только ступеньки зоны нечувствительности
+        return INTERPOLATION_LINEAR if self.deviation > 0 or not self.deadband_enabled else INTERPOLATION_PREVIOUS
+
+    @classmethod
+    def for_sensor(cls, thresholds: Optional[SensorThresholds]) -> "CompressionSettings":
+        """Параметры из EquipmentSetting, пропуски заполняются значениями из конфигурации"""
+        deadband = deadband_percent = deviation = max_interval = None
+        if thresholds is not None:
+            deadband = thresholds.deadband
+            deadband_percent = thresholds.deadband_percent
+            deviation = thresholds.compression_deviation
+            max_interval = thresholds.max_interval
+            if deviation is None and thresholds.range:
+                deviation = config.COMPRESSION_DEVIATION_FRACTION * thresholds.range
+        return cls(
+            deadband=deadband if deadband is not None else config.COMPRESSION_DEADBAND,
+            deadband_percent=deadband_percent if deadband_percent is not None else config.COMPRESSION_DEADBAND_PERCENT,
+            deviation=deviation or 0.0,
+            max_interval=max_interval if max_interval is not None else config.COMPRESSION_MAX_INTERVAL
+        )
+
+
+class SensorCompressor:
+    """Сжатие потока одного датчика: отчет по исключению и swinging door
+
+    Сначала зона нечувствительности отбрасывает значения, отличающиеся от
+    последнего переданного меньше чем на deadband (или deadband_percent).
+    Прошедшие значения сжимаются алгоритмом swinging door: точка
+    сохраняется, только когда прямая от последней сохраненной точки уже
+    не может пройти через все промежуточные значения с допуском deviation.
+    Не реже max_interval сохраняется контрольная точка.
+    """
+
+    __slots__ = ("last_reported", "last_received", "archived", "held", "slope_high", "slope_low")
+
+    def __init__(self):
+        self.last_reported: Optional[BufferedReading] = None
+        self.last_received: Optional[BufferedReading] = None
+        self.archived: Optional[BufferedReading] = None
+        self.held: Optional[BufferedReading] = None
+        self.slope_high = math.inf
+        self.slope_low = -math.inf
+
+    def offer(self, reading: BufferedReading, settings: CompressionSettings) -> List[BufferedReading]:
+        """Новое показание, возвращает показания, которые нужно записать"""
+        latest = self.held or self.archived
+        if latest is not None and reading.seconds <= latest.seconds:
+            # Показание не по порядку пишется как есть, состояние не меняется
+            return [reading]
+
+        to_store = []
+        if settings.deadband_enabled and self.last_reported is not None:
+            limit = max(settings.deadband, settings.deadband_percent / 100 * abs(self.last_reported.value))
+            if (abs(reading.value - self.last_reported.value) <= limit
+                    and reading.seconds - self.last_reported.seconds < settings.max_interval):
+                self.last_received = reading
+                return to_store
+            # Перед скачком передаем последнее отброшенное значение, чтобы сохранить фронт
+            if self.last_received is not None and self.last_received is not self.last_reported:
+                to_store.extend(self._swing(self.last_received, settings))
+
+        self.last_reported = self.last_received = reading
+        to_store.extend(self._swing(reading, settings))
+        return to_store
+
+    def state(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def restore(self, state: tuple):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def _reset_door(self, point: BufferedReading, deviation: float):
+        elapsed = point.seconds - self.archived.seconds
+        if elapsed > 0:
+            self.slope_high = (point.value + deviation - self.archived.value) / elapsed
+            self.slope_low = (point.value - deviation - self.archived.value) / elapsed
+        else:
+            self.slope_high = math.inf
+            self.slope_low = -math.inf
+
+    def _swing(self, point: BufferedReading, settings: CompressionSettings) -> List[BufferedReading]:
+        if self.archived is None:
+            self.archived = point
+            return [point]
+        if self.held is None:
+            self.held = point
+            self._reset_door(point, settings.deviation)
+            return []
+
+        elapsed = point.seconds - self.archived.seconds
+        slope_high = min(self.slope_high, (point.value + settings.deviation - self.archived.value) / elapsed)
+        slope_low = max(self.slope_low, (point.value - settings.deviation - self.archived.value) / elapsed)
+
+        if slope_low > slope_high or elapsed >= settings.max_interval:
+            # Дверь открылась (или пора контрольной записи): сохраняем удерживаемую точку
+            stored = self.held
+            self.archived = stored
+            self.held = point
+            self._reset_door(point, settings.deviation)
+            return [stored]
+
+        self.slope_high = slope_high
+        self.slope_low = slope_low
+        self.held = point
+        return []
+
+    def flush(self) -> List[BufferedReading]:
+        """Удерживаемая точка, которая еще не записана"""
+        if self.held is None:
+            return []
+        held = self.held
+        self.archived = held
+        self.held = None
+        self.slope_high = math.inf
+        self.slope_low = -math.inf
+        return [held]
+
+
+class ReadingCompressor:
+    """Сжатие показаний всех датчиков перед записью в sensor_readings"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._sensors: Dict[int, SensorCompressor] = {}
+        self.received = 0
+        self.stored = 0
+
+    def offer(self, sensor_id: int, reading: BufferedReading,
+              thresholds: Optional[SensorThresholds]) -> List[BufferedReading]:
+        self.received += 1
+        if not self.enabled:
+            self.stored += 1
+            return [reading]
+        compressor = self._sensors.get(sensor_id)
+        if compressor is None:
+            compressor = self._sensors[sensor_id] = SensorCompressor()
+        to_store = compressor.offer(reading, CompressionSettings.for_sensor(thresholds))
+        self.stored += len(to_store)
+        return to_store
+
+    def checkpoint(self, sensor_ids: Iterable[int]) -> tuple:
+        """Состояние компрессоров датчиков перед записью
+
+        offer() меняет состояние до фиксации транзакции; если запись не
+        удалась (показание уйдет в спул или на повтор), состояние
+        восстанавливается через restore(), иначе точка, которую вернул
+        offer(), была бы потеряна, а повторное показание - записано как
+        пришедшее не по порядку.
+        """
+        sensors = {sensor_id: self._sensors[sensor_id].state() if sensor_id in self._sensors else None
+                   for sensor_id in set(sensor_ids)}
+        return sensors, self.received, self.stored
+
+    def restore(self, checkpoint: tuple):
+        """Откат состояния к checkpoint() после неудачной записи"""
+        sensors, self.received, self.stored = checkpoint
+        for sensor_id, state in sensors.items():
+            if state is None:
+                self._sensors.pop(sensor_id, None)
+            else:
+                self._sensors.setdefault(sensor_id, SensorCompressor()).restore(state)
+
+    def pending(self, sensor_id: int) -> Optional[BufferedReading]:
+        """Последнее принятое, но еще не записанное показание датчика"""
+        compressor = self._sensors.get(sensor_id)
+        if compressor is None:
+            return None
+        return compressor.held if compressor.held is not None else compressor.last_received
+
+    def flush_all(self) -> Dict[int, List[BufferedReading]]:
+        """Незаписанные точки всех датчиков (при остановке приема)"""
+        flushed = {}
+        for sensor_id, compressor in self._sensors.items():
+            points = compressor.flush()
+            if points:
+                flushed[sensor_id] = points
+        self.stored += sum(len(points) for points in flushed.values())
+        return flushed
+
+    def ratio(self) -> Optional[float]:
+        """Доля записанных показаний"""
+        return self.stored / self.received if self.received else None
+
+
+def interpolate(times: np.ndarray, values: np.ndarray, grid: np.ndarray,
+                mode: str = INTERPOLATION_LINEAR) -> np.ndarray:
+    """Значения на сетке grid по сохраненным точкам (NaN вне диапазона данных)"""
+    result = np.full(len(grid), np.nan)
+    if not len(times):
+        return result
+    inside = (grid >= times[0]) & (grid <= times[-1])
+    if mode == INTERPOLATION_PREVIOUS:
+        positions = np.searchsorted(times, grid[inside], side="right") - 1
+        result[inside] = values[positions]
+    else:
+        result[inside] = np.interp(grid[inside], times, values)
+    return result
+
+
+# Глобальный компрессор конвейера приема
+reading_compressor = ReadingCompressor(enabled=config.COMPRESSION_ENABLED)
@@ -1,33 +1,130 @@
 import asyncio
 import logging
-import json
-from sqlalchemy import select
+import datetime
+import time
+from sqlalchemy import insert, select
 from database.connection import async_session
 from database.models import SensorReading, Sensor, Event, EquipmentSetting
-from processing.alerts import check_alert_conditions
+from processing.alerts import (check_alert_conditions, check_alert_conditions_batch, check_rule_conditions,
+                               save_anomaly_events, settle_alerts)
+from processing.anomaly import anomaly_detector
+from processing.thresholds import threshold_cache
+from config import config
+from processing.live_buffer import live_readings
+from processing.statistics import statistics_engine
+from processing.event_time import parse_timestamp, ingest_lag
+from processing.payload import dumps, payload_decoder
+from processing.spool import DownstreamUnavailable, db_spool, is_unavailable_error
+from processing.metrics import SIZE_BUCKETS, registry
+from processing.tracing import tracer
+from processing.log_limits import hot_logger
+from processing.compression import BufferedReading, reading_compressor
+from mqtt.client import determine_kafka_topic
 
 logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
+
+db_write_seconds = registry.histogram("db_write_seconds", "Время записи показаний в БД (вставка и фиксация)",
+                                      labelnames=("operation",))
+db_write_rows = registry.histogram("db_write_rows", "Строк sensor_readings в одной записи", SIZE_BUCKETS,
+                                   labelnames=("operation",))
+alert_evaluation_seconds = registry.histogram("alert_evaluation_seconds", "Время проверки оповещений",
+                                              labelnames=("kind",))
+
+
+class ProcessingError(Exception):
+    """Сообщение не обработано
+
+    retryable=False - ошибка в самом сообщении (повтор не поможет),
+    иначе ошибку можно попробовать обойти повторной обработкой.
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+async def process_batch(topic, readings):
+    """Обработка пакета показаний: одна вставка в БД и пакетная проверка уставок"""
+    ingest_time = datetime.datetime.now()
+    rows = []
+    skipped = 0
+    for reading in readings:
+        if reading.sensor_id is None:
+            skipped += 1
+            continue
+        rows.append((reading.sensor_id, reading.payload, reading.value, parse_timestamp(reading.timestamp, ingest_time)))
+
+    if skipped:
+        hot_log.warning("Пропущено %d показаний без sensor_id в пакете из топика %s", skipped, topic)
+    if not rows:
+        raise ProcessingError(f"В пакете из топика {topic} нет показаний с sensor_id", retryable=False)
+    if await save_sensor_readings_batch(rows) is None:
+        raise ProcessingError(f"Пакет показаний из топика {topic} не сохранен")
+
+    # Обновляем скользящую статистику этапа производства
+    stage_handler = get_stage_handler(topic)
+    if stage_handler:
+        for sensor_id, _, numeric_value, event_time in rows:
+            if numeric_value is not None:
+                await stage_handler(sensor_id, event_time, numeric_value)
+
+
+async def ingest_data(topic, data):
+    """Обработка сообщения с откладыванием в спул на время недоступности БД
+
+    Пока в спуле есть необработанные сообщения, новые дописываются за ними,
+    чтобы после восстановления БД показания записывались в порядке приема.
+    """
+    if db_spool.pending:
+        await db_spool.append(topic, data if isinstance(data, (bytes, str)) else dumps(data))
+        return
+    try:
+        await process_data(topic, data)
+    except DownstreamUnavailable as e:
+        if not db_spool.enabled:
+            hot_log.error("БД недоступна, сообщение из топика %s потеряно: %s", topic, e)
+            return
+        hot_log.error("БД недоступна, сообщение отложено в спул: %s", e)
+        await db_spool.append(topic, data if isinstance(data, (bytes, str)) else dumps(data))
+
+
+async def replay_spooled_data(records):
+    """Обработка отложенных сообщений, возвращает число обработанных до новой ошибки БД"""
+    for handled, (topic, payload) in enumerate(records):
+        try:
+            await process_data(topic, payload)
+        except DownstreamUnavailable:
+            return handled
+        except ProcessingError as e:
+            # Ошибочное сообщение не должно останавливать выгрузку спула
+            hot_log.error("Отложенное сообщение из топика %s не обработано: %s", topic, e)
+    return len(records)
 
 
 async def process_data(topic, data):
-    """Асинхронная обработка данных, полученных из MQTT/Kafka"""
+    """Асинхронная обработка данных, полученных из MQTT/Kafka
+
+    data - исходные байты сообщения (или уже разобранный объект), разбираются один раз
+    по схеме топика. При недоступности БД выбрасывает DownstreamUnavailable,
+    при прочих ошибках - ProcessingError.
+    """
     try:
-        logger.debug(f"Обработка данных из топика {topic}: {data}")
-
-        # Если данные пришли в виде строки, преобразуем их в словарь
-        if isinstance(data, str):
-            try:
-                data = json.loads(data)
-            except json.JSONDecodeError:
-                logger.error(f"Невозможно преобразовать данные в JSON: {data}")
-                return
-
-        # Проверяем, есть ли в данных идентификатор датчика
-        if "sensor_id" in data:
-            sensor_id = data["sensor_id"]
-        elif "id" in data:
-            sensor_id = data["id"]
-        else:
+        hot_log.debug("Обработка данных из топика %s: %.200r", topic, data)
+
+        try:
+            is_batch, readings = payload_decoder.decode(topic, data)
+        except ValueError:
+            raise ProcessingError(f"Невозможно преобразовать данные в JSON: {data}", retryable=False)
+
+        # Пакет из нескольких показаний (от шлюза или многоканального устройства)
+        if is_batch:
+            await process_batch(topic, readings)
+            return
+
+        reading = readings[0]
+        sensor_id = reading.sensor_id
+        if sensor_id is None:
             # Пытаемся определить датчик из топика
             async with async_session() as session:
                 # Извлекаем последнюю часть топика как имя датчика
@@ -41,100 +138,275 @@ async def process_data(topic, data):
 
                 if sensor:
                     sensor_id = sensor.id
-                    logger.debug(f"Определен sensor_id={sensor_id} из топика {topic}")
+                    hot_log.debug("Определен sensor_id=%s из топика %s", sensor_id, topic)
                 else:
-                    logger.warning(f"Не удалось определить датчик из топика {topic}")
-                    return
+                    raise ProcessingError(f"Не удалось определить датчик из топика {topic}", retryable=False)
 
         # Определяем тип значения для сохранения
-        if isinstance(data, dict):
-            # Извлекаем числовое значение для проверки оповещений
-            numeric_value = None
-
-            # Пытаемся найти числовое значение для оповещений
-            for key in ['value', 'temperature', 'pressure', 'humidity', 'speed', 'level', 'weight', 'flow_rate',
-                        'wall_thickness']:
-                if key in data and isinstance(data[key], (int, float)):
-                    numeric_value = data[key]
-                    break
-
-            # Сохраняем всё как JSON-строку
-            value_to_save = json.dumps(data)
-
-            # Сохраняем показание датчика
-            await save_sensor_reading(sensor_id, value_to_save, numeric_value)
+        if isinstance(reading.data, dict):
+            # Числовое значение для проверки оповещений уже извлечено по схеме топика
+            numeric_value = reading.value
+
+            # Время измерения берется с устройства, время приема хранится отдельно
+            event_time = parse_timestamp(reading.timestamp, datetime.datetime.now())
+
+            # Сохраняем показание датчика (исходный JSON, без повторной сериализации)
+            reading_time = await save_sensor_reading(sensor_id, reading.payload, numeric_value, event_time)
+            if reading_time is None:
+                raise ProcessingError(f"Показание датчика {sensor_id} из топика {topic} не сохранено")
+
+            # Обновляем скользящую статистику этапа производства
+            if numeric_value is not None:
+                stage_handler = get_stage_handler(topic)
+                if stage_handler:
+                    await stage_handler(sensor_id, reading_time, numeric_value)
         else:
             # Если это не словарь, сохраняем как есть
-            await save_sensor_reading(sensor_id, str(data))
+            if await save_sensor_reading(sensor_id, reading.payload) is None:
+                raise ProcessingError(f"Показание датчика {sensor_id} из топика {topic} не сохранено")
 
+    except (DownstreamUnavailable, ProcessingError):
+        raise
     except Exception as e:
-        logger.error(f"Ошибка обработки данных: {e}")
+        if is_unavailable_error(e):
+            raise DownstreamUnavailable(str(e)) from e
+        raise ProcessingError(f"Ошибка обработки данных: {e}") from e
+
 
+async def compress_reading(sensor_id, value, numeric_value, reading_time, ingest_time):
+    """Строки sensor_readings для показания после сжатия (может не быть ни одной)"""
+    if numeric_value is None:
+        # Нечисловые показания не сжимаются
+        return [{"sensor_id": sensor_id, "value": value, "time": reading_time, "ingest_time": ingest_time}]
+    thresholds = await threshold_cache.get(sensor_id)
+    stored = reading_compressor.offer(
+        sensor_id, BufferedReading(reading_time, float(numeric_value), value, ingest_time), thresholds
+    )
+    return [{"sensor_id": sensor_id, "value": point.payload, "time": point.time, "ingest_time": point.ingest_time}
+            for point in stored]
 
-async def save_sensor_reading(sensor_id, value, numeric_value=None):
-    """Сохранение показаний датчика в БД"""
+
+async def flush_compressed_readings():
+    """Запись удерживаемых компрессором показаний (при остановке приема)"""
+    flushed = reading_compressor.flush_all()
+    if not flushed:
+        return
+    async with async_session() as session:
+        try:
+            await session.execute(insert(SensorReading), [
+                {"sensor_id": sensor_id, "value": point.payload, "time": point.time, "ingest_time": point.ingest_time}
+                for sensor_id, points in flushed.items() for point in points
+            ])
+            await session.commit()
+            logger.info(f"Записаны удерживаемые показания {len(flushed)} датчиков")
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Ошибка при записи удерживаемых показаний: {e}")
+
+
+async def save_sensor_reading(sensor_id, value, numeric_value=None, event_time=None):
+    """Сохранение показаний датчика в БД, возвращает время измерения или None при ошибке
+
+    Ошибки подключения к БД передаются вызывающему как DownstreamUnavailable.
+    """
+    # Состояние компрессора откатывается, если показание не записано
+    checkpoint = reading_compressor.checkpoint((sensor_id,))
     async with async_session() as session:
         try:
             # Создаем новую запись показаний датчика
-            new_reading = SensorReading(sensor_id=sensor_id, value=value)
-            session.add(new_reading)
+            ingest_time = datetime.datetime.now()
+            reading_time = event_time or ingest_time
+            rows = await compress_reading(sensor_id, value, numeric_value, reading_time, ingest_time)
+            for row in rows:
+                session.add(SensorReading(**row))
 
             # Проверяем условия для оповещений, только если есть числовое значение
             if numeric_value is not None:
-                await check_alert_conditions(sensor_id, numeric_value)
+                started = time.perf_counter()
+                with tracer.span("alert.evaluate", kind="threshold"):
+                    await check_alert_conditions(sensor_id, numeric_value, timestamp=reading_time)
+                alert_evaluation_seconds.labels("threshold").observe(time.perf_counter() - started)
 
-            await session.commit()
-            logger.debug(f"Сохранено показание датчика: sensor_id={sensor_id}, value={value}")
+            started = time.perf_counter()
+            with tracer.span("db.commit", rows=len(rows)):
+                await session.commit()
+            db_write_seconds.labels("single").observe(time.perf_counter() - started)
+            db_write_rows.labels("single").observe(len(rows))
+            tracer.mark_committed()
+            hot_log.debug("Сохранено показание датчика: sensor_id=%s, value=%.200s", sensor_id, value)
+            ingest_lag.observe(sensor_id, reading_time, ingest_time)
+
+            # Буфер для графиков в реальном времени (без обращения к БД)
+            if numeric_value is not None:
+                live_readings.append(sensor_id, reading_time, numeric_value)
+                # Составные правила читают входы из буферов, поэтому проверяются после добавления
+                started = time.perf_counter()
+                with tracer.span("alert.evaluate", kind="rules"):
+                    await check_rule_conditions(sensor_id, reading_time)
+                alert_evaluation_seconds.labels("rules").observe(time.perf_counter() - started)
+
+            return reading_time
+        except Exception as e:
+            await session.rollback()
+            reading_compressor.restore(checkpoint)
+            if is_unavailable_error(e):
+                raise DownstreamUnavailable(str(e)) from e
+            hot_log.error("Ошибка при сохранении показания датчика: %s", e)
+            return None
+
+
+async def save_sensor_readings_batch(readings):
+    """Пакетное сохранение показаний [(sensor_id, value, numeric_value, event_time), ...]
+
+    Показания вставляются одним запросом, уставки проверяются векторизованно.
+    event_time может быть None - тогда используется время приема.
+    Возвращает время приема или None при ошибке.
+    """
+    if not readings:
+        return None
+    ingest_time = datetime.datetime.now()
+    readings = [(sensor_id, value, numeric_value, event_time or ingest_time)
+                for sensor_id, value, numeric_value, event_time in readings]
+    # Состояние компрессора откатывается, если пакет не записан
+    checkpoint = reading_compressor.checkpoint(sensor_id for sensor_id, _, _, _ in readings)
+    rows = []
+    try:
+        for sensor_id, value, numeric_value, event_time in readings:
+            rows.extend(await compress_reading(sensor_id, value, numeric_value, event_time, ingest_time))
+    except Exception:
+        reading_compressor.restore(checkpoint)
+        raise
+    async with async_session() as session:
+        try:
+            started = time.perf_counter()
+            with tracer.span("db.commit", rows=len(rows)):
+                if rows:
+                    await session.execute(insert(SensorReading), rows)
+                await session.commit()
+            db_write_seconds.labels("batch").observe(time.perf_counter() - started)
+            db_write_rows.labels("batch").observe(len(rows))
+            tracer.mark_committed()
+            hot_log.debug("Сохранено показаний пакетом: %d из %d", len(rows), len(readings))
         except Exception as e:
             await session.rollback()
-            logger.error(f"Ошибка при сохранении показания датчика: {e}")
+            reading_compressor.restore(checkpoint)
+            if is_unavailable_error(e):
+                raise DownstreamUnavailable(str(e)) from e
+            hot_log.error("Ошибка при пакетном сохранении показаний: %s", e)
+            return None
+
+    for sensor_id, _, _, event_time in readings:
+        ingest_lag.observe(sensor_id, event_time, ingest_time)
 
+    numeric = [(sensor_id, numeric_value, event_time)
+               for sensor_id, _, numeric_value, event_time in readings if numeric_value is not None]
+    if numeric:
+        started = time.perf_counter()
+        with tracer.span("alert.evaluate", kind="threshold_batch", readings=len(numeric)):
+            await check_alert_conditions_batch(
+                [sensor_id for sensor_id, _, _ in numeric],
+                [numeric_value for _, numeric_value, _ in numeric],
+                [event_time for _, _, event_time in numeric]
+            )
+        alert_evaluation_seconds.labels("threshold_batch").observe(time.perf_counter() - started)
+        for sensor_id, numeric_value, event_time in numeric:
+            live_readings.append(sensor_id, event_time, numeric_value)
+        latest = {}
+        for sensor_id, _, event_time in numeric:
+            latest[sensor_id] = max(event_time, latest.get(sensor_id, event_time))
+        started = time.perf_counter()
+        with tracer.span("alert.evaluate", kind="rules"):
+            for sensor_id, event_time in latest.items():
+                await check_rule_conditions(sensor_id, event_time)
+        alert_evaluation_seconds.labels("rules").observe(time.perf_counter() - started)
+    return ingest_time
 
-async def process_raw_material_data(data):
+
+async def process_stage_reading(stage, sensor_id, timestamp, value):
+    """Потоковая обработка показания этапа: обнаружение аномалий и скользящая статистика"""
+    stats = statistics_engine.get(sensor_id)
+    if stats is not None and stats.last_time is not None and timestamp.timestamp() < stats.last_time:
+        # Показание не по порядку: детектор последовательный, поэтому только статистика окна
+        late_before = stats.late
+        statistics_engine.update(sensor_id, timestamp, value, stage=stage)
+        if stats.late > late_before:
+            ingest_lag.observe_late(sensor_id)
+        return
+
+    if config.ANOMALY_DETECTION_ENABLED:
+        try:
+            # Детектор сравнивает показание с окном до его добавления
+            thresholds = await threshold_cache.get(sensor_id)
+            anomalies = anomaly_detector.check(
+                sensor_id, timestamp.timestamp(), value, statistics_engine.get(sensor_id), thresholds
+            )
+            if anomalies:
+                location_id = thresholds.location_id if thresholds else None
+                await save_anomaly_events(sensor_id, anomalies, location_id, timestamp)
+            # Снимаем оповещения детектора, которые перестали повторяться
+            await settle_alerts(sensor_id, {anomaly["alert_type"] for anomaly in anomalies}, timestamp)
+        except Exception as e:
+            hot_log.error("Ошибка обнаружения аномалий для датчика %s: %s", sensor_id, e)
+
+    statistics_engine.update(sensor_id, timestamp, value, stage=stage)
+
+
+async def process_raw_material_data(sensor_id, timestamp, value):
     """Обработка данных по сырью"""
     try:
         # Обработка специфичная для сырья
-        logger.debug(f"Обработка данных по сырью: {data}")
-        # Здесь может быть дополнительная логика...
+        await process_stage_reading("raw_material", sensor_id, timestamp, value)
     except Exception as e:
-        logger.error(f"Ошибка обработки данных по сырью: {e}")
+        hot_log.error("Ошибка обработки данных по сырью: %s", e)
 
 
-async def process_bottle_forming_data(data):
+async def process_bottle_forming_data(sensor_id, timestamp, value):
     """Обработка данных по формованию бутылок"""
     try:
         # Обработка специфичная для формования
-        logger.debug(f"Обработка данных по формованию бутылок: {data}")
-        # Здесь может быть дополнительная логика...
+        await process_stage_reading("bottle_forming", sensor_id, timestamp, value)
     except Exception as e:
-        logger.error(f"Ошибка обработки данных по формованию бутылок: {e}")
+        hot_log.error("Ошибка обработки данных по формованию бутылок: %s", e)
 
 
-async def process_cooling_data(data):
+async def process_cooling_data(sensor_id, timestamp, value):
     """Обработка данных по охлаждению"""
     try:
         # Обработка специфичная для охлаждения
-        logger.debug(f"Обработка данных по охлаждению: {data}")
-        # Здесь может быть дополнительная логика...
+        await process_stage_reading("cooling", sensor_id, timestamp, value)
     except Exception as e:
-        logger.error(f"Ошибка обработки данных по охлаждению: {e}")
+        hot_log.error("Ошибка обработки данных по охлаждению: %s", e)
 
 
-async def process_quality_data(data):
+async def process_quality_data(sensor_id, timestamp, value):
     """Обработка данных по контролю качества"""
     try:
         # Обработка специфичная для контроля качества
-        logger.debug(f"Обработка данных по контролю качества: {data}")
-        # Здесь может быть дополнительная логика...
+        await process_stage_reading("quality", sensor_id, timestamp, value)
     except Exception as e:
-        logger.error(f"Ошибка обработки данных по контролю качества: {e}")
+        hot_log.error("Ошибка обработки данных по контролю качества: %s", e)
 
 
-async def process_packaging_data(data):
+async def process_packaging_data(sensor_id, timestamp, value):
     """Обработка данных по упаковке"""
     try:
         # Обработка специфичная для упаковки
-        logger.debug(f"Обработка данных по упаковке: {data}")
-        # Здесь может быть дополнительная логика...
+        await process_stage_reading("packaging", sensor_id, timestamp, value)
     except Exception as e:
-        logger.error(f"Ошибка обработки данных по упаковке: {e}")
\ No newline at end of file
+        hot_log.error("Ошибка обработки данных по упаковке: %s", e)
+
+
+# Обработчики этапов производства по топикам Kafka
+STAGE_HANDLERS = {
+    "raw_material_data": process_raw_material_data,
+    "bottle_forming_data": process_bottle_forming_data,
+    "cooling_data": process_cooling_data,
+    "quality_data": process_quality_data,
+    "packaging_data": process_packaging_data,
+}
+
+
+def get_stage_handler(topic):
+    """Обработчик этапа по топику MQTT или Kafka"""
+    kafka_topic = topic if topic in STAGE_HANDLERS else determine_kafka_topic(topic)
+    return STAGE_HANDLERS.get(kafka_topic)
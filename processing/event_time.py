@@ -0,0 +1,109 @@
+import datetime
+import logging
+from typing import Dict, Optional
+from config import config
+from processing.log_limits import hot_logger
+
+logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
+
+
+def parse_event_time(data: dict, ingest_time: datetime.datetime) -> datetime.datetime:
+    """Время измерения из поля timestamp сообщения"""
+    return parse_timestamp(data.get("timestamp") if isinstance(data, dict) else None, ingest_time)
+
+
+def parse_timestamp(raw, ingest_time: datetime.datetime) -> datetime.datetime:
+    """Время измерения из значения поля timestamp
+
+    Поддерживаются ISO 8601 (с часовым поясом или без) и число секунд или
+    миллисекунд от эпохи. Время приводится к локальному без часового пояса,
+    как остальные колонки БД. При отсутствии, ошибке разбора или сдвиге в
+    будущее больше EVENT_TIME_MAX_SKEW используется время приема.
+    """
+    if raw is None:
+        return ingest_time
+
+    try:
+        if isinstance(raw, (int, float)):
+            # Миллисекунды отличаем по порядку величины
+            event_time = datetime.datetime.fromtimestamp(raw / 1000 if raw > 1e11 else raw)
+        else:
+            event_time = datetime.datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+            if event_time.tzinfo is not None:
+                event_time = event_time.astimezone().replace(tzinfo=None)
+    except (ValueError, OverflowError, OSError) as e:
+        hot_log.debug("Некорректное время измерения %r: %s", raw, e)
+        return ingest_time
+
+    if (event_time - ingest_time).total_seconds() > config.EVENT_TIME_MAX_SKEW:
+        hot_log.debug("Время измерения %s опережает время приема %s", event_time, ingest_time)
+        return ingest_time
+    return event_time
+
+
+class SensorLag:
+    """Задержка доставки показаний одного датчика"""
+
+    __slots__ = ("count", "last", "ewma", "max", "late")
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.ewma = None
+        self.max = 0.0
+        self.late = 0
+
+
+class IngestLagTracker:
+    """Сквозная задержка: время приема минус время измерения на устройстве"""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self._sensors: Dict[int, SensorLag] = {}
+        self.total = SensorLag()
+
+    def _update(self, lag: SensorLag, seconds: float):
+        lag.count += 1
+        lag.last = seconds
+        lag.ewma = seconds if lag.ewma is None else self.alpha * seconds + (1 - self.alpha) * lag.ewma
+        lag.max = max(lag.max, seconds)
+
+    def observe(self, sensor_id: int, event_time: datetime.datetime, ingest_time: datetime.datetime):
+        seconds = (ingest_time - event_time).total_seconds()
+        lag = self._sensors.get(sensor_id)
+        if lag is None:
+            lag = self._sensors[sensor_id] = SensorLag()
+        self._update(lag, seconds)
+        self._update(self.total, seconds)
+
+    def observe_late(self, sensor_id: int):
+        """Учет показания, пришедшего позже водяного знака"""
+        lag = self._sensors.get(sensor_id)
+        if lag is None:
+            lag = self._sensors[sensor_id] = SensorLag()
+        lag.late += 1
+        self.total.late += 1
+
+    @staticmethod
+    def _snapshot(lag: SensorLag) -> dict:
+        return {
+            "count": lag.count,
+            "last_seconds": lag.last,
+            "ewma_seconds": lag.ewma,
+            "max_seconds": lag.max,
+            "late": lag.late
+        }
+
+    def snapshot(self, sensor_id: Optional[int] = None) -> Optional[dict]:
+        if sensor_id is not None:
+            lag = self._sensors.get(sensor_id)
+            return {"sensor_id": sensor_id, **self._snapshot(lag)} if lag is not None else None
+        return {
+            "total": self._snapshot(self.total),
+            "sensors": [{"sensor_id": sensor_id, **self._snapshot(lag)} for sensor_id, lag in self._sensors.items()]
+        }
+
+
+# Глобальная метрика задержки, обновляется при сохранении показаний
+ingest_lag = IngestLagTracker(alpha=config.STATS_EWMA_ALPHA)
@@ -0,0 +1,138 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def to_epoch_ms(timestamp: Union[datetime, int, float]) -> int:
+    """Перевод времени в миллисекунды от эпохи"""
+    if isinstance(timestamp, datetime):
+        return int(timestamp.timestamp() * 1000)
+    return int(timestamp)
+
+
+class SensorRingBuffer:
+    """Кольцевой буфер последних показаний датчика фиксированной емкости
+
+    Время хранится в int64 (мс от эпохи), значения - в float64,
+    поэтому объем памяти на датчик постоянен: 16 байт * capacity.
+    Показания лежат в порядке поступления, а не времени измерения: опоздавшие
+    показания приходят позже более свежих. Для выборки приращений буфер ведет
+    номер последней записи (sequence), растущий с каждым показанием.
+    """
+
+    __slots__ = ("capacity", "times", "values", "sequence", "_head", "_size")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        # Позиция следующей записи и число заполненных ячеек
+        self._head = 0
+        self._size = 0
+        # Число показаний, добавленных за все время
+        self.sequence = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp_ms: int, value: float):
+        """Добавление показания, при заполнении перезаписывается самое старое"""
+        self.times[self._head] = timestamp_ms
+        self.values[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+        self.sequence += 1
+
+    def ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Все показания в порядке поступления"""
+        if self._size < self.capacity:
+            return self.times[:self._size], self.values[:self._size]
+        # Буфер заполнен: самое старое показание находится в позиции head
+        return (
+            np.concatenate((self.times[self._head:], self.times[:self._head])),
+            np.concatenate((self.values[self._head:], self.values[:self._head]))
+        )
+
+    def since(self, since_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Показания со временем не раньше since_ms"""
+        times, values = self.ordered()
+        mask = times >= since_ms
+        return times[mask], values[mask]
+
+    def after(self, sequence: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Показания, добавленные после записи с номером sequence (перезаписанные пропускаются)"""
+        count = min(self.sequence - sequence, self._size)
+        if count <= 0:
+            return self.times[:0], self.values[:0]
+        times, values = self.ordered()
+        return times[-count:], values[-count:]
+
+    def last(self) -> Optional[Tuple[int, float]]:
+        """Последнее показание"""
+        if not self._size:
+            return None
+        position = (self._head - 1) % self.capacity
+        return int(self.times[position]), float(self.values[position])
+
+
+class LiveReadingsStore:
+    """Буферы последних показаний всех датчиков для графиков в реальном времени"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffers: Dict[int, SensorRingBuffer] = {}
+
+    def append(self, sensor_id: int, timestamp: Union[datetime, int, float], value: float):
+        """Добавление показания из конвейера приема данных"""
+        buffer = self._buffers.get(sensor_id)
+        if buffer is None:
+            buffer = self._buffers[sensor_id] = SensorRingBuffer(self.capacity)
+        buffer.append(to_epoch_ms(timestamp), value)
+
+    def window(self, sensor_id: int, minutes: Optional[float] = None,
+               since_ms: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Показания за последние minutes минут или начиная с since_ms"""
+        buffer = self._buffers.get(sensor_id)
+        if buffer is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if since_ms is None:
+            since_ms = to_epoch_ms(datetime.now()) - int(minutes * 60_000) if minutes else 0
+        return buffer.since(since_ms)
+
+    def sequence(self, sensor_id: int) -> int:
+        """Номер последнего добавленного показания датчика (0 - показаний не было)"""
+        buffer = self._buffers.get(sensor_id)
+        return buffer.sequence if buffer is not None else 0
+
+    def appended(self, sensor_id: int, sequence: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Показания, добавленные после sequence, и номер последнего из них
+
+        В отличие от window(since_ms=...) выборка идет по порядку поступления,
+        поэтому опоздавшие показания (со временем раньше уже отправленных)
+        тоже попадают в приращения.
+        """
+        buffer = self._buffers.get(sensor_id)
+        if buffer is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), sequence
+        times, values = buffer.after(sequence)
+        return times, values, buffer.sequence
+
+    def last(self, sensor_id: int) -> Optional[Tuple[int, float]]:
+        buffer = self._buffers.get(sensor_id)
+        return buffer.last() if buffer is not None else None
+
+    def sensor_ids(self) -> List[int]:
+        return list(self._buffers)
+
+    def memory_bytes(self) -> int:
+        """Объем памяти под массивы всех буферов"""
+        return sum(buffer.times.nbytes + buffer.values.nbytes for buffer in self._buffers.values())
+
+
+# Глобальное хранилище, заполняется при сохранении показаний
+live_readings = LiveReadingsStore(capacity=config.LIVE_BUFFER_CAPACITY)
@@ -0,0 +1,73 @@
+import logging
+import random
+import time
+from typing import Dict, List
+from config import config
+
+# Формат записей журнала приложения
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging():
+    """Настройка корневого логгера по LOG_LEVEL (один раз при запуске процесса)"""
+    logging.basicConfig(level=config.LOG_LEVEL.upper(), format=LOG_FORMAT)
+
+
+class HotPathLogger:
+    """Журналирование на участках, выполняемых для каждого сообщения
+
+    Сообщения передаются шаблоном с аргументами (%-форматирование), поэтому
+    строка собирается, только если запись действительно будет выведена.
+    DEBUG дополнительно прореживается с долей sample_rate, а записи
+    остальных уровней ограничиваются: не больше burst записей с одним
+    шаблоном за interval секунд; число пропущенных добавляется к следующей
+    выведенной записи.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float, burst: int, sample_rate: float):
+        self.logger = logger
+        self.interval = interval
+        self.burst = burst
+        self.sample_rate = sample_rate
+        # Шаблон сообщения -> [начало окна, записей в окне, пропущено]
+        self._sites: Dict[str, List[float]] = {}
+
+    def debug(self, msg: str, *args):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        self.logger.debug(msg, *args, stacklevel=2)
+
+    def info(self, msg: str, *args, **kwargs):
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg: str, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg: str, *args, **kwargs):
+        self._log(logging.ERROR, msg, args, kwargs)
+
+    def _log(self, level: int, msg: str, args: tuple, kwargs: dict):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        site = self._sites.get(msg)
+        if site is None or now - site[0] >= self.interval:
+            suppressed = int(site[2]) if site is not None else 0
+            site = self._sites[msg] = [now, 0, 0]
+        else:
+            suppressed = 0
+        if site[1] >= self.burst:
+            site[2] += 1
+            return
+        site[1] += 1
+        if suppressed:
+            msg = f"{msg} (пропущено похожих сообщений: {suppressed})"
+        self.logger.log(level, msg, *args, stacklevel=3, **kwargs)
+
+
+def hot_logger(name: str) -> HotPathLogger:
+    """Логгер горячего пути с параметрами из конфигурации"""
+    return HotPathLogger(logging.getLogger(name), config.LOG_RATE_LIMIT_INTERVAL,
+                         config.LOG_RATE_LIMIT_BURST, config.LOG_DEBUG_SAMPLE_RATE)
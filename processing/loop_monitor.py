@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from config import config
+from processing.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "Задержка пробуждения задачи-зонда цикла событий",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+loop_stalls = registry.counter("event_loop_stalls_total", "Блокировок цикла событий дольше порога")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", code.co_filename)
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def collapse_stack(frame) -> str:
+    """Стек в формате collapsed (корень слева, через ';') для flamegraph"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Stall:
+    """Блокировка цикла событий со стеком в момент обнаружения"""
+
+    __slots__ = ("started", "detected_after", "duration", "stack")
+
+    def __init__(self, started: float, detected_after: float, stack: List[str]):
+        self.started = started
+        self.detected_after = detected_after
+        self.duration = None
+        self.stack = stack
+
+    def to_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "detected_after_seconds": self.detected_after,
+            "duration_seconds": self.duration,
+            "stack": self.stack
+        }
+
+
+class LoopMonitor:
+    """Контроль отзывчивости цикла событий
+
+    Задача-зонд каждые interval секунд засыпает и измеряет опоздание
+    пробуждения. Сторожевой поток следит за отметкой зонда: если цикл не
+    отвечает дольше slow_threshold, снимается стек потока цикла - видно,
+    какой синхронный вызов его держит. Профилировщик по запросу
+    периодически снимает стеки потока цикла из отдельного потока.
+    """
+
+    def __init__(self, interval: float, slow_threshold: float, history_size: int = 50):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.stalls: Deque[Stall] = deque(maxlen=history_size)
+        self.max_lag = 0.0
+        self.last_lag = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._profiling = threading.Lock()
+
+    def start(self):
+        """Запуск зонда и сторожевого потока в текущем цикле событий (повторный вызов ничего не делает)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Мониторинг цикла событий запущен (порог блокировки {self.slow_threshold} с)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _probe(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            self._heartbeat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag_seconds.observe(lag)
+
+    def _loop_frame(self):
+        return sys._current_frames().get(self._loop_thread_id)
+
+    def _watch(self):
+        stall = None
+        heartbeat_at_stall = None
+        while not self._stopped.wait(self.slow_threshold / 2):
+            heartbeat = self._heartbeat
+            silent = time.monotonic() - heartbeat - self.interval
+            if stall is not None and heartbeat != heartbeat_at_stall:
+                # Цикл снова отвечает: фиксируем длительность блокировки
+                stall.duration = heartbeat - heartbeat_at_stall - self.interval
+                logger.warning(f"Цикл событий был заблокирован {stall.duration:.3f} с: "
+                               f"{stall.stack[-1] if stall.stack else '?'}")
+                stall = None
+            if stall is None and silent > self.slow_threshold:
+                frame = self._loop_frame()
+                stack = collapse_stack(frame).split(";") if frame is not None else []
+                stall = Stall(time.time() - silent, silent, stack)
+                heartbeat_at_stall = heartbeat
+                self.stalls.append(stall)
+                loop_stalls.inc()
+
+    def profile(self, seconds: float, sample_interval: float) -> Optional[Dict[str, int]]:
+        """Выборочный профиль потока цикла: {свернутый стек: число выборок}
+
+        Блокирующий вызов, выполняется вне цикла (asyncio.to_thread). Возвращает
+        None, если профилирование уже идет.
+        """
+        if not self._profiling.acquire(blocking=False):
+            return None
+        try:
+            counts: Dict[str, int] = {}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = self._loop_frame()
+                if frame is not None:
+                    stack = collapse_stack(frame)
+                    counts[stack] = counts.get(stack, 0) + 1
+                time.sleep(sample_interval)
+            return counts
+        finally:
+            self._profiling.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "slow_threshold_seconds": self.slow_threshold,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "lag": loop_lag_seconds.snapshot(),
+            "stalls": [stall.to_dict() for stall in reversed(self.stalls)]
+        }
+
+
+def render_collapsed(counts: Dict[str, int]) -> str:
+    """Профиль в текстовом формате collapsed stacks (flamegraph.pl, speedscope)"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+# Глобальный монитор цикла событий, запускается при старте приложения
+loop_monitor = LoopMonitor(interval=config.LOOP_MONITOR_INTERVAL, slow_threshold=config.LOOP_SLOW_CALLBACK_THRESHOLD)
@@ -0,0 +1,252 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Границы корзин по умолчанию: задержки в секундах и размеры пакетов
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как в Prometheus)
+
+    Наблюдение - бинарный поиск корзины и два сложения; значения не хранятся.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Последняя корзина - значения больше верхней границы (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)}
+        }
+
+
+class ThroughputMeter:
+    """Скорость событий за последние window секунд по посекундным корзинам"""
+
+    __slots__ = ("window", "total", "_counts", "_seconds")
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.total = 0
+        self._counts = [0] * window
+        self._seconds = [0] * window
+
+    def mark(self, count: int = 1, now: Optional[float] = None):
+        second = int(now if now is not None else time.time())
+        index = second % self.window
+        if self._seconds[index] != second:
+            self._seconds[index] = second
+            self._counts[index] = 0
+        self._counts[index] += count
+        self.total += count
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """Событий в секунду (текущая неполная секунда не учитывается)"""
+        second = int(now if now is not None else time.time())
+        recent = sum(count for count, moment in zip(self._counts, self._seconds)
+                     if second - self.window <= moment < second)
+        return recent / self.window
+
+
+
+class Counter:
+    """Монотонный счетчик без блокировок
+
+    Каждый поток увеличивает собственную ячейку (поток MQTT-клиента и цикл
+    событий не мешают друг другу), сумма ячеек считается при чтении.
+    """
+
+    __slots__ = ("_local", "_cells")
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells: List[List[float]] = []
+
+    def inc(self, amount: float = 1):
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = self._local.cell = [0]
+            self._cells.append(cell)
+        cell[0] += amount
+
+    @property
+    def value(self) -> float:
+        return sum(cell[0] for cell in list(self._cells))
+
+
+class Gauge:
+    """Текущее значение: задается явно или вычисляется функцией при чтении"""
+
+    __slots__ = ("_value", "function")
+
+    def __init__(self, function: Optional[Callable[[], float]] = None):
+        self._value = 0
+        self.function = function
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def dec(self, amount: float = 1):
+        self._value -= amount
+
+    @property
+    def value(self) -> float:
+        return self.function() if self.function is not None else self._value
+
+
+# Семпл коллектора: (имя метрики, метки, значение)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class MetricFamily:
+    """Метрика с набором меток; дочерние метрики создаются при первом обращении"""
+
+    def __init__(self, kind: str, name: str, documentation: str, labelnames: Sequence[str],
+                 factory: Callable[[], object]):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children: Dict[tuple, object] = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            # setdefault атомарен: при гонке потоков обе стороны получат одну метрику
+            child = self._children.setdefault(values, self.factory())
+        return child
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            if self.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(child.buckets + (math.inf,), child.counts):
+                    cumulative += count
+                    yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+                yield f"{self.name}_sum", labels, child.sum
+                yield f"{self.name}_count", labels, child.count
+            else:
+                yield self.name, labels, child.value
+
+
+class Collector:
+    """Метрики, вычисляемые функцией при каждом чтении (например, отставание по партициям)"""
+
+    def __init__(self, kind: str, name: str, documentation: str, function: Callable[[], Iterable[Sample]]):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self) -> Iterable[Sample]:
+        return self.function()
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """Реестр метрик конвейера в текстовом формате Prometheus
+
+    Модули создают метрики при импорте; без меток возвращается сама
+    метрика, с метками - семейство с методом labels().
+    """
+
+    def __init__(self):
+        self._families: Dict[str, object] = {}
+
+    def _register(self, family):
+        if family.name in self._families:
+            raise ValueError(f"Метрика {family.name} уже зарегистрирована")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        family = self._register(MetricFamily("counter", name, documentation, labelnames, Counter))
+        return family if labelnames else family.labels()
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None):
+        family = self._register(MetricFamily("gauge", name, documentation, labelnames, lambda: Gauge(function)))
+        return family if labelnames else family.labels()
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = ()):
+        family = self._register(MetricFamily("histogram", name, documentation, labelnames,
+                                             lambda: Histogram(buckets)))
+        return family if labelnames else family.labels()
+
+    def collector(self, kind: str, name: str, documentation: str, function: Callable[[], Iterable[Sample]]):
+        self._register(Collector(kind, name, documentation, function))
+
+    def render(self) -> str:
+        lines = []
+        for family in list(self._families.values()):
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in family.samples():
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Тип содержимого ответа /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Глобальный реестр метрик, отдается через /metrics
+registry = MetricsRegistry()
@@ -0,0 +1,165 @@
+import json
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Поля сообщения, в которых передается числовое значение датчика (в порядке приоритета)
+NUMERIC_KEYS = ('value', 'temperature', 'pressure', 'humidity', 'speed', 'level', 'weight', 'flow_rate',
+                'wall_thickness', 'quality_index')
+
+# Схемы топиков: последний сегмент топика -> поля значения.
+# Поля схемы проверяются первыми, затем общий список NUMERIC_KEYS.
+TOPIC_SCHEMAS = {
+    "temperature": ("temperature",),
+    "pressure": ("pressure",),
+    "level": ("level",),
+    "flow": ("flow_rate",),
+    "speed": ("speed",),
+    "weight": ("weight",),
+    "thickness": ("quality_index", "wall_thickness"),
+    "dimensions": ("quality_index",),
+}
+
+
+def loads(raw: Union[bytes, str]):
+    """Разбор JSON (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps(data) -> str:
+    """Сериализация в JSON-строку для хранения"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+
+def extract_numeric_value(data: dict, keys: Tuple[str, ...] = NUMERIC_KEYS):
+    """Числовое значение показания из словаря сообщения или None"""
+    for key in keys:
+        value = data.get(key)
+        # bool - подкласс int, но значением датчика не является
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+    return None
+
+
+def expand_batch(data):
+    """Показания пакетного сообщения или None, если сообщение содержит одно показание
+
+    Поддерживаемые форматы:
+    - массив показаний: [{"sensor_id": 1, "temperature": 20.5, ...}, ...];
+    - конверт {"timestamp": ..., "readings": [...]}: поля конверта - значения по умолчанию для показаний;
+    - устройство с каналами {"device": ..., "timestamp": ..., "channels": {"1": 20.5, "2": {"pressure": 3.1}}}.
+    """
+    if isinstance(data, list):
+        return [reading for reading in data if isinstance(reading, dict)]
+    if not isinstance(data, dict):
+        return None
+
+    if isinstance(data.get("readings"), list):
+        shared = {key: value for key, value in data.items() if key != "readings"}
+        return [{**shared, **reading} for reading in data["readings"] if isinstance(reading, dict)]
+
+    channels = data.get("channels")
+    if isinstance(channels, dict):
+        shared = {key: value for key, value in data.items() if key != "channels"}
+        readings = []
+        for sensor_id, channel in channels.items():
+            reading = dict(shared)
+            if isinstance(channel, dict):
+                reading.update(channel)
+            else:
+                reading["value"] = channel
+            reading["sensor_id"] = sensor_id
+            readings.append(reading)
+        return readings
+
+    return None
+
+
+class DecodedReading(NamedTuple):
+    """Показание, разобранное за один проход"""
+    sensor_id: Optional[int]
+    timestamp: Any
+    value: Optional[float]
+    unit: Optional[str]
+    data: Any  # исходный словарь (или значение, если сообщение не объект)
+    payload: str  # JSON показания для записи в sensor_readings
+
+
+class PayloadDecoder:
+    """Разбор сообщений MQTT/Kafka по схемам топиков
+
+    Набор полей значения для топика вычисляется один раз и кешируется.
+    Исходные байты декодируются ровно один раз; для одиночного показания
+    они же сохраняются в БД без повторной сериализации.
+    """
+
+    def __init__(self, schemas: Dict[str, Tuple[str, ...]]):
+        self.schemas = schemas
+        self._keys_by_topic: Dict[str, Tuple[str, ...]] = {}
+
+    def value_keys(self, topic: str) -> Tuple[str, ...]:
+        keys = self._keys_by_topic.get(topic)
+        if keys is None:
+            schema = ()
+            for segment in reversed(topic.split('/')):
+                if segment in self.schemas:
+                    schema = self.schemas[segment]
+                    break
+            keys = self._keys_by_topic[topic] = schema + tuple(key for key in NUMERIC_KEYS if key not in schema)
+        return keys
+
+    def _reading(self, data, keys: Tuple[str, ...], payload: Optional[str]) -> DecodedReading:
+        if not isinstance(data, dict):
+            return DecodedReading(None, None, None, None, data, payload if payload is not None else str(data))
+
+        sensor_id = data.get("sensor_id", data.get("id"))
+        if sensor_id is not None:
+            try:
+                sensor_id = int(sensor_id)
+            except (TypeError, ValueError):
+                sensor_id = None
+        value = extract_numeric_value(data, keys)
+        return DecodedReading(
+            sensor_id,
+            data.get("timestamp"),
+            float(value) if value is not None else None,
+            data.get("unit"),
+            data,
+            payload if payload is not None else dumps(data)
+        )
+
+    def decode(self, topic: str, message) -> Tuple[bool, List[DecodedReading]]:
+        """Разбор сообщения (байты, строка или уже разобранный объект)
+
+        Возвращает признак пакета и список показаний. ValueError - некорректный JSON.
+        """
+        raw = None
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            message = bytes(message)
+            data = loads(message)
+            raw = message.decode('utf-8')
+        elif isinstance(message, str):
+            raw = message
+            data = loads(raw)
+        else:
+            data = message
+
+        keys = self.value_keys(topic)
+        readings = expand_batch(data)
+        if readings is not None:
+            return True, [self._reading(reading, keys, None) for reading in readings]
+        return False, [self._reading(data, keys, raw)]
+
+
+# Глобальный декодер конвейера приема
+payload_decoder = PayloadDecoder(TOPIC_SCHEMAS)
@@ -0,0 +1,195 @@
+import datetime
+import json
+import os
+import socket
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from config import config
+from kafka.metrics import consumer_metrics
+from processing.event_time import ingest_lag
+from processing.live_buffer import live_readings
+from processing.metrics import Histogram
+from processing.statistics import statistics_engine
+
+# Гистограммы снимка метрик консьюмера (объединяются по корзинам)
+CONSUMER_HISTOGRAMS = ("batch_size", "processing_seconds", "end_to_end_seconds")
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется")
+
+
+def encode_state(message: dict) -> bytes:
+    return json.dumps(message, default=_json_default).encode("utf-8")
+
+
+class PipelineStatePublisher:
+    """Сбор состояния конвейера процесса-консьюмера для публикации веб-роли
+
+    Сообщение содержит приращения буферов последних показаний с прошлой
+    публикации (по номерам записей буферов) и текущие снимки скользящей
+    статистики, задержки доставки и метрик консьюмера.
+    """
+
+    def __init__(self):
+        self.source = f"{socket.gethostname()}:{os.getpid()}"
+        self._sequences: Dict[int, int] = {}
+
+    def collect(self) -> dict:
+        """Сообщение для публикации; номера записей сдвигаются сразу, поэтому
+        при ошибке отправки приращения пропускаются, а не копятся"""
+        live = {}
+        for sensor_id in live_readings.sensor_ids():
+            times, values, sequence = live_readings.appended(sensor_id, self._sequences.get(sensor_id, 0))
+            self._sequences[sensor_id] = sequence
+            if len(times):
+                live[str(sensor_id)] = [times.tolist(), values.tolist()]
+        return {
+            "source": self.source,
+            "time": time.time(),
+            "live": live,
+            "statistics": statistics_engine.snapshot_all(),
+            "lag": ingest_lag.snapshot(),
+            "consumer": consumer_metrics.snapshot()
+        }
+
+
+def _merge_histograms(snapshots: List[dict]) -> dict:
+    """Объединение снимков гистограмм с одинаковыми корзинами"""
+    keys = list(snapshots[0]["buckets"])
+    merged = Histogram(tuple(float(key) for key in keys[:-1]))
+    for snapshot in snapshots:
+        for index, count in enumerate(snapshot["buckets"].values()):
+            merged.counts[index] += count
+        merged.sum += snapshot["sum"]
+        merged.count += snapshot["count"]
+    return {**merged.snapshot(), "buckets": dict(zip(keys, merged.counts))}
+
+
+def _merge_lag(totals: List[dict]) -> dict:
+    """Объединение общих задержек доставки нескольких консьюмеров"""
+    count = sum(total["count"] for total in totals)
+    weighted = [(total["ewma_seconds"], total["count"]) for total in totals if total["ewma_seconds"] is not None]
+    maxima = [total["max_seconds"] for total in totals if total["max_seconds"] is not None]
+    return {
+        "count": count,
+        "last_seconds": totals[-1]["last_seconds"],
+        "ewma_seconds": (sum(value * weight for value, weight in weighted) / sum(weight for _, weight in weighted)
+                         if weighted and sum(weight for _, weight in weighted) else None),
+        "max_seconds": max(maxima) if maxima else None,
+        "late": sum(total["late"] for total in totals)
+    }
+
+
+class PipelineStateMirror:
+    """Состояние конвейера, полученное от консьюмеров (процессы роли web)
+
+    Приращения буферов показаний дописываются в live_readings процесса,
+    поэтому графики и /ws/live работают так же, как в роли all. Снимки
+    статистики, задержки и метрик консьюмера хранятся по источникам и
+    объединяются при чтении; источник, не публиковавший дольше expire
+    секунд, не учитывается.
+    """
+
+    def __init__(self, expire: float):
+        self.expire = expire
+        self.enabled = False
+        self._sources: Dict[str, dict] = {}
+
+    def apply(self, message: dict):
+        for sensor_id, (times, values) in message.get("live", {}).items():
+            for timestamp_ms, value in zip(times, values):
+                live_readings.append(int(sensor_id), timestamp_ms, value)
+        self._sources[message["source"]] = message
+        # Источники перезапущенных консьюмеров (другой pid) больше не публикуют
+        deadline = time.time() - self.expire
+        for source in [source for source, last in self._sources.items() if last["time"] < deadline]:
+            del self._sources[source]
+
+    def _active(self) -> List[dict]:
+        """Свежие сообщения источников, от старых к новым"""
+        deadline = time.time() - self.expire
+        return sorted((message for message in self._sources.values() if message["time"] >= deadline),
+                      key=lambda message: message["time"])
+
+    def statistics(self) -> Dict[int, dict]:
+        merged = {}
+        for message in self._active():
+            for stats in message["statistics"]:
+                merged[stats["sensor_id"]] = stats
+        return merged
+
+    def lag(self) -> Optional[dict]:
+        snapshots = [message["lag"] for message in self._active()]
+        if not snapshots:
+            return None
+        sensors = {}
+        for snapshot in snapshots:
+            for lag in snapshot["sensors"]:
+                sensors[lag["sensor_id"]] = lag
+        total = snapshots[0]["total"] if len(snapshots) == 1 else _merge_lag([s["total"] for s in snapshots])
+        return {"total": total, "sensors": list(sensors.values())}
+
+    def consumer(self) -> Optional[dict]:
+        snapshots = [message["consumer"] for message in self._active()]
+        if len(snapshots) <= 1:
+            return snapshots[0] if snapshots else None
+        # После перебалансировки партиция берется из последнего снимка
+        partitions = {}
+        topics: Dict[str, dict] = {}
+        for snapshot in snapshots:
+            for partition in snapshot["partitions"]:
+                partitions[(partition["topic"], partition["partition"])] = partition
+            for topic, meter in snapshot["topics"].items():
+                total = topics.setdefault(topic, {"messages": 0, "messages_per_second": 0.0})
+                total["messages"] += meter["messages"]
+                total["messages_per_second"] += meter["messages_per_second"]
+        merged = {
+            "group_id": snapshots[-1]["group_id"],
+            "total_lag": sum(partition["lag"] or 0 for partition in partitions.values()),
+            "partitions": [partitions[key] for key in sorted(partitions)],
+            "topics": topics,
+            "retries": sum(snapshot["retries"] for snapshot in snapshots),
+            "dead_letters": sum(snapshot["dead_letters"] for snapshot in snapshots)
+        }
+        for name in CONSUMER_HISTOGRAMS:
+            merged[name] = _merge_histograms([snapshot[name] for snapshot in snapshots])
+        return merged
+
+
+# Заполняется в процессах веб-роли без консьюмера (kafka.state.mirror_pipeline_state)
+pipeline_mirror = PipelineStateMirror(expire=config.PIPELINE_STATE_EXPIRE)
+
+
+def statistics_snapshot(sensor_id: int) -> Optional[dict]:
+    """Скользящая статистика датчика: своя или полученная от консьюмеров"""
+    if not pipeline_mirror.enabled:
+        return statistics_engine.snapshot(sensor_id)
+    return pipeline_mirror.statistics().get(sensor_id)
+
+
+def statistics_snapshot_all() -> list:
+    if not pipeline_mirror.enabled:
+        return statistics_engine.snapshot_all()
+    return list(pipeline_mirror.statistics().values())
+
+
+def lag_snapshot(sensor_id: Optional[int] = None) -> Optional[dict]:
+    """Задержка доставки показаний: своя или полученная от консьюмеров"""
+    snapshot = pipeline_mirror.lag() if pipeline_mirror.enabled else None
+    if snapshot is None:
+        return ingest_lag.snapshot(sensor_id)
+    if sensor_id is None:
+        return snapshot
+    return next((lag for lag in snapshot["sensors"] if lag["sensor_id"] == sensor_id), None)
+
+
+def consumer_snapshot() -> dict:
+    """Метрики консьюмера Kafka: свои или полученные от консьюмеров"""
+    snapshot = pipeline_mirror.consumer() if pipeline_mirror.enabled else None
+    return snapshot if snapshot is not None else consumer_metrics.snapshot()
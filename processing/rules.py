@@ -0,0 +1,327 @@
+import ast
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from sqlalchemy import select
+from config import config, BASE_DIR
+from database.connection import async_session
+from database.models import Sensor
+from processing.live_buffer import live_readings, to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+# Тип событий составных правил: "rule:<имя правила>"
+RULE_ALERT_PREFIX = "rule:"
+
+# Оконные функции: первый аргумент - псевдоним датчика, второй - окно в секундах
+WINDOW_FUNCTIONS = {"last", "avg", "min", "max", "stddev", "delta", "rate", "count"}
+# Обычные функции над значениями выражения
+SCALAR_FUNCTIONS = {"abs": abs}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+    ast.Name, ast.Load, ast.Constant, ast.Call
+)
+
+
+class RuleError(ValueError):
+    """Ошибка в описании составного правила"""
+
+
+class _AliasRewriter(ast.NodeTransformer):
+    """Замена псевдонимов датчиков в аргументах оконных функций на строковые константы"""
+
+    def __init__(self, aliases):
+        self.aliases = aliases
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in WINDOW_FUNCTIONS:
+            if not node.args or not isinstance(node.args[0], ast.Name) or node.args[0].id not in self.aliases:
+                raise RuleError(f"Первым аргументом {node.func.id}() должен быть псевдоним датчика")
+            if len(node.args) > 2 or (len(node.args) < 2 and node.func.id != "last"):
+                raise RuleError(f"{node.func.id}() принимает датчик и окно в секундах")
+            if len(node.args) == 2 and not (isinstance(node.args[1], ast.Constant)
+                                            and isinstance(node.args[1].value, (int, float))):
+                raise RuleError(f"Окно {node.func.id}() должно быть числом секунд")
+            node.args[0] = ast.copy_location(ast.Constant(node.args[0].id), node.args[0])
+            return node
+        return self.generic_visit(node)
+
+
+def _is_name(sensor) -> bool:
+    return isinstance(sensor, str) and not sensor.isdigit()
+
+
+def resolve_sensor(sensor: Union[int, str], sensor_ids: Dict[str, int]) -> int:
+    """id датчика, заданного в правиле числом или именем (Sensor.sensor_name)"""
+    if not _is_name(sensor):
+        return int(sensor)
+    if sensor not in sensor_ids:
+        raise RuleError(f"Датчик '{sensor}' не найден")
+    return sensor_ids[sensor]
+
+
+def compile_condition(condition: str, aliases):
+    """Разбор и проверка условия правила, возвращает объект кода для eval
+
+    Разрешены только арифметика, сравнения, and/or/not, числа, псевдонимы
+    датчиков (последнее значение) и функции из WINDOW_FUNCTIONS и SCALAR_FUNCTIONS.
+    """
+    try:
+        tree = ast.parse(condition, mode="eval")
+    except SyntaxError as e:
+        raise RuleError(f"Синтаксическая ошибка в условии '{condition}': {e.msg}")
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise RuleError(f"Недопустимая конструкция {type(node).__name__} в условии '{condition}'")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise RuleError(f"Недопустимая константа {node.value!r} в условии '{condition}'")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or (node.func.id not in WINDOW_FUNCTIONS
+                                                       and node.func.id not in SCALAR_FUNCTIONS):
+                raise RuleError(f"Неизвестная функция в условии '{condition}'")
+            if node.keywords:
+                raise RuleError(f"Именованные аргументы не поддерживаются: '{condition}'")
+        if isinstance(node, ast.Name) and node.id not in aliases \
+                and node.id not in WINDOW_FUNCTIONS and node.id not in SCALAR_FUNCTIONS:
+            raise RuleError(f"Неизвестный датчик '{node.id}' в условии '{condition}'")
+
+    tree = ast.fix_missing_locations(_AliasRewriter(aliases).visit(tree))
+    return compile(tree, f"<rule: {condition}>", "eval")
+
+
+class CompiledRule:
+    """Составное правило, скомпилированное в объект кода Python"""
+
+    __slots__ = ("name", "message", "sensors", "sensor_id", "condition", "code",
+                 "duration", "max_age", "true_since")
+
+    def __init__(self, name: str, condition: str, sensors: Dict[str, int], message: Optional[str] = None,
+                 sensor_id: Optional[int] = None, duration: float = 0.0, max_age: Optional[float] = None):
+        if not sensors:
+            raise RuleError(f"В правиле {name} не указаны датчики")
+        self.name = name
+        self.message = message or f"Сработало правило {name}: {condition}"
+        self.sensors = {alias: int(sid) for alias, sid in sensors.items()}
+        # Датчик, к которому привязывается событие (по умолчанию первый в списке)
+        self.sensor_id = int(sensor_id) if sensor_id is not None else next(iter(self.sensors.values()))
+        self.condition = condition
+        self.code = compile_condition(condition, self.sensors)
+        self.duration = float(duration)
+        self.max_age = float(max_age if max_age is not None else config.ALERT_RULE_MAX_AGE)
+        # Момент (мс), с которого условие непрерывно выполняется
+        self.true_since = None
+
+    @property
+    def alert_type(self) -> str:
+        return f"{RULE_ALERT_PREFIX}{self.name}"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CompiledRule":
+        try:
+            return cls(
+                name=data["name"],
+                condition=data["condition"],
+                sensors=data["sensors"],
+                message=data.get("message"),
+                sensor_id=data.get("sensor_id"),
+                duration=data.get("duration", 0.0),
+                max_age=data.get("max_age")
+            )
+        except KeyError as e:
+            raise RuleError(f"В правиле не указано поле {e}")
+
+
+class _WindowContext:
+    """Значения оконных функций для одного вычисления правила"""
+
+    __slots__ = ("rule", "now_ms", "_windows")
+
+    def __init__(self, rule: CompiledRule, now_ms: int):
+        self.rule = rule
+        self.now_ms = now_ms
+        self._windows = {}
+
+    def _window(self, alias: str, seconds: float):
+        key = (alias, seconds)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = live_readings.window(
+                self.rule.sensors[alias], since_ms=self.now_ms - int(seconds * 1000)
+            )
+        return window
+
+    def last(self, alias, seconds=0.0):
+        last = live_readings.last(self.rule.sensors[alias])
+        return last[1] if last is not None else math.nan
+
+    def avg(self, alias, seconds):
+        _, values = self._window(alias, seconds)
+        return float(values.mean()) if len(values) else math.nan
+
+    def min(self, alias, seconds):
+        _, values = self._window(alias, seconds)
+        return float(values.min()) if len(values) else math.nan
+
+    def max(self, alias, seconds):
+        _, values = self._window(alias, seconds)
+        return float(values.max()) if len(values) else math.nan
+
+    def stddev(self, alias, seconds):
+        _, values = self._window(alias, seconds)
+        return float(values.std(ddof=1)) if len(values) > 1 else math.nan
+
+    def count(self, alias, seconds):
+        return len(self._window(alias, seconds)[1])
+
+    def delta(self, alias, seconds):
+        _, values = self._window(alias, seconds)
+        return float(values[-1] - values[0]) if len(values) > 1 else math.nan
+
+    def rate(self, alias, seconds):
+        """Наклон линейной регрессии по окну, единиц в секунду"""
+        times, values = self._window(alias, seconds)
+        if len(values) < 2:
+            return math.nan
+        t = (times - times[0]) / 1000.0
+        t_centered = t - t.mean()
+        denominator = float(np.dot(t_centered, t_centered))
+        if not denominator:
+            return math.nan
+        return float(np.dot(t_centered, values - values.mean())) / denominator
+
+    def namespace(self) -> dict:
+        namespace = {"__builtins__": {}, **SCALAR_FUNCTIONS}
+        for name in WINDOW_FUNCTIONS:
+            namespace[name] = getattr(self, name)
+        for alias in self.rule.sensors:
+            namespace[alias] = self.last(alias)
+        return namespace
+
+
+class RuleEngine:
+    """Составные правила по нескольким датчикам
+
+    Правила компилируются один раз при загрузке, а индекс зависимостей
+    (датчик -> правила) позволяет при каждом показании вычислять только
+    правила, в которые входит этот датчик. Данные берутся из кольцевых
+    буферов последних показаний, без обращения к БД.
+
+    Датчики в описаниях задаются именем (Sensor.sensor_name) или id. Имена
+    разрешаются в id по таблице датчиков (resolve_sensors); до этого правила
+    с именами не загружаются.
+    """
+
+    def __init__(self):
+        self.rules: Dict[str, CompiledRule] = {}
+        self._by_sensor: Dict[int, List[CompiledRule]] = {}
+        self.definitions: List[dict] = []
+
+    def load(self, definitions: List[dict], sensor_ids: Optional[Dict[str, int]] = None):
+        """Компиляция правил и построение индекса зависимостей
+
+        sensor_ids - id датчиков по именам; без него правила с именами датчиков откладываются.
+        """
+        self.definitions = definitions
+        rules = {}
+        deferred = 0
+        for definition in definitions:
+            try:
+                sensors = definition.get("sensors") or {}
+                if sensor_ids is None and (any(map(_is_name, sensors.values()))
+                                           or _is_name(definition.get("sensor_id"))):
+                    deferred += 1
+                    continue
+                resolved = {**definition, "sensors": {alias: resolve_sensor(sensor, sensor_ids)
+                                                      for alias, sensor in sensors.items()}}
+                if definition.get("sensor_id") is not None:
+                    resolved["sensor_id"] = resolve_sensor(definition["sensor_id"], sensor_ids)
+                rule = CompiledRule.from_dict(resolved)
+            except (RuleError, TypeError, ValueError, AttributeError) as e:
+                logger.error(f"Правило {definition.get('name', '?')} пропущено: {e}")
+                continue
+            rules[rule.name] = rule
+
+        by_sensor = {}
+        for rule in rules.values():
+            for sensor_id in set(rule.sensors.values()):
+                by_sensor.setdefault(sensor_id, []).append(rule)
+
+        self.rules = rules
+        self._by_sensor = by_sensor
+        if deferred:
+            logger.info(f"Загружено составных правил: {len(rules)}, ожидают разрешения имен датчиков: {deferred}")
+        else:
+            logger.info(f"Загружено составных правил: {len(rules)}")
+
+    async def resolve_sensors(self):
+        """Разрешение имен датчиков правил по таблице датчиков и перезагрузка правил"""
+        try:
+            async with async_session() as session:
+                result = await session.execute(select(Sensor.sensor_name, Sensor.id))
+                sensor_ids = dict(result.all())
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке датчиков для составных правил: {e}")
+            return
+        self.load(self.definitions, sensor_ids)
+
+    def load_file(self, path: Path):
+        """Загрузка правил из JSON-файла (список описаний правил)"""
+        if not path.exists():
+            logger.info(f"Файл составных правил {path} не найден, правила не загружены")
+            self.load([])
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                definitions = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Ошибка чтения файла правил {path}: {e}")
+            return
+        self.load(definitions)
+
+    def rules_for(self, sensor_id: int) -> List[CompiledRule]:
+        return self._by_sensor.get(sensor_id, [])
+
+    def evaluate(self, rule: CompiledRule, now_ms: int) -> Optional[bool]:
+        """Вычисление правила: True - сработало, False - не выполняется, None - нет свежих данных или
+        условие выполняется меньше duration"""
+        # Все входные датчики должны иметь свежие показания
+        for sensor_id in rule.sensors.values():
+            last = live_readings.last(sensor_id)
+            if last is None or now_ms - last[0] > rule.max_age * 1000:
+                rule.true_since = None
+                return None
+
+        context = _WindowContext(rule, now_ms)
+        try:
+            result = bool(eval(rule.code, context.namespace()))
+        except (ArithmeticError, TypeError, ValueError) as e:
+            logger.debug(f"Правило {rule.name} не вычислено: {e}")
+            return None
+
+        if not result:
+            rule.true_since = None
+            return False
+        if rule.true_since is None:
+            rule.true_since = now_ms
+        if now_ms - rule.true_since < rule.duration * 1000:
+            return None
+        return True
+
+    def evaluate_sensor(self, sensor_id: int, timestamp) -> List[Tuple[CompiledRule, Optional[bool]]]:
+        """Вычисление правил, зависящих от датчика, после его нового показания"""
+        rules = self._by_sensor.get(sensor_id)
+        if not rules:
+            return []
+        now_ms = to_epoch_ms(timestamp)
+        return [(rule, self.evaluate(rule, now_ms)) for rule in rules]
+
+
+rule_engine = RuleEngine()
+rule_engine.load_file(BASE_DIR / config.ALERT_RULES_FILE)
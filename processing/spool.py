@@ -0,0 +1,335 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from config import config, BASE_DIR
+from processing.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Заголовок записи: длина сообщения, CRC32 (топик + сообщение), длина топика
+_HEADER = struct.Struct("<IIH")
+_SEGMENT_SUFFIX = ".seg"
+_CHECKPOINT_FILE = "checkpoint"
+
+# Обработчик воспроизведения: получает порцию (топик, сообщение) и возвращает число
+# успешно переданных записей; меньше длины порции - получатель снова недоступен
+ReplayHandler = Callable[[List[Tuple[str, bytes]]], Awaitable[int]]
+
+
+class DownstreamUnavailable(Exception):
+    """Получатель данных (БД или Kafka) недоступен, сообщение нужно отложить"""
+
+
+def is_unavailable_error(error: BaseException) -> bool:
+    """Ошибка связана с недоступностью БД, а не с содержимым сообщения"""
+    if isinstance(error, DownstreamUnavailable):
+        return True
+    if isinstance(error, (OperationalError, InterfaceError)):
+        return True
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+class DiskSpool:
+    """Локальная очередь сообщений на диске на время недоступности получателя
+
+    Сообщения дописываются в сегментные файлы фиксированного размера; fsync
+    выполняется пачкой - по числу записей или по времени. Воспроизведение
+    читает сегменты через mmap и хранит позицию в файле checkpoint, так что
+    после перезапуска передаются только неотправленные записи. Полностью
+    переданные сегменты удаляются. В памяти хранятся только позиции, объем
+    на диске ограничен max_bytes (при переполнении теряются старейшие сегменты).
+
+    Каталог открывается не при создании объекта, а в роли, которая пользуется
+    спулом (open()), чтобы процессы других ролей не создавали в нем сегменты.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int, max_bytes: int,
+                 fsync_batch: int, fsync_interval: float, enabled: bool = True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.enabled = enabled
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped_segments = 0
+        self._file = None
+        self._write_seq = 0
+        self._write_offset = 0
+        self._read_seq = 0
+        self._read_offset = 0
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def open(self):
+        """Открытие каталога спула (повторный вызов ничего не делает)"""
+        if self._file is not None or not self.enabled:
+            return
+        try:
+            self._open()
+        except OSError as e:
+            logger.error(f"Ошибка открытия спула {self.directory}, сообщения не будут откладываться: {e}")
+            self.enabled = False
+
+    def _segment_path(self, seq: int) -> Path:
+        return self.directory / f"{seq:010d}{_SEGMENT_SUFFIX}"
+
+    def _segments(self) -> List[int]:
+        return sorted(int(path.stem) for path in self.directory.glob(f"*{_SEGMENT_SUFFIX}"))
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = self._segments()
+
+        checkpoint = self.directory / _CHECKPOINT_FILE
+        if checkpoint.exists():
+            seq, offset = checkpoint.read_text().split()
+            self._read_seq, self._read_offset = int(seq), int(offset)
+        elif segments:
+            self._read_seq, self._read_offset = segments[0], 0
+        if segments and self._read_seq < segments[0]:
+            self._read_seq, self._read_offset = segments[0], 0
+
+        # После перезапуска запись всегда идет в новый сегмент: хвост старого мог оборваться
+        self._write_seq = max(segments[-1] + 1 if segments else 0, self._read_seq)
+        self._open_segment(self._write_seq)
+        if not segments:
+            self._read_seq, self._read_offset = self._write_seq, 0
+
+        if self.pending:
+            logger.info(f"Спул {self.directory}: есть неотправленные данные, "
+                        f"{self.backlog_bytes()} байт в {len(segments)} сегментах")
+
+    def _open_segment(self, seq: int):
+        # Без буферизации Python: записанное сразу видно при чтении через mmap
+        self._file = open(self._segment_path(seq), "ab", buffering=0)
+        self._write_seq = seq
+        self._write_offset = self._file.tell()
+
+    @property
+    def pending(self) -> bool:
+        """Есть записи, которые еще не переданы получателю"""
+        return self._file is not None and (self._read_seq, self._read_offset) < (self._write_seq, self._write_offset)
+
+    def backlog_bytes(self) -> int:
+        """Объем неотправленных данных на диске"""
+        total = 0
+        for seq in self._segments():
+            if seq >= self._read_seq:
+                total += self._segment_path(seq).stat().st_size
+        return max(total - self._read_offset, 0)
+
+    @staticmethod
+    def _encode(topic: str, payload: Union[bytes, str]) -> bytes:
+        topic_bytes = topic.encode("utf-8")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        body = topic_bytes + payload
+        return _HEADER.pack(len(payload), zlib.crc32(body), len(topic_bytes)) + body
+
+    async def append(self, topic: str, payload: Union[bytes, str]):
+        """Дописать сообщение в спул"""
+        record = self._encode(topic, payload)
+        self.open()
+        if self._file is None:
+            return
+        async with self._lock:
+            if self._write_offset and self._write_offset + len(record) > self.segment_bytes:
+                self._rotate()
+            self._file.write(record)
+            self._write_offset += len(record)
+            self._unsynced += 1
+            self.appended += 1
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._synced_at >= self.fsync_interval:
+                await self._fsync()
+
+    async def _fsync(self):
+        if self._unsynced:
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+            self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    async def sync(self):
+        """Сброс на диск записей, ожидающих fsync"""
+        if self._file is None:
+            return
+        async with self._lock:
+            await self._fsync()
+
+    def _rotate(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._file.close()
+        self._open_segment(self._write_seq + 1)
+
+    def _save_checkpoint(self):
+        checkpoint = self.directory / _CHECKPOINT_FILE
+        temporary = checkpoint.with_suffix(".tmp")
+        temporary.write_text(f"{self._read_seq} {self._read_offset}")
+        os.replace(temporary, checkpoint)
+
+    def _read_records(self, seq: int, offset: int, limit: int) -> Tuple[List[Tuple[str, bytes, int]], bool]:
+        """Записи сегмента начиная с offset: ([(топик, сообщение, конец записи)], хвост поврежден)"""
+        path = self._segment_path(seq)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return [], False
+        if offset >= size:
+            return [], False
+
+        records = []
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset < size and len(records) < limit:
+                if offset + _HEADER.size > size:
+                    return records, True
+                length, crc, topic_length = _HEADER.unpack_from(data, offset)
+                start = offset + _HEADER.size
+                end = start + topic_length + length
+                if end > size or zlib.crc32(data[start:end]) != crc:
+                    return records, True
+                records.append((data[start:start + topic_length].decode("utf-8"), data[start + topic_length:end], end))
+                offset = end
+        return records, False
+
+    async def replay(self, handler: ReplayHandler, batch_size: int) -> bool:
+        """Передача отложенных записей получателю порциями
+
+        Возвращает True, если спул опустошен, и False, если получатель снова
+        недоступен (позиция сохраняется, передача продолжится с того же места).
+        """
+        while self.enabled:
+            records, torn = self._read_records(self._read_seq, self._read_offset, batch_size)
+            if records:
+                try:
+                    handled = await handler([(topic, payload) for topic, payload, _ in records])
+                except Exception as e:
+                    logger.warning(f"Спул {self.directory}: получатель недоступен: {e}")
+                    handled = 0
+                if handled:
+                    # Позиция сразу после последней переданной записи
+                    self._read_offset = records[handled - 1][2]
+                    self.replayed += handled
+                    self._save_checkpoint()
+                if handled < len(records):
+                    return False
+                continue
+
+            if self._read_seq >= self._write_seq:
+                # Активный сегмент прочитан до конца
+                return True
+            if torn:
+                logger.warning(f"Спул {self.directory}: поврежден хвост сегмента {self._read_seq}, "
+                               f"позиция {self._read_offset}")
+            # Сегмент передан полностью - удаляем и переходим к следующему
+            finished = self._read_seq
+            later = [seq for seq in self._segments() if seq > finished]
+            self._read_seq, self._read_offset = (later[0] if later else self._write_seq), 0
+            self._save_checkpoint()
+            self._segment_path(finished).unlink(missing_ok=True)
+        return True
+
+    def enforce_limit(self):
+        """Удаление старейших неотправленных сегментов сверх max_bytes
+
+        Вызывается между проходами воспроизведения, пока получатель недоступен.
+        """
+        if self._file is None:
+            return
+        segments = [seq for seq in self._segments() if seq < self._write_seq]
+        total = sum(self._segment_path(seq).stat().st_size for seq in self._segments())
+        for seq in segments:
+            if total <= self.max_bytes:
+                break
+            path = self._segment_path(seq)
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+            self.dropped_segments += 1
+            logger.error(f"Спул {self.directory} переполнен, удален неотправленный сегмент {seq}")
+            if seq >= self._read_seq:
+                later = [s for s in self._segments() if s > seq]
+                self._read_seq, self._read_offset = (later[0] if later else self._write_seq), 0
+                self._save_checkpoint()
+
+    def close(self):
+        """Сброс на диск и закрытие активного сегмента"""
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._unsynced = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": self.pending,
+            "backlog_bytes": self.backlog_bytes() if self._file is not None else 0,
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "dropped_segments": self.dropped_segments
+        }
+
+
+async def run_replayer(spool: DiskSpool, handler: ReplayHandler, stop: Optional[Callable[[], bool]] = None):
+    """Фоновая передача спула: быстрая выгрузка после восстановления получателя
+
+    Пока получатель недоступен, попытки повторяются раз в SPOOL_RETRY_INTERVAL.
+    """
+    spool.open()
+    while spool.enabled and not (stop and stop()):
+        drained = True
+        try:
+            await spool.sync()
+            if spool.pending:
+                drained = await spool.replay(handler, config.SPOOL_REPLAY_BATCH)
+                if drained:
+                    logger.info(f"Спул {spool.directory} передан получателю")
+            if not drained:
+                spool.enforce_limit()
+        except Exception as e:
+            logger.error(f"Ошибка воспроизведения спула {spool.directory}: {e}")
+            drained = False
+        await asyncio.sleep(config.SPOOL_FSYNC_INTERVAL if drained else config.SPOOL_RETRY_INTERVAL)
+
+
+def _create_spool(name: str) -> DiskSpool:
+    return DiskSpool(
+        directory=BASE_DIR / config.SPOOL_DIR / name,
+        segment_bytes=config.SPOOL_SEGMENT_BYTES,
+        max_bytes=config.SPOOL_MAX_BYTES,
+        fsync_batch=config.SPOOL_FSYNC_BATCH,
+        fsync_interval=config.SPOOL_FSYNC_INTERVAL,
+        enabled=config.SPOOL_ENABLED
+    )
+
+
+# Спулы приема: сообщения для Kafka (роль ingest) и сообщения, не записанные в БД (роль consumer);
+# каталог открывает роль, которая пользуется спулом
+kafka_spool = _create_spool("kafka")
+db_spool = _create_spool("db")
+
+
+def _spool_samples(metric: str, value: Callable[[DiskSpool], float]):
+    return lambda: [(metric, {"spool": name}, value(spool))
+                    for name, spool in (("kafka", kafka_spool), ("db", db_spool))]
+
+
+registry.collector("counter", "spool_appended_total", "Сообщений, отложенных в спул",
+                   _spool_samples("spool_appended_total", lambda spool: spool.appended))
+registry.collector("counter", "spool_replayed_total", "Сообщений, переданных из спула получателю",
+                   _spool_samples("spool_replayed_total", lambda spool: spool.replayed))
+registry.collector("gauge", "spool_backlog_bytes", "Объем неотправленных данных в спуле",
+                   _spool_samples("spool_backlog_bytes",
+                                  lambda spool: spool.backlog_bytes() if spool.pending else 0))
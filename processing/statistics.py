@@ -0,0 +1,214 @@
+import logging
+import math
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class RollingStatistics:
+    """Скользящая статистика показаний одного датчика
+
+    Каждое обновление выполняется за амортизированное O(1): сумма и сумма
+    квадратов поддерживаются инкрементально (со сдвигом для численной
+    устойчивости), минимум и максимум - монотонными очередями.
+
+    Время - время измерения на устройстве. Показания не по порядку, но не
+    старше водяного знака (последнее время минус allowed_lateness), встают
+    в окно на свое место; более поздние отбрасываются и учитываются в late.
+    """
+
+    __slots__ = ("window_seconds", "max_points", "alpha", "allowed_lateness", "stage", "window", "_min", "_max",
+                 "_shift", "_sum", "_sumsq", "ewma", "rate_of_change", "last_value", "last_time", "total", "late")
+
+    def __init__(self, window_seconds: float, max_points: int, alpha: float, stage: Optional[str] = None,
+                 allowed_lateness: float = 0.0):
+        self.window_seconds = window_seconds
+        self.max_points = max_points
+        self.alpha = alpha
+        self.allowed_lateness = allowed_lateness
+        self.stage = stage
+        # Показания в окне: (время в секундах, значение)
+        self.window = deque()
+        self._min = deque()
+        self._max = deque()
+        self._shift = None
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self.ewma = None
+        self.rate_of_change = None
+        self.last_value = None
+        self.last_time = None
+        self.total = 0
+        self.late = 0
+
+    @property
+    def watermark(self) -> Optional[float]:
+        """Время, раньше которого показания считаются опоздавшими"""
+        return self.last_time - self.allowed_lateness if self.last_time is not None else None
+
+    def update(self, timestamp: float, value: float) -> bool:
+        """Добавление показания, возвращает False, если оно опоздало и отброшено"""
+        if self._shift is None:
+            self._shift = value
+
+        if self.last_time is not None and timestamp < self.last_time:
+            if timestamp < self.watermark:
+                self.late += 1
+                return False
+            self._insert_out_of_order(timestamp, value)
+            return True
+
+        # Скорость изменения - единиц в секунду относительно предыдущего показания
+        if self.last_time is not None and timestamp > self.last_time:
+            self.rate_of_change = (value - self.last_value) / (timestamp - self.last_time)
+
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        self.last_value = value
+        self.last_time = timestamp
+        self.total += 1
+
+        item = (timestamp, value)
+        self.window.append(item)
+        delta = value - self._shift
+        self._sum += delta
+        self._sumsq += delta * delta
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append(item)
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append(item)
+
+        self._evict(timestamp)
+        return True
+
+    def _insert_out_of_order(self, timestamp: float, value: float):
+        """Вставка показания в середину окна (редкий случай, O(размер окна))"""
+        self.total += 1
+        item = (timestamp, value)
+        position = len(self.window)
+        while position and self.window[position - 1][0] > timestamp:
+            position -= 1
+        self.window.insert(position, item)
+        delta = value - self._shift
+        self._sum += delta
+        self._sumsq += delta * delta
+
+        # Монотонные очереди пересобираются по окну
+        self._min.clear()
+        self._max.clear()
+        for entry in self.window:
+            while self._min and self._min[-1][1] >= entry[1]:
+                self._min.pop()
+            self._min.append(entry)
+            while self._max and self._max[-1][1] <= entry[1]:
+                self._max.pop()
+            self._max.append(entry)
+
+        # Скорость, EWMA и последнее значение относятся к самому свежему показанию и не меняются
+        self._evict(self.last_time)
+
+    def _evict(self, now: float):
+        horizon = now - self.window_seconds
+        while self.window and (self.window[0][0] < horizon or len(self.window) > self.max_points):
+            item = self.window.popleft()
+            delta = item[1] - self._shift
+            self._sum -= delta
+            self._sumsq -= delta * delta
+            if self._min and self._min[0] is item:
+                self._min.popleft()
+            if self._max and self._max[0] is item:
+                self._max.popleft()
+
+    @property
+    def count(self) -> int:
+        return len(self.window)
+
+    @property
+    def mean(self) -> Optional[float]:
+        if not self.window:
+            return None
+        return self._shift + self._sum / len(self.window)
+
+    @property
+    def stddev(self) -> Optional[float]:
+        n = len(self.window)
+        if n < 2:
+            return 0.0 if n else None
+        variance = (self._sumsq - self._sum * self._sum / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def min(self) -> Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self) -> Optional[float]:
+        return self._max[0][1] if self._max else None
+
+    def snapshot(self) -> dict:
+        """Текущие значения статистики"""
+        return {
+            "stage": self.stage,
+            "count": self.count,
+            "total": self.total,
+            "window_seconds": self.window_seconds,
+            "mean": self.mean,
+            "stddev": self.stddev,
+            "min": self.min,
+            "max": self.max,
+            "rate_of_change": self.rate_of_change,
+            "ewma": self.ewma,
+            "last_value": self.last_value,
+            "last_time": datetime.fromtimestamp(self.last_time) if self.last_time is not None else None,
+            "watermark": datetime.fromtimestamp(self.watermark) if self.last_time is not None else None,
+            "late": self.late
+        }
+
+
+class StatisticsEngine:
+    """Скользящая статистика по всем датчикам"""
+
+    def __init__(self, window_seconds: float, max_points: int, alpha: float, allowed_lateness: float = 0.0):
+        self.window_seconds = window_seconds
+        self.max_points = max_points
+        self.alpha = alpha
+        self.allowed_lateness = allowed_lateness
+        self._sensors: Dict[int, RollingStatistics] = {}
+
+    def update(self, sensor_id: int, timestamp: datetime, value: float, stage: Optional[str] = None) -> RollingStatistics:
+        """Обновление статистики датчика новым показанием"""
+        stats = self._sensors.get(sensor_id)
+        if stats is None:
+            stats = self._sensors[sensor_id] = RollingStatistics(
+                self.window_seconds, self.max_points, self.alpha, stage, self.allowed_lateness
+            )
+        elif stage is not None:
+            stats.stage = stage
+        stats.update(timestamp.timestamp(), float(value))
+        return stats
+
+    def get(self, sensor_id: int) -> Optional[RollingStatistics]:
+        return self._sensors.get(sensor_id)
+
+    def snapshot(self, sensor_id: int) -> Optional[dict]:
+        stats = self._sensors.get(sensor_id)
+        if stats is None:
+            return None
+        return {"sensor_id": sensor_id, **stats.snapshot()}
+
+    def snapshot_all(self) -> list:
+        return [{"sensor_id": sensor_id, **stats.snapshot()} for sensor_id, stats in self._sensors.items()]
+
+
+# Глобальный движок статистики, обновляется обработчиками этапов производства
+statistics_engine = StatisticsEngine(
+    window_seconds=config.STATS_WINDOW_SECONDS,
+    max_points=config.STATS_WINDOW_MAX_POINTS,
+    alpha=config.STATS_EWMA_ALPHA,
+    allowed_lateness=config.STREAM_ALLOWED_LATENESS
+)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+import numpy as np
+from sqlalchemy import event, select
+from database.models import EquipmentSetting, Sensor
+from database.connection import async_session
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class SensorThresholds(NamedTuple):
+    """Уставки датчика, его местоположение и параметры сжатия показаний"""
+    min_value: Optional[float]
+    max_value: Optional[float]
+    location_id: Optional[int]
+    deadband: Optional[float] = None
+    deadband_percent: Optional[float] = None
+    compression_deviation: Optional[float] = None
+    max_interval: Optional[float] = None
+
+    @property
+    def range(self) -> Optional[float]:
+        if self.min_value is None or self.max_value is None:
+            return None
+        return self.max_value - self.min_value
+
+
+class ThresholdCache:
+    """Кеш уставок EquipmentSetting, обновляемый одним запросом раз в ttl секунд"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._thresholds: Dict[int, SensorThresholds] = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+        # Плотные массивы уставок, индексированные sensor_id, для пакетной проверки
+        self._arrays = (np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def refresh(self):
+        """Загрузка уставок всех датчиков"""
+        async with self._lock:
+            # Другой вызов мог уже обновить кеш, пока мы ждали блокировку
+            if not self.is_stale():
+                return
+            async with async_session() as session:
+                query = select(
+                    Sensor.id, Sensor.location_id, EquipmentSetting.min_value, EquipmentSetting.max_value,
+                    EquipmentSetting.deadband, EquipmentSetting.deadband_percent,
+                    EquipmentSetting.compression_deviation, EquipmentSetting.max_interval
+                ).outerjoin(EquipmentSetting, EquipmentSetting.sensor_id == Sensor.id)
+                result = await session.execute(query)
+
+                thresholds = {}
+                for row in result.all():
+                    # У датчика может быть несколько записей настроек - берем первую, как check_alert_conditions
+                    if row.id in thresholds:
+                        continue
+                    thresholds[row.id] = SensorThresholds(
+                        float(row.min_value) if row.min_value is not None else None,
+                        float(row.max_value) if row.max_value is not None else None,
+                        row.location_id,
+                        row.deadband,
+                        row.deadband_percent,
+                        row.compression_deviation,
+                        row.max_interval
+                    )
+
+            self._thresholds = thresholds
+            self._arrays = self._build_arrays(thresholds)
+            self._loaded_at = time.monotonic()
+            logger.debug(f"Загружены уставки для {len(thresholds)} датчиков")
+
+    @staticmethod
+    def _build_arrays(thresholds: Dict[int, SensorThresholds]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Массивы min, max (NaN - уставки нет) и location_id (-1 - нет) по индексу sensor_id"""
+        size = max(thresholds, default=-1) + 1
+        min_values = np.full(size, np.nan)
+        max_values = np.full(size, np.nan)
+        locations = np.full(size, -1, dtype=np.int64)
+        for sensor_id, setting in thresholds.items():
+            if setting.min_value is not None:
+                min_values[sensor_id] = setting.min_value
+            if setting.max_value is not None:
+                max_values[sensor_id] = setting.max_value
+            if setting.location_id is not None:
+                locations[sensor_id] = setting.location_id
+        return min_values, max_values, locations
+
+    async def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Массивы уставок для векторизованной проверки (с обновлением кеша при устаревании)"""
+        if self.is_stale():
+            await self.refresh()
+        return self._arrays
+
+    async def get(self, sensor_id: int) -> Optional[SensorThresholds]:
+        """Уставки датчика (с обновлением кеша при устаревании)"""
+        if self.is_stale():
+            await self.refresh()
+        return self._thresholds.get(sensor_id)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+
+threshold_cache = ThresholdCache(ttl=config.THRESHOLD_CACHE_TTL)
+
+
+# Сброс кеша при изменении уставок через ORM
+@event.listens_for(EquipmentSetting, "after_insert")
+@event.listens_for(EquipmentSetting, "after_update")
+@event.listens_for(EquipmentSetting, "after_delete")
+def _invalidate_thresholds(mapper, connection, target):
+    threshold_cache.invalidate()
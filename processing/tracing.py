@@ -0,0 +1,311 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from config import config, BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Имя сервиса в экспортируемых трассировках
+SERVICE_NAME = "pet-bottle-monitoring"
+# Заголовок Kafka с контекстом трассировки (формат W3C traceparent)
+TRACEPARENT_HEADER = "traceparent"
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """Интервал обработки внутри трассировки"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], start_ns: int, end_ns: Optional[int] = None,
+                 attributes: Optional[dict] = None):
+        self.name = name
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.attributes = attributes or {}
+
+    def to_dict(self, trace_start_ns: int) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "offset_ms": (self.start_ns - trace_start_ns) / 1e6,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns is not None else None,
+            "attributes": self.attributes
+        }
+
+    def to_otlp(self, trace_id: str) -> dict:
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns if self.end_ns is not None else self.start_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()]
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace:
+    """Трассировка одного сообщения: от приема по MQTT до рассылки клиентам"""
+
+    __slots__ = ("trace_id", "root", "spans", "committed")
+
+    def __init__(self, name: str, start_ns: int, attributes: Optional[dict] = None, trace_id: Optional[str] = None,
+                 parent_id: Optional[str] = None):
+        self.trace_id = trace_id or _new_id(128)
+        self.root = Span(name, parent_id, start_ns, attributes=attributes)
+        self.spans: List[Span] = [self.root]
+        # Показание записано в БД, трассировка ждет ближайшей рассылки
+        self.committed = False
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, parent_id: Optional[str] = None, **attributes) -> Span:
+        span = Span(name, parent_id or self.root.span_id, start_ns, end_ns, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.root.end_ns is None:
+            return None
+        return (self.root.end_ns - self.root.start_ns) / 1e6
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.root.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.root.start_ns / 1e9,
+            "duration_ms": self.duration_ms,
+            "attributes": self.root.attributes,
+            "spans": [span.to_dict(self.root.start_ns)
+                      for span in sorted(self.spans[1:], key=lambda span: span.start_ns)]
+        }
+
+
+class _SpanContext:
+    """Контекстный менеджер интервала внутри текущей трассировки"""
+
+    __slots__ = ("trace", "name", "attributes", "span", "_token")
+
+    def __init__(self, trace: Trace, name: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+        self._token = None
+
+    def __enter__(self):
+        parent = _current_span.get() or self.trace.root.span_id
+        self.span = Span(self.name, parent, time.time_ns(), attributes=self.attributes)
+        self._token = _current_span.set(self.span.span_id)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.time_ns()
+        if exc is not None:
+            self.span.attributes["error"] = str(exc)
+        self.trace.spans.append(self.span)
+        _current_span.reset(self._token)
+        return False
+
+
+class _NullSpan:
+    """Пустой интервал для сообщений вне выборки"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Activation:
+    """Установка трассировки текущей для обработки сообщения"""
+
+    __slots__ = ("trace", "_token")
+
+    def __init__(self, trace: Optional[Trace]):
+        self.trace = trace
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        return False
+
+
+class Tracer:
+    """Выборочная трассировка сообщений конвейера
+
+    В выборку попадает доля sample_rate сообщений; для остальных интервалы
+    не создаются (проверка - одно чтение contextvar). Трассировка
+    завершается ближайшей рассылкой клиентам после записи в БД или по
+    таймауту, после чего попадает в кольцевой буфер и, если задан файл,
+    экспортируется строкой OTLP/JSON.
+    """
+
+    def __init__(self, sample_rate: float, buffer_size: int, timeout: float, export_path: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.timeout_ns = int(timeout * 1e9)
+        self.finished: Deque[Trace] = deque(maxlen=buffer_size)
+        self._active: Dict[str, Trace] = {}
+        self._export_path = export_path
+        self._export_file = None
+
+    def sample(self, name: str, start_ns: Optional[int] = None, **attributes) -> Optional[Trace]:
+        """Новая трассировка, если сообщение попало в выборку, иначе None"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        # Может вызываться из потока MQTT-клиента: регистрация происходит в цикле событий (activate)
+        return Trace(name, start_ns or time.time_ns(), attributes)
+
+    def resume(self, traceparent: Optional[str], name: str, **attributes) -> Optional[Trace]:
+        """Продолжение трассировки по заголовку traceparent (сообщение из Kafka)"""
+        if not traceparent:
+            return None
+        try:
+            _, trace_id, parent_id, _ = traceparent.split("-")
+        except ValueError:
+            return None
+        trace = self._active.get(trace_id)
+        if trace is None:
+            # Трассировка начата в другом процессе или уже завершена
+            trace = Trace(name, time.time_ns(), attributes, trace_id=trace_id, parent_id=parent_id)
+            self._active[trace_id] = trace
+        return trace
+
+    def activate(self, trace: Optional[Trace]):
+        """Контекст обработки сообщения с текущей трассировкой"""
+        if trace is not None and trace.trace_id not in self._active:
+            self._active[trace.trace_id] = trace
+            self._expire()
+        return _Activation(trace)
+
+    @staticmethod
+    def current() -> Optional[Trace]:
+        return _current_trace.get()
+
+    def span(self, name: str, **attributes):
+        """Интервал внутри текущей трассировки (пустой, если сообщение вне выборки)"""
+        trace = _current_trace.get()
+        if trace is None:
+            return _NULL_SPAN
+        return _SpanContext(trace, name, attributes)
+
+    def mark_committed(self):
+        """Показание текущей трассировки записано в БД"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.committed = True
+
+    def on_broadcast(self, group: str, start_ns: int, end_ns: int, clients: int):
+        """Рассылка клиентам завершает трассировки, ожидающие ее"""
+        if not self._active:
+            return
+        for trace in [trace for trace in self._active.values() if trace.committed]:
+            trace.add_span("websocket.broadcast", start_ns, end_ns, group=group, clients=clients)
+            self._finish(trace, end_ns)
+        self._expire()
+
+    def _expire(self):
+        now = time.time_ns()
+        for trace in [trace for trace in self._active.values() if now - trace.root.start_ns > self.timeout_ns]:
+            trace.root.attributes["broadcast"] = False
+            self._finish(trace, max(span.end_ns or span.start_ns for span in trace.spans))
+
+    def _finish(self, trace: Trace, end_ns: int):
+        self._active.pop(trace.trace_id, None)
+        trace.root.end_ns = end_ns
+        self.finished.append(trace)
+        if self._export_path:
+            self._export(trace)
+
+    def _export(self, trace: Trace):
+        try:
+            if self._export_file is None:
+                self._export_file = open(self._export_path, "a", encoding="utf-8")
+            record = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp(trace.trace_id) for span in trace.spans]
+                }]
+            }]}
+            self._export_file.write(json.dumps(record) + "\n")
+            self._export_file.flush()
+        except OSError as e:
+            logger.error(f"Ошибка записи трассировки в {self._export_path}: {e}")
+            self._export_path = None
+
+    def traces(self, limit: int = 100, min_duration_ms: float = 0.0) -> List[dict]:
+        """Последние завершенные трассировки (новые первыми)"""
+        result = []
+        for trace in reversed(self.finished):
+            if (trace.duration_ms or 0.0) >= min_duration_ms:
+                result.append(trace.to_dict())
+                if len(result) >= limit:
+                    break
+        return result
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        trace = self._active.get(trace_id)
+        if trace is not None:
+            return trace.to_dict()
+        for trace in self.finished:
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+        return None
+
+
+def _export_path() -> Optional[str]:
+    if not config.TRACE_EXPORT_FILE:
+        return None
+    path = BASE_DIR / config.TRACE_EXPORT_FILE
+    os.makedirs(path.parent, exist_ok=True)
+    return str(path)
+
+
+# Глобальный трассировщик конвейера
+tracer = Tracer(
+    sample_rate=config.TRACE_SAMPLE_RATE,
+    buffer_size=config.TRACE_BUFFER_SIZE,
+    timeout=config.TRACE_TIMEOUT,
+    export_path=_export_path()
+)
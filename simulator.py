@@ -77,13 +77,9 @@ def generate_value(sensor, anomaly_chance=0.05):
     return base_value
 
 
-# Функция для отправки данных в MQTT
-def send_sensor_data(client, sensor_name, sensor_config, anomaly_chance=0.05):
-    """Отправляет сгенерированные данные датчика в MQTT топик"""
-    value = generate_value(sensor_config, anomaly_chance)
-    timestamp = datetime.now().isoformat()
-
-    # Формируем сообщение
+# Функция для формирования сообщения с показанием датчика
+def build_reading(sensor_name, sensor_config, value, timestamp):
+    """Формирует показание датчика в формате одиночного сообщения"""
     message = {
         "sensor_id": sensor_config["id"],
         "timestamp": timestamp,
@@ -99,9 +95,7 @@ def send_sensor_data(client, sensor_name, sensor_config, anomaly_chance=0.05):
         message["level"] = round(value, 1)
     elif "flow" in sensor_name:
         message["flow_rate"] = round(value, 2)
-    elif "thickness" in sensor_name:
-        message["quality_index"] = round(value, 1)
-    elif "dimensions" in sensor_name:
+    elif "thickness" in sensor_name or "dimensions" in sensor_name:
         message["quality_index"] = round(value, 1)
     elif "speed" in sensor_name:
         message["speed"] = round(value)
@@ -110,21 +104,63 @@ def send_sensor_data(client, sensor_name, sensor_config, anomaly_chance=0.05):
     else:
         message["value"] = round(value, 2)
 
+    return message
+
+
+# Топик пакетных сообщений этапа: pet/cooling/flow -> pet/cooling/batch
+def batch_topic(sensor_config):
+    return sensor_config["topic"].rsplit("/", 1)[0] + "/batch"
+
+
+# Функция для отправки накопленных пакетов показаний
+def publish_batches(client, batches):
+    """Отправляет по одному сообщению {"readings": [...]} на каждый топик этапа"""
+    for topic, readings in batches.items():
+        if readings:
+            client.publish(topic, json.dumps({"readings": readings}))
+            logger.debug(f"Отправлен пакет: {topic} - {len(readings)} показаний")
+    batches.clear()
+
+
+# Функция для отправки данных в MQTT
+def send_sensor_data(client, sensor_name, sensor_config, anomaly_chance=0.05):
+    """Отправляет сгенерированные данные датчика в MQTT топик"""
+    value = generate_value(sensor_config, anomaly_chance)
+    message = build_reading(sensor_name, sensor_config, value, datetime.now().isoformat())
+
     # Отправляем сообщение
     client.publish(sensor_config["topic"], json.dumps(message))
     logger.info(f"Отправлено: {sensor_config['topic']} - {json.dumps(message)}")
 
 
+# Функция для отправки данных всех датчиков пакетами по этапам
+def send_batch_data(client, anomaly_chance=0.05):
+    """Отправляет показания всех датчиков, по одному сообщению на этап производства"""
+    timestamp = datetime.now().isoformat()
+    batches = {}
+    for sensor_name, sensor_config in SENSORS.items():
+        value = generate_value(sensor_config, anomaly_chance)
+        batches.setdefault(batch_topic(sensor_config), []).append(
+            build_reading(sensor_name, sensor_config, value, timestamp)
+        )
+    count = sum(len(readings) for readings in batches.values())
+    publish_batches(client, batches)
+    logger.info(f"Отправлено пакетами: {count} показаний")
+
+
 # Функция для генерации исторических данных
-def generate_historical_data(client, days=7, interval_minutes=15, anomaly_chance=0.05):
-    """Генерирует исторические данные за указанный период"""
+def generate_historical_data(client, days=7, interval_minutes=15, anomaly_chance=0.05, batch_size=0):
+    """Генерирует исторические данные за указанный период
+
+    При batch_size > 0 показания этапа накапливаются и отправляются пакетами до batch_size штук.
+    """
     logger.info(f"Генерация исторических данных за {days} дней с интервалом {interval_minutes} минут")
 
     end_time = datetime.now()
     start_time = end_time - timedelta(days=days)
 
     current_time = start_time
-    bottles_count = 0
+    batches = {}
 
     while current_time < end_time:
         # Формируем временную метку
@@ -134,32 +170,16 @@ def generate_historical_data(client, days=7, interval_minutes=15, anomaly_chance
         for sensor_name, sensor_config in SENSORS.items():
             # Создаем сообщение
             value = generate_value(sensor_config, anomaly_chance)
-            message = {
-                "sensor_id": sensor_config["id"],
-                "timestamp": timestamp,
-                "unit": sensor_config["unit"]
-            }
-
-            # Добавляем специфичное название параметра
-            if "temp" in sensor_name:
-                message["temperature"] = round(value, 1)
-            elif "pressure" in sensor_name:
-                message["pressure"] = round(value, 2)
-            elif "level" in sensor_name:
-                message["level"] = round(value, 1)
-            elif "flow" in sensor_name:
-                message["flow_rate"] = round(value, 2)
-            elif "thickness" in sensor_name or "dimensions" in sensor_name:
-                message["quality_index"] = round(value, 1)
-            elif "speed" in sensor_name:
-                message["speed"] = round(value)
-            elif "weight" in sensor_name:
-                message["weight"] = round(value, 3)
-            else:
-                message["value"] = round(value, 2)
+            message = build_reading(sensor_name, sensor_config, value, timestamp)
 
-            # Отправляем сообщение
-            client.publish(sensor_config["topic"], json.dumps(message))
+            if batch_size > 0:
+                topic = batch_topic(sensor_config)
+                batches.setdefault(topic, []).append(message)
+                if len(batches[topic]) >= batch_size:
+                    publish_batches(client, {topic: batches.pop(topic)})
+            else:
+                # Отправляем сообщение
+                client.publish(sensor_config["topic"], json.dumps(message))
 
         # Логируем процесс через равные промежутки времени
         if current_time.minute % 60 == 0 and current_time.second == 0:
@@ -171,13 +191,14 @@ def generate_historical_data(client, days=7, interval_minutes=15, anomaly_chance
         # Пауза для предотвращения перегрузки брокера
         time.sleep(0.01)
 
+    publish_batches(client, batches)
     logger.info("Генерация исторических данных завершена")
 
 
 # Основная функция для запуска симулятора
 def run_simulator(broker=MQTT_BROKER, port=MQTT_PORT, username=MQTT_USERNAME,
                   password=MQTT_PASSWORD, interval=5, historical=False,
-                  days=7, anomaly_chance=0.05):
+                  days=7, anomaly_chance=0.05, batch=False, batch_size=500):
     """Запускает симулятор данных датчиков"""
     logger.info(f"Запуск симулятора датчиков с подключением к {broker}:{port}")
 
@@ -201,13 +222,16 @@ def run_simulator(broker=MQTT_BROKER, port=MQTT_PORT, username=MQTT_USERNAME,
     try:
         # Если нужны исторические данные, генерируем их
         if historical:
-            generate_historical_data(client, days, 15, anomaly_chance)
+            generate_historical_data(client, days, 15, anomaly_chance, batch_size if batch else 0)
 
         # Бесконечный цикл генерации текущих данных
         while True:
             # Отправляем данные со всех датчиков
-            for sensor_name, sensor_config in SENSORS.items():
-                send_sensor_data(client, sensor_name, sensor_config, anomaly_chance)
+            if batch:
+                send_batch_data(client, anomaly_chance)
+            else:
+                for sensor_name, sensor_config in SENSORS.items():
+                    send_sensor_data(client, sensor_name, sensor_config, anomaly_chance)
 
             # Задержка между отправками
             time.sleep(interval)
@@ -231,6 +255,9 @@ if __name__ == "__main__":
     parser.add_argument('--historical', action='store_true', help='Генерировать исторические данные')
     parser.add_argument('--days', type=int, default=7, help='Количество дней для исторических данных')
     parser.add_argument('--anomaly', type=float, default=0.05, help='Вероятность аномалий (0-1)')
+    parser.add_argument('--batch', action='store_true', help='Отправлять показания пакетами по этапам')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Максимум показаний в пакете исторических данных')
 
     args = parser.parse_args()
 
@@ -243,5 +270,7 @@ if __name__ == "__main__":
         interval=args.interval,
         historical=args.historical,
         days=args.days,
-        anomaly_chance=args.anomaly
+        anomaly_chance=args.anomaly,
+        batch=args.batch,
+        batch_size=args.batch_size
     )
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+import sys
+from pathlib import Path
+
+# Обязательные параметры конфигурации для импорта модулей без .env (подключения не открываются)
+TEST_ENVIRONMENT = {
+    "DB_HOST": "localhost", "DB_PORT": "5432", "DB_USER": "test", "DB_PASS": "test", "DB_NAME": "test",
+    "MQTT_BROKER": "localhost", "MQTT_PORT": "1883", "MQTT_USERNAME": "", "MQTT_PASSWORD": "", "MQTT_QOS": "1",
+    "KAFKA_BOOTSTRAP_SERVERS": "localhost:9092", "KAFKA_MAX_BATCH_SIZE": "16384", "KAFKA_LINGER_MS": "10",
+    "SECRET_KEY": "test", "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "SPOOL_ENABLED": "false",
+}
+for name, value in TEST_ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
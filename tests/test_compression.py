@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+import pytest
+from sqlalchemy.exc import OperationalError
+import processing.data_processor as data_processor
+from processing.compression import ReadingCompressor
+from processing.spool import DownstreamUnavailable
+
+
+class FakeSession:
+    """Сессия, которая запоминает записанные строки и может отказать при фиксации"""
+
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def add(self, reading):
+        self.rows.append({"value": reading.value, "time": reading.time})
+
+    async def execute(self, statement, rows=None):
+        self.rows.extend({"value": row["value"], "time": row["time"]} for row in rows or [])
+
+    async def commit(self):
+        if self.db.fail_commits:
+            self.db.fail_commits -= 1
+            raise OperationalError("COMMIT", {}, ConnectionError("connection lost"))
+        self.db.stored.extend(self.rows)
+
+    async def rollback(self):
+        self.rows = []
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.stored = []
+        self.fail_commits = 0
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = FakeDatabase()
+
+    async def no_thresholds(sensor_id):
+        return None
+
+    async def nothing(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(data_processor, "async_session", database)
+    monkeypatch.setattr(data_processor, "reading_compressor", ReadingCompressor(enabled=True))
+    monkeypatch.setattr(data_processor.threshold_cache, "get", no_thresholds)
+    monkeypatch.setattr(data_processor, "check_alert_conditions", nothing)
+    monkeypatch.setattr(data_processor, "check_alert_conditions_batch", nothing)
+    monkeypatch.setattr(data_processor, "check_rule_conditions", nothing)
+    return database
+
+
+def readings():
+    start = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    # Без допуска swinging door: третья точка вне прямой, вторая должна попасть в архив
+    return [(start + datetime.timedelta(seconds=index), f'{{"value": {value}}}', value)
+            for index, value in enumerate((1.0, 2.0, 10.0))]
+
+
+def save_single(sensor_id, event_time, payload, value):
+    return data_processor.save_sensor_reading(sensor_id, payload, value, event_time)
+
+
+def save_batch(sensor_id, event_time, payload, value):
+    return data_processor.save_sensor_readings_batch([(sensor_id, payload, value, event_time)])
+
+
+@pytest.mark.parametrize("save", [save_single, save_batch])
+def test_failed_commit_keeps_archived_point_for_replay(db, save):
+    async def scenario():
+        (first_time, first, first_value), (second_time, second, second_value), (third_time, third, third_value) = \
+            readings()
+        assert await save(1, first_time, first, first_value) is not None
+        assert await save(1, second_time, second, second_value) is not None
+        assert [row["value"] for row in db.stored] == [first]
+
+        # Фиксация третьего показания не удалась: оно уходит в спул
+        db.fail_commits = 1
+        with pytest.raises(DownstreamUnavailable):
+            await save(1, third_time, third, third_value)
+        assert [row["value"] for row in db.stored] == [first]
+
+        # Воспроизведение из спула записывает точку, которую вытеснило третье показание
+        assert await save(1, third_time, third, third_value) is not None
+        assert [row["value"] for row in db.stored] == [first, second]
+        assert data_processor.reading_compressor.pending(1).payload == third
+
+    asyncio.run(scenario())
@@ -0,0 +1,21 @@
+from processing.live_buffer import LiveReadingsStore
+
+
+def test_appended_includes_late_readings():
+    store = LiveReadingsStore(capacity=4)
+    store.append(1, 1000, 1.0)
+    sequence = store.sequence(1)
+
+    # Опоздавшее показание приходит после более свежего
+    store.append(1, 3000, 3.0)
+    store.append(1, 2000, 2.0)
+    times, values, sequence = store.appended(1, sequence)
+    assert times.tolist() == [3000, 2000]
+    assert values.tolist() == [3.0, 2.0]
+
+    # Отстающий клиент получает только то, что осталось в буфере
+    for i in range(6):
+        store.append(1, 4000 + i, float(i))
+    times, _, sequence = store.appended(1, sequence)
+    assert times.tolist() == [4002, 4003, 4004, 4005]
+    assert len(store.appended(1, sequence)[0]) == 0
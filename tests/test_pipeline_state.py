@@ -0,0 +1,53 @@
+import datetime
+import json
+import time
+import processing.pipeline_state as pipeline_state
+from processing.event_time import IngestLagTracker
+from processing.live_buffer import LiveReadingsStore
+from processing.statistics import StatisticsEngine
+
+
+def _publish(monkeypatch, publisher, store, sensor_id, values, lag_seconds):
+    """Сообщение процесса-консьюмера с его буфером, статистикой и задержкой"""
+    engine = StatisticsEngine(window_seconds=300, max_points=100, alpha=0.2)
+    lag = IngestLagTracker(alpha=0.2)
+    now = datetime.datetime.now()
+    for i, value in enumerate(values):
+        timestamp = now + datetime.timedelta(seconds=i)
+        store.append(sensor_id, timestamp, value)
+        engine.update(sensor_id, timestamp, value)
+        lag.observe(sensor_id, timestamp, timestamp + datetime.timedelta(seconds=lag_seconds))
+    monkeypatch.setattr(pipeline_state, "live_readings", store)
+    monkeypatch.setattr(pipeline_state, "statistics_engine", engine)
+    monkeypatch.setattr(pipeline_state, "ingest_lag", lag)
+    return json.loads(pipeline_state.encode_state(publisher.collect()))
+
+
+def test_mirror_merges_consumer_sources(monkeypatch):
+    first, second = pipeline_state.PipelineStatePublisher(), pipeline_state.PipelineStatePublisher()
+    second.source = "other:1"
+    messages = [
+        _publish(monkeypatch, first, LiveReadingsStore(capacity=10), 1, [1.0, 2.0], lag_seconds=1),
+        _publish(monkeypatch, second, LiveReadingsStore(capacity=10), 2, [5.0], lag_seconds=3),
+    ]
+
+    web_store = LiveReadingsStore(capacity=10)
+    monkeypatch.setattr(pipeline_state, "live_readings", web_store)
+    mirror = pipeline_state.PipelineStateMirror(expire=30)
+    monkeypatch.setattr(pipeline_state, "pipeline_mirror", mirror)
+    mirror.enabled = True
+    for message in messages:
+        mirror.apply(message)
+
+    assert web_store.window(1)[1].tolist() == [1.0, 2.0]
+    assert web_store.window(2)[1].tolist() == [5.0]
+    assert sorted(stats["sensor_id"] for stats in pipeline_state.statistics_snapshot_all()) == [1, 2]
+    assert pipeline_state.statistics_snapshot(2)["last_value"] == 5.0
+    lag = pipeline_state.lag_snapshot()
+    assert lag["total"]["count"] == 3 and lag["total"]["max_seconds"] == 3
+    assert pipeline_state.lag_snapshot(1)["last_seconds"] == 1
+    assert pipeline_state.consumer_snapshot()["retries"] == 0
+
+    # Снимки источника, давно не публиковавшего, не учитываются
+    mirror.apply({**messages[1], "live": {}, "time": time.time() - 60})
+    assert pipeline_state.statistics_snapshot(2) is None
@@ -5,18 +5,32 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from pathlib import Path
-from database.connection import get_async_session
+from database.connection import async_session, get_async_session, connection
+from database.pool import pool_monitor
+from database.query_limits import (ClientDisconnected, cancel_on_disconnect, heavy_queries, is_statement_timeout,
+                                   with_statement_timeout)
 from database.models import Employee, Role, SensorReading, Sensor, Location, Event, EquipmentSetting
-from api.routes import router as api_router
+from api.routes import router as api_router, get_latest_sensor_data
 from api.schemas import LoginRequest, TokenResponse
 from jose import jwt, JWTError, ExpiredSignatureError
 from datetime import datetime, timedelta
 from config import config
 import sqlalchemy as sa
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 import typing
 from web.websockets import manager
+from web.fanout import fanout
+from processing.thresholds import threshold_cache
+from web.encoding import accept_with_encoding, encode_message, send_encoded
+from web.metrics import MetricsMiddleware
+from processing.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from processing.tracing import tracer
+from processing.loop_monitor import loop_monitor, render_collapsed
+from processing.live_buffer import live_readings
+from processing.pipeline_state import statistics_snapshot_all
+from web.auth import (CachedUser, token_cache, user_cache, verify_password, is_password_hashed,
+                      hash_password_async)
 import logging
 import asyncio
 import random
@@ -27,6 +41,7 @@ import json
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Система мониторинга производства ПЭТ бутылок")
+app.add_middleware(MetricsMiddleware)
 
 # Подключение статических файлов и шаблонов
 BASE_DIR = Path(__file__).resolve().parent
@@ -50,6 +65,13 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+# Встроенные учетные записи формы входа (не хранятся в БД)
+BUILTIN_CREDENTIALS = {
+    "admin": "admin",
+    "operator": "operator"
+}
+
+
 # Верификация пользователя
 async def authenticate_user(db: AsyncSession, username: str, password: str):
     """Аутентификация пользователя"""
@@ -61,9 +83,16 @@ async def authenticate_user(db: AsyncSession, username: str, password: str):
 
         if not user:
             return None
-        if user.hashed_password != password:
+        # Проверка bcrypt выполняется в пуле потоков
+        if not await verify_password(password, user.hashed_password):
             return None
 
+        # Пароли, сохраненные в открытом виде, перехешируем при успешном входе
+        if not is_password_hashed(user.hashed_password):
+            user.hashed_password = await hash_password_async(password)
+            await db.commit()
+            await db.refresh(user)
+
         return user
     except Exception as e:
         logger.error(f"Ошибка аутентификации: {e}")
@@ -79,60 +108,67 @@ async def get_current_user_from_cookie(request: Request, db: AsyncSession = Depe
 
         # Извлекаем сам токен из строки "Bearer ..."
         if token.startswith("Bearer "):
-            token = token.split("Bearer ")[1]
+            token = token[len("Bearer "):]
 
-        # Упрощенная проверка - без верификации подписи
+        # Подпись проверяется один раз, дальше токен берется из кеша до истечения срока
         try:
-            # Только для отладки - распаковываем без проверки подписи
-            decoded_payload = jwt.decode(
-                token,
-                config.SECRET_KEY,  # Используем правильный ключ из конфигурации
-                options={"verify_signature": False}
-            )
-            username = decoded_payload.get("sub")
-            role = decoded_payload.get("role")
+            payload = token_cache.verify(token)
+        except JWTError as e:
+            logger.warning(f"Ошибка при проверке токена с подписью: {e}")
+            return None
 
-            logger.info(f"Декодирован токен для пользователя: {username}, роль: {role}")
+        username = payload.get("sub")
+        if not username:
+            return None
 
-            # Создаем временный объект пользователя для отладки
-            if username in ["admin", "operator"]:
-                user = type('User', (), {
-                    'username': username,
-                    'role': role or ("admin" if username == "admin" else "operator")
-                })
-                return user
+        user = user_cache.get(username)
+        if user is not None:
+            return user
 
-        except Exception as decode_error:
-            logger.error(f"Ошибка при базовом декодировании токена: {decode_error}")
+        # Ищем в БД только при промахе кеша
+        query = sa.select(Employee).where(Employee.username == username)
+        result = await db.execute(query)
+        employee = result.scalars().first()
 
-        # Пытаемся найти пользователя в БД (если он там есть)
-        try:
-            # Более безопасное декодирование с проверкой подписи
-            payload = jwt.decode(token, config.SECRET_KEY, algorithms=["HS256"])  # Используем config.SECRET_KEY вместо "тестовый_ключ_123"
-            username = payload.get("sub")
-
-            if username:
-                # Ищем в БД
-                query = sa.select(Employee).where(Employee.username == username)
-                result = await db.execute(query)
-                user = result.scalars().first()
-
-                if user:
-                    return user
-        except Exception as e:
-            logger.warning(f"Ошибка при проверке токена с подписью: {e}")
-            # Продолжаем использовать упрощенный вариант без проверки подписи
+        if employee:
+            user = CachedUser.from_employee(employee)
+        elif username in BUILTIN_CREDENTIALS:
+            role = payload.get("role") or ("admin" if username == "admin" else "operator")
+            user = CachedUser(username=username, role=role)
+        else:
+            return None
 
-        return None
+        user_cache.put(user)
+        return user
 
     except Exception as e:
         logger.error(f"Общая ошибка при получении пользователя из cookie: {e}")
         return None
 
+async def require_admin(user=Depends(get_current_user_from_cookie)):
+    """Доступ только для администратора (служебные эндпоинты диагностики)"""
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Требуется авторизация")
+    if user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Требуются права администратора")
+    return user
+
 # Подключение API маршрутов
 app.include_router(api_router, prefix="/api")
 
 
+# Уставки, измененные в одном воркере пред-форка, сбрасываются и в остальных
+# (кеш в воркере, изменившем их, сбрасывает processing.thresholds)
+@sa.event.listens_for(EquipmentSetting, "after_insert")
+@sa.event.listens_for(EquipmentSetting, "after_update")
+@sa.event.listens_for(EquipmentSetting, "after_delete")
+def _relay_thresholds(mapper, connection, target):
+    fanout.invalidate("thresholds")
+
+
+fanout.register_cache("thresholds", threshold_cache.invalidate)
+
+
 @app.post("/token")
 async def login_for_access_token(
     response: Response,
@@ -141,22 +177,20 @@ async def login_for_access_token(
 ):
     """Получение токена доступа - совсем простая версия"""
     try:
-        # Получаем сотрудника
-        query = select(Employee).where(Employee.username == form_data.username)
-        result = await db.execute(query)
-        employee = result.scalar_one_or_none()
+        # Получаем сотрудника и проверяем пароль
+        employee = await authenticate_user(db, form_data.username, form_data.password)
         
-        if not employee or employee.hashed_password != form_data.password:
+        if not employee:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Неверное имя пользователя или пароль",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        # Используем прямое значение поля role, если оно есть
+        # Используем название роли сотрудника, если она есть
         role_value = "operator"
-        if hasattr(employee, 'role') and isinstance(employee.role, str):
-            role_value = employee.role
+        if employee.role is not None:
+            role_value = employee.role.name
         
         # Создаем JWT токен
         access_token_expires = timedelta(minutes=60)
@@ -190,6 +224,62 @@ async def root():
     return {"message": "Система мониторинга производства ПЭТ бутылок работает!"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики конвейера в текстовом формате Prometheus"""
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/admin/traces")
+async def get_traces(limit: int = 100, min_duration_ms: float = 0.0, user=Depends(require_admin)):
+    """Последние трассировки сообщений (от приема по MQTT до рассылки клиентам)"""
+    return {
+        "sample_rate": tracer.sample_rate,
+        "traces": tracer.traces(limit=min(limit, 1000), min_duration_ms=min_duration_ms)
+    }
+
+
+@app.get("/admin/traces/{trace_id}")
+async def get_trace(trace_id: str, user=Depends(require_admin)):
+    """Трассировка по идентификатору"""
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Трассировка не найдена")
+    return trace
+
+
+@app.get("/admin/loop")
+async def get_loop_status(user=Depends(require_admin)):
+    """Задержка цикла событий и последние блокировки со стеками"""
+    return loop_monitor.snapshot()
+
+
+@app.get("/admin/profile")
+async def profile_event_loop(seconds: float = 10.0, interval_ms: float = 5.0, format: str = "collapsed",
+                             user=Depends(require_admin)):
+    """Выборочный профиль потока цикла событий
+
+    format=collapsed - текст для flamegraph.pl/speedscope, format=json - {стек: выборки}.
+    """
+    if not 0 < seconds <= config.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds должно быть от 0 до {config.PROFILE_MAX_SECONDS}")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms должно быть не меньше 1")
+    # Выборки снимаются из отдельного потока, цикл событий продолжает работу
+    counts = await asyncio.to_thread(loop_monitor.profile, seconds, interval_ms / 1000)
+    if counts is None:
+        raise HTTPException(status_code=409, detail="Профилирование уже выполняется")
+    if format == "json":
+        return counts
+    return Response(render_collapsed(counts), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/admin/db/pool")
+async def get_db_pool_status(user=Depends(require_admin)):
+    """Состояние пула соединений БД, соединения, удерживаемые дольше порога, и допуск тяжелых запросов"""
+    return {**pool_monitor.snapshot(), "heavy_queries": heavy_queries.snapshot()}
+
+
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, next: str = "/dashboard"):
     """Страница входа с формой авторизации"""
@@ -210,12 +300,7 @@ async def login_form(
     """Максимально упрощенная обработка формы входа"""
     try:
         # Проверяем логин/пароль напрямую, без запросов к БД
-        valid_credentials = {
-            "admin": "admin",
-            "operator": "operator"
-        }
-
-        if username not in valid_credentials or password != valid_credentials[username]:
+        if username not in BUILTIN_CREDENTIALS or password != BUILTIN_CREDENTIALS[username]:
             return templates.TemplateResponse(
                 "login.html",
                 {"request": request, "error": "Неверное имя пользователя или пароль", "next": next}
@@ -320,28 +405,53 @@ async def reports_page(request: Request, db: AsyncSession = Depends(get_async_se
 # Добавьте маршрут для выхода из системы
 @app.get("/logout")
 async def logout():
-    """Выход из системы"""
+    """Выход из системы: удаление cookie с токеном
+
+    Токен не отзывается: JWT без состояния остается действительным до exp
+    (ACCESS_TOKEN_EXPIRE_MINUTES) у всех воркеров и реплик веб-роли.
+    """
     response = RedirectResponse(url="/login", status_code=303)
     response.delete_cookie(key="access_token", path="/")
     return response
 
 
 
+async def wait_closed(websocket: WebSocket):
+    """Чтение из WebSocket до отключения клиента, который сам ничего не присылает"""
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except RuntimeError:
+        # Соединение уже закрыто сервером
+        pass
+
+
 # Маршрут для WebSocket дашборда
 @app.websocket("/ws/dashboard")
-async def websocket_dashboard(websocket: WebSocket, db: AsyncSession = Depends(get_async_session)):
-    await websocket.accept()
+async def websocket_dashboard(websocket: WebSocket):
+    encoding = await accept_with_encoding(websocket)
+    # Отключение замечается сразу, а не при следующей отправке: запрос к БД отменяется
+    closed = asyncio.create_task(wait_closed(websocket))
     
     try:
         while True:
-            # Получаем данные для дашборда
+            # Получаем данные для дашборда; сессия открывается на одно обновление,
+            # чтобы подключение не удерживало соединение пула все время работы
             try:
-                dashboard_data = await generate_dashboard_data(db)
-                await websocket.send_json(dashboard_data)
+                async with async_session() as db:
+                    # SET LOCAL тоже выполняется в отменяемой задаче: при отключении клиента не ждем и его
+                    dashboard_data = await cancel_on_disconnect(dashboard_snapshot(db), closed, "dashboard")
+                await send_encoded(websocket, encode_message(dashboard_data, encoding))
+            except ClientDisconnected:
+                raise
             except Exception as e:
-                logger.error(f"Ошибка при генерации данных дашборда: {e}")
+                if is_statement_timeout(e):
+                    logger.warning(f"Запрос дашборда прерван по лимиту времени "
+                                   f"{config.DB_STATEMENT_TIMEOUT_STREAMS} с")
+                else:
+                    logger.error(f"Ошибка при генерации данных дашборда: {e}")
                 # Создаем новую сессию для следующей попытки
-                await websocket.send_json({
+                await send_encoded(websocket, encode_message({
                     "error": "Ошибка получения данных дашборда",
                     "sensor_readings": [],
                     "recent_alerts": [],
@@ -350,12 +460,12 @@ async def websocket_dashboard(websocket: WebSocket, db: AsyncSession = Depends(g
                         "message": "Ошибка получения данных",
                         "metrics": {}
                     }
-                })
+                }, encoding))
             
             # Ждем перед следующим обновлением
             await asyncio.sleep(1)
             
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, ClientDisconnected):
         logger.info("WebSocket клиент отключен от /ws/dashboard")
     except Exception as e:
         logger.error(f"Ошибка при отправке данных дашборда: {e}")
@@ -363,6 +473,8 @@ async def websocket_dashboard(websocket: WebSocket, db: AsyncSession = Depends(g
             await websocket.send_json({"error": f"Ошибка получения данных дашборда: {str(e)}"})
         except:
             pass
+    finally:
+        closed.cancel()
 
 async def generate_dashboard_data(db: AsyncSession):
     try:
@@ -400,7 +512,8 @@ async def generate_dashboard_data(db: AsyncSession):
                 "sensor_type": row.sensor_type,
                 "location_name": row.location_name,
                 "value": row.SensorReading.value,
-                "time": row.SensorReading.time.strftime("%Y-%m-%d %H:%M:%S") if row.SensorReading.time else None
+                # Время форматируется при кодировании сообщения (JSON - строка, бинарные форматы - epoch ms)
+                "time": row.SensorReading.time
             })
         
         # Получаем последние оповещения
@@ -428,8 +541,10 @@ async def generate_dashboard_data(db: AsyncSession):
                 "alert_type": alert.Event.alert_type,
                 "message": alert.Event.message,
                 "value": alert.Event.value,
+                "count": alert.Event.count or 1,
+                "status": alert.Event.status,
                 "location": alert.location_name,
-                "timestamp": alert.Event.timestamp.strftime("%Y-%m-%d %H:%M:%S") if alert.Event.timestamp else None
+                "timestamp": alert.Event.timestamp
             })
         
         # Формируем данные о текущем статусе производства
@@ -441,6 +556,9 @@ async def generate_dashboard_data(db: AsyncSession):
             "production_status": production_status
         }
     except Exception as e:
+        if is_statement_timeout(e):
+            # Транзакция прервана, снимок не собрать: ошибку обрабатывает вызывающий
+            raise
         logger.error(f"Ошибка при генерации данных дашборда: {e}")
         # Заворачиваем ошибку в транзакцию, чтобы не прерывать сессию
         await db.rollback()
@@ -452,6 +570,10 @@ async def generate_dashboard_data(db: AsyncSession):
             "production_status": {"status": "error", "message": f"Ошибка: {str(e)}", "metrics": {}}
         }
 
+# Снимок дашборда для /ws/dashboard с лимитом времени запросов
+dashboard_snapshot = with_statement_timeout(config.DB_STATEMENT_TIMEOUT_STREAMS, generate_dashboard_data)
+
+
 async def generate_production_status(db: AsyncSession):
     """Генерация статуса производства с PostgreSQL-совместимым синтаксисом"""
     try:
@@ -487,7 +609,7 @@ async def generate_production_status(db: AsyncSession):
         production_metrics = {
             "active_sensors": active_sensors,
             "alerts_24h": alerts_count,
-            "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            "last_update": datetime.now()
         }
         
         return {
@@ -496,6 +618,9 @@ async def generate_production_status(db: AsyncSession):
             "metrics": production_metrics
         }
     except Exception as e:
+        if is_statement_timeout(e):
+            # Транзакция прервана, снимок не собрать: ошибку обрабатывает вызывающий
+            raise
         logger.error(f"Ошибка при генерации статуса производства: {e}")
         return {
             "status": "error",
@@ -643,7 +768,7 @@ async def create_test_readings(db: AsyncSession, sensors):
 # Маршрут для WebSocket мониторинга датчиков
 @app.websocket("/ws/sensors")
 async def websocket_sensors(websocket: WebSocket, db: AsyncSession = Depends(get_async_session)):
-    await websocket.accept()
+    encoding = await accept_with_encoding(websocket)
     try:
         # Получаем информацию о датчиках
         query = sa.select(
@@ -689,13 +814,13 @@ async def websocket_sensors(websocket: WebSocket, db: AsyncSession = Depends(get
                     "status": sensor.status,
                     "location": sensor.location_name,
                     "last_reading": reading.value if reading else "Нет данных",
-                    "last_updated": reading.time.strftime("%Y-%m-%d %H:%M:%S") if reading else "Никогда"
+                    "last_updated": reading.time if reading else "Никогда"
                 }
                 
                 sensors_data.append(sensor_dict)
         
         # Отправляем данные клиенту
-        await websocket.send_json({"sensors": sensors_data})
+        await send_encoded(websocket, encode_message({"sensors": sensors_data}, encoding))
         
     except WebSocketDisconnect:
         logger.info("WebSocket клиент отключен от /ws/sensors")
@@ -749,49 +874,111 @@ async def create_test_sensors(db: AsyncSession):
         await db.rollback()
         logger.error(f"Ошибка при создании тестовых датчиков: {e}")
 
-# Маршрут для WebSocket оповещений
-@app.websocket("/ws/alerts")
-async def websocket_alerts(websocket: WebSocket, db: AsyncSession = Depends(get_async_session)):
-    await manager.connect(websocket, "alerts")
+# Маршрут для WebSocket графиков в реальном времени
+@app.websocket("/ws/live/{sensor_id}")
+async def websocket_live(websocket: WebSocket, sensor_id: int, minutes: float = 15, interval: float = 1):
+    """Окно последних показаний датчика и дальнейшие приращения из буфера в памяти"""
+    encoding = await accept_with_encoding(websocket)
     
-    # Генератор данных для оповещений
-    async def generate_alerts_data():
-        try:
-            query = sa.select(
-                Event, 
-                Sensor.sensor_name
-            ).outerjoin(
-                Sensor, Event.sensor_id == Sensor.id
-            ).filter(
-                sa.and_(
-                    Event.event_type.is_not(None),  # Проверяем, что не NULL
-                    Event.event_type.in_(["high_value", "low_value", "value_exceeded"])
-                )
-            ).order_by(Event.time.desc()).limit(100)
-            
-            result = await db.execute(query)
-            alerts = result.all()
+    try:
+        # Сначала отправляем все окно, затем только новые точки (по порядку поступления,
+        # чтобы не терять опоздавшие показания со временем раньше уже отправленных)
+        times, values = live_readings.window(sensor_id, minutes=minutes)
+        sequence = live_readings.sequence(sensor_id)
+        await send_encoded(websocket, encode_message({
+            "sensor_id": sensor_id,
+            "type": "window",
+            "times": times.tolist(),
+            "values": values.tolist()
+        }, encoding))
+        
+        while True:
+            await asyncio.sleep(max(interval, 0.2))
+            times, values, sequence = live_readings.appended(sensor_id, sequence)
+            if not len(times):
+                continue
+            await send_encoded(websocket, encode_message({
+                "sensor_id": sensor_id,
+                "type": "append",
+                "times": times.tolist(),
+                "values": values.tolist()
+            }, encoding))
             
-            return {
-                "alerts": [
-                    {
-                        "id": row.Event.id,
-                        "time": row.Event.time.isoformat(),
-                        "event_type": row.Event.event_type,
-                        "description": row.Event.description,
-                        "sensor_id": row.Event.sensor_id,
-                        "sensor_name": row.sensor_name
-                    }
-                    for row in alerts
-                ],
-                "timestamp": datetime.now().isoformat()
-            }
-        except Exception as e:
-            logger.error(f"Ошибка получения оповещений: {e}")
-            return {"error": str(e)}
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket клиент отключен от /ws/live/{sensor_id}")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке показаний датчика {sensor_id}: {e}")
+
+
+# Генератор данных для оповещений (общий для WebSocket и SSE)
+async def generate_alerts_data(db: AsyncSession):
+    try:
+        query = sa.select(
+            Event, 
+            Sensor.sensor_name
+        ).outerjoin(
+            Sensor, Event.sensor_id == Sensor.id
+        ).order_by(Event.timestamp.desc()).limit(100)
+        
+        result = await db.execute(query)
+        alerts = result.all()
+        
+        return {
+            "alerts": [
+                {
+                    "id": row.Event.id,
+                    "time": row.Event.timestamp.isoformat() if row.Event.timestamp else None,
+                    "event_type": row.Event.alert_type,
+                    "description": row.Event.message,
+                    "sensor_id": row.Event.sensor_id,
+                    "sensor_name": row.sensor_name,
+                    "count": row.Event.count or 1,
+                    "peak_value": row.Event.peak_value,
+                    "status": row.Event.status
+                }
+                for row in alerts
+            ],
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        if is_statement_timeout(e):
+            # Транзакция прервана, снимок не собрать: ошибку обрабатывает вызывающий
+            raise
+        logger.error(f"Ошибка получения оповещений: {e}")
+        return {"error": str(e)}
+
+
+# Генератор текущих показаний датчиков (общий для WebSocket и SSE)
+async def generate_sensors_data(db: AsyncSession):
+    try:
+        sensors = await get_latest_sensor_data(db)
+        return {
+            "sensors": sensors,
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        if is_statement_timeout(e):
+            # Транзакция прервана, снимок не собрать: ошибку обрабатывает вызывающий
+            raise
+        logger.error(f"Ошибка получения показаний датчиков: {e}")
+        return {"error": str(e)}
+
+
+# Генератор скользящей статистики (только из памяти, без БД)
+async def generate_statistics_data():
+    return {
+        "statistics": statistics_snapshot_all(),
+        "timestamp": datetime.now()
+    }
+
+
+async def serve_broadcast_group(websocket: WebSocket, group: str):
+    """Подключение клиента к группе с общей задачей рассылки"""
+    await manager.connect(websocket, group)
     
-    # Запускаем периодическую отправку данных
-    task = await manager.start_broadcast_task("alerts", 10, generate_alerts_data)
+    # Запускаем периодическую отправку данных (одна задача на всех клиентов)
+    interval, generator = SSE_STREAMS[group]
+    await manager.ensure_broadcast_task(group, interval, generator)
     
     try:
         # Ждем отключения клиента
@@ -799,7 +986,110 @@ async def websocket_alerts(websocket: WebSocket, db: AsyncSession = Depends(get_
             data = await websocket.receive_text()
             # Если клиент отправил сообщение, можно обработать его здесь
     except WebSocketDisconnect:
-        manager.disconnect(websocket, "alerts")
+        manager.disconnect(websocket, group)
+
+
+# Маршрут для WebSocket оповещений
+@app.websocket("/ws/alerts")
+async def websocket_alerts(websocket: WebSocket):
+    await serve_broadcast_group(websocket, "alerts")
+
+
+# Маршрут для WebSocket скользящей статистики
+@app.websocket("/ws/statistics")
+async def websocket_statistics(websocket: WebSocket):
+    await serve_broadcast_group(websocket, "statistics")
+
+
+def stream_generator(func):
+    """Генератор группы: своя сессия на каждый снимок и лимит времени ее запросов"""
+    return connection(with_statement_timeout(config.DB_STATEMENT_TIMEOUT_STREAMS, func))
+
+
+# Потоки SSE: группа -> (интервал обновления в секундах, генератор снимка)
+SSE_STREAMS = {
+    "dashboard": (1, stream_generator(generate_dashboard_data)),
+    "sensors": (5, stream_generator(generate_sensors_data)),
+    "alerts": (10, stream_generator(generate_alerts_data)),
+    "statistics": (1, generate_statistics_data),
+}
+for _group, (_interval, _generator) in SSE_STREAMS.items():
+    manager.register_stream(_group, _interval, _generator)
+# Интервал комментариев-пингов, чтобы прокси не закрывали простаивающее соединение
+SSE_HEARTBEAT_INTERVAL = 15
+# Задержка переподключения EventSource, мс
+SSE_RETRY_MS = 3000
+
+
+def format_sse_event(event_id: int, group: str, message) -> str:
+    """Форматирование события в формате text/event-stream"""
+    return f"id: {event_id}\nevent: {group}\ndata: {encode_message(message)}\n\n"
+
+
+@app.get("/sse/{group}")
+async def sse_stream(request: Request, group: str, last_event_id: typing.Optional[int] = None):
+    """Поток Server-Sent Events для пассивных дашбордов и ТВ-панелей"""
+    if group not in SSE_STREAMS:
+        raise HTTPException(status_code=404, detail=f"Неизвестный поток: {group}")
+
+    # EventSource передает Last-Event-ID в заголовке при переподключении
+    header_event_id = request.headers.get("last-event-id")
+    if header_event_id:
+        try:
+            last_event_id = int(header_event_id)
+        except ValueError:
+            last_event_id = None
+
+    interval, generator = SSE_STREAMS[group]
+    await manager.ensure_broadcast_task(group, interval, generator)
+
+    async def event_stream():
+        # Подписка внутри генератора: если клиент ушел до первой итерации,
+        # генератор не запускается и очередь не регистрируется
+        queue = None
+        try:
+            queue = manager.subscribe_sse(group)
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+
+            # Досылаем пропущенные события или текущий снимок из памяти
+            events = manager.events_since(group, last_event_id) if last_event_id is not None else None
+            if events is None:
+                snapshot = manager.latest_event(group)
+                events = [snapshot] if snapshot else []
+                sent_id = 0
+            else:
+                sent_id = last_event_id
+
+            for event_id, message in events:
+                yield format_sse_event(event_id, group, message)
+                sent_id = event_id
+
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event_id, message = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+
+                # Событие уже отправлено при досылке
+                if event_id <= sent_id:
+                    continue
+                yield format_sse_event(event_id, group, message)
+                sent_id = event_id
+        finally:
+            if queue is not None:
+                manager.unsubscribe_sse(group, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 
 @app.websocket("/ws/test")
@@ -0,0 +1,148 @@
+import asyncio
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import bcrypt
+from jose import jwt, ExpiredSignatureError
+from sqlalchemy import event
+from config import config
+from database.models import Employee, Role
+from web.fanout import fanout
+
+logger = logging.getLogger(__name__)
+
+# Префиксы bcrypt-хешей; остальные значения считаются паролями в открытом виде (старые записи)
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+
+def hash_password(password: str) -> str:
+    """Хеширование пароля (bcrypt)"""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def is_password_hashed(hashed_password: str) -> bool:
+    """Хранится ли пароль в виде bcrypt-хеша"""
+    return bool(hashed_password) and hashed_password.startswith(BCRYPT_PREFIXES)
+
+
+def _verify_password_sync(password: str, hashed_password: str) -> bool:
+    if not hashed_password:
+        return False
+    if is_password_hashed(hashed_password):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+    # Совместимость с паролями, сохраненными без хеширования
+    return hmac.compare_digest(password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """Проверка пароля в пуле потоков, чтобы bcrypt не блокировал цикл событий"""
+    return await asyncio.to_thread(_verify_password_sync, password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    """Хеширование пароля в пуле потоков"""
+    return await asyncio.to_thread(hash_password, password)
+
+
+class CachedUser:
+    """Снимок пользователя для кеша (не привязан к сессии БД)"""
+
+    def __init__(self, username: str, role: Optional[str] = None, id: Optional[int] = None,
+                 email: Optional[str] = None):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.email = email
+
+    @classmethod
+    def from_employee(cls, employee: Employee) -> "CachedUser":
+        role = employee.role.name if employee.role is not None else None
+        return cls(username=employee.username, role=role, id=employee.id, email=employee.email)
+
+    def __repr__(self):
+        return f"CachedUser(username={self.username!r}, role={self.role!r})"
+
+
+class TokenCache:
+    """LRU-кеш проверенных JWT токенов с вытеснением по сроку действия"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._tokens: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+
+    def verify(self, token: str) -> dict:
+        """Возвращает полезную нагрузку токена, проверяя подпись только при промахе кеша"""
+        now = time.time()
+        cached = self._tokens.get(token)
+        if cached is not None:
+            payload, expires_at = cached
+            if expires_at > now:
+                self._tokens.move_to_end(token)
+                return payload
+            del self._tokens[token]
+            raise ExpiredSignatureError("Срок действия токена истек")
+
+        payload = jwt.decode(token, config.SECRET_KEY, algorithms=list(dict.fromkeys([config.ALGORITHM, "HS256"])))
+        expires_at = float(payload.get("exp", now + config.ACCESS_TOKEN_EXPIRE_MINUTES * 60))
+        self._put(token, payload, expires_at, now)
+        return payload
+
+    def _put(self, token: str, payload: dict, expires_at: float, now: float):
+        self._tokens[token] = (payload, expires_at)
+        if len(self._tokens) > self.maxsize:
+            # Сначала убираем просроченные токены, затем наименее используемые
+            expired = [key for key, (_, exp) in self._tokens.items() if exp <= now]
+            for key in expired:
+                del self._tokens[key]
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        self._tokens.clear()
+
+
+class UserCache:
+    """Кеш пользователей и их ролей с TTL и явной инвалидацией"""
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._users: Dict[str, Tuple[CachedUser, float]] = {}
+
+    def get(self, username: str) -> Optional[CachedUser]:
+        cached = self._users.get(username)
+        if cached is None:
+            return None
+        user, expires_at = cached
+        if expires_at <= time.monotonic():
+            del self._users[username]
+            return None
+        return user
+
+    def put(self, user: CachedUser):
+        self._users[user.username] = (user, time.monotonic() + self.ttl)
+
+    def invalidate(self, username: str):
+        self._users.pop(username, None)
+
+    def clear(self):
+        self._users.clear()
+
+
+token_cache = TokenCache(maxsize=config.AUTH_TOKEN_CACHE_SIZE)
+user_cache = UserCache(ttl=config.AUTH_USER_CACHE_TTL)
+
+
+# Инвалидация кеша пользователей при изменении сотрудников и ролей
+# (изменения редки, поэтому кеш сбрасывается целиком - это покрывает и переименование)
+@event.listens_for(Employee, "after_update")
+@event.listens_for(Employee, "after_delete")
+@event.listens_for(Role, "after_update")
+@event.listens_for(Role, "after_delete")
+def _invalidate_users(mapper, connection, target):
+    user_cache.clear()
+    fanout.invalidate("users")
+
+
+fanout.register_cache("users", user_cache.clear)
@@ -0,0 +1,145 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from fastapi import WebSocket
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые кодировки сообщений
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+ENCODING_COLUMNAR = "columnar"
+
+# Подпротоколы WebSocket для согласования кодировки
+SUBPROTOCOLS = {
+    "pet.json.v1": ENCODING_JSON,
+    "pet.msgpack.v1": ENCODING_MSGPACK,
+    "pet.columnar.v1": ENCODING_COLUMNAR,
+}
+
+
+def is_available(encoding: str) -> bool:
+    """Доступна ли кодировка в текущем окружении"""
+    if encoding == ENCODING_JSON:
+        return True
+    if encoding == ENCODING_MSGPACK:
+        return msgpack is not None
+    # Колоночный формат без msgpack передается как JSON-текст
+    return encoding == ENCODING_COLUMNAR
+
+
+def negotiate_encoding(websocket: WebSocket) -> Tuple[str, Optional[str]]:
+    """Выбор кодировки по подпротоколу или параметру ?encoding=
+
+    Возвращает кодировку и подпротокол, который нужно подтвердить при accept.
+    """
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        encoding = SUBPROTOCOLS.get(subprotocol)
+        if encoding and is_available(encoding):
+            return encoding, subprotocol
+
+    encoding = websocket.query_params.get("encoding", ENCODING_JSON)
+    if encoding not in SUBPROTOCOLS.values():
+        logger.warning(f"Неизвестная кодировка {encoding}, используется JSON")
+        return ENCODING_JSON, None
+    if not is_available(encoding):
+        logger.warning(f"Кодировка {encoding} недоступна (msgpack не установлен), используется JSON")
+        return ENCODING_JSON, None
+
+    return encoding, None
+
+
+async def accept_with_encoding(websocket: WebSocket) -> str:
+    """Принятие WebSocket соединения с согласованием кодировки"""
+    encoding, subprotocol = negotiate_encoding(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    return encoding
+
+
+def _json_default(value):
+    # Формат времени совпадает с прежним strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    return str(value)
+
+
+def _epoch_ms(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+
+def _binary_default(value):
+    if isinstance(value, datetime):
+        return _epoch_ms(value)
+    return str(value)
+
+
+def _intern(value: str, strings: List[str], index: Dict[str, int]) -> int:
+    position = index.get(value)
+    if position is None:
+        position = len(strings)
+        index[value] = position
+        strings.append(value)
+    return position
+
+
+def _to_columnar(value, strings: List[str], index: Dict[str, int]):
+    """Преобразование списков словарей в колонки с интернированием строк"""
+    if isinstance(value, dict):
+        return {key: _to_columnar(item, strings, index) for key, item in value.items()}
+
+    if isinstance(value, list):
+        if not value or not all(isinstance(row, dict) for row in value):
+            return [_to_columnar(item, strings, index) for item in value]
+
+        keys = list(dict.fromkeys(key for row in value for key in row))
+        columns = {}
+        interned = []
+        for key in keys:
+            column = [row.get(key) for row in value]
+            if all(item is None or isinstance(item, str) for item in column):
+                # Строковые колонки (имена датчиков, локации) передаются индексами в таблицу строк
+                columns[key] = [None if item is None else _intern(item, strings, index) for item in column]
+                interned.append(key)
+            else:
+                columns[key] = [_to_columnar(item, strings, index) for item in column]
+
+        return {"rows": len(value), "columns": columns, "interned": interned}
+
+    if isinstance(value, datetime):
+        return _epoch_ms(value)
+
+    return value
+
+
+def encode_message(message, encoding: str = ENCODING_JSON) -> Union[str, bytes]:
+    """Кодирование сообщения в выбранный формат
+
+    Для JSON возвращается текст, для msgpack и колоночного формата - байты
+    (колоночный формат без msgpack возвращается JSON-текстом).
+    """
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(message, default=_binary_default)
+
+    if encoding == ENCODING_COLUMNAR:
+        strings: List[str] = []
+        data = _to_columnar(message, strings, {})
+        frame = {"format": ENCODING_COLUMNAR, "strings": strings, "data": data}
+        if msgpack is not None:
+            return msgpack.packb(frame, default=_binary_default)
+        return json.dumps(frame, default=_binary_default, separators=(",", ":"))
+
+    return json.dumps(message, default=_json_default)
+
+
+async def send_encoded(websocket: WebSocket, payload: Union[str, bytes]):
+    """Отправка заранее закодированного сообщения"""
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import pickle
+import socket
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import config
+from processing.log_limits import hot_logger
+
+logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
+
+# Кадр: метка, длина (4 байта) и pickle словаря. Обмен только между воркерами одного хоста.
+_MAGIC = b"PWF1"
+_SIZE = struct.Struct("!I")
+_MAX_FRAME = 64 * 1024 * 1024
+
+# Обработчики сообщений ведущего и запросов подписчиков
+DeliverHandler = Callable[[str, int, dict], Awaitable[None]]
+DemandHandler = Callable[[str], Awaitable[None]]
+
+
+class WorkerFanout:
+    """Рассылка сообщений групп между пред-форкнутыми воркерами веб-роли
+
+    Данные групп готовит только ведущий воркер (номер 0) и передает их
+    остальным по парам сокетов, созданным до fork; каждый воркер рассылает
+    сообщение своим клиентам. Запросы к БД для рассылки выполняются один раз
+    на хост, а идентификаторы событий SSE совпадают во всех воркерах, поэтому
+    клиент может переподключиться к любому из них. Ведомые сообщают ведущему
+    число своих подписчиков по группам, чтобы он знал, какие группы готовить.
+    Сброс кеша в одном воркере (уставки, пользователи) передается остальным,
+    чтобы воркеры не отвечали по-разному до истечения TTL.
+    """
+
+    def __init__(self, max_buffer: int):
+        self.max_buffer = max_buffer
+        self.worker_index = 0
+        self.workers = 1
+        # Пары сокетов (сторона ведущего, сторона ведомого) для воркеров 1..N-1
+        self._pairs: List[tuple] = []
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+        # Подписчики ведомых воркеров: номер воркера -> группа -> число
+        self.remote_subscribers: Dict[int, Dict[str, int]] = {}
+        # Кеши, сброс которых повторяется во всех воркерах: имя -> функция сброса
+        self._caches: Dict[str, Callable[[], None]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    @property
+    def is_leader(self) -> bool:
+        return self.worker_index == 0
+
+    def prepare(self, workers: int):
+        """Создание каналов в родительском процессе до запуска воркеров"""
+        self.workers = workers
+        self._pairs = [socket.socketpair() for _ in range(workers - 1)]
+
+    def bind_worker(self, index: int):
+        """Выбор своих концов каналов в дочернем процессе после fork"""
+        self.worker_index = index
+        for peer, (leader_end, follower_end) in enumerate(self._pairs, start=1):
+            if index == 0:
+                follower_end.close()
+            else:
+                leader_end.close()
+                if peer != index:
+                    follower_end.close()
+
+    def has_remote_subscribers(self, group: str) -> bool:
+        return any(groups.get(group) for groups in self.remote_subscribers.values())
+
+    async def run(self, deliver: DeliverHandler, demand: DemandHandler,
+                  local_counts: Callable[[], Dict[str, int]]):
+        """Обмен с другими воркерами до отмены задачи"""
+        if self.is_leader:
+            readers = []
+            for peer, (leader_end, _) in enumerate(self._pairs, start=1):
+                reader, writer = await asyncio.open_connection(sock=leader_end)
+                self._writers[peer] = writer
+                readers.append(self._read_demands(peer, reader, demand))
+                # После перезапуска ведущего ведомые присылают свои подписки заново
+                self._write(peer, {"sync": True})
+            await asyncio.gather(*readers)
+        else:
+            _, follower_end = self._pairs[self.worker_index - 1]
+            reader, writer = await asyncio.open_connection(sock=follower_end)
+            self._writers[0] = writer
+            # После перезапуска ведомого ведущий забывает его прежних подписчиков
+            self._write(0, {"reset": True, "subscribers": local_counts()})
+            await self._read_messages(reader, deliver, local_counts)
+
+    def publish(self, group: str, event_id: int, message: dict):
+        """Передача сообщения группы ведомым воркерам (только ведущий)"""
+        frame = {"group": group, "id": event_id, "message": message}
+        for peer in list(self._writers):
+            self._write(peer, frame)
+
+    def report_subscribers(self, group: str, count: int):
+        """Сообщение ведущему числа подписчиков группы (только ведомый)"""
+        if 0 in self._writers:
+            self._write(0, {"subscribers": {group: count}})
+
+    def register_cache(self, name: str, invalidate: Callable[[], None]):
+        self._caches[name] = invalidate
+
+    def invalidate(self, name: str, origin: Optional[int] = None):
+        """Передача сброса кеша другим воркерам (ведомый - ведущему, ведущий - остальным ведомым)"""
+        for peer in list(self._writers):
+            if peer != origin:
+                self._write(peer, {"invalidate": name})
+
+    def _apply_invalidate(self, name: str):
+        invalidate = self._caches.get(name)
+        if invalidate is not None:
+            invalidate()
+
+    def _write(self, peer: int, frame: dict):
+        writer = self._writers.get(peer)
+        if writer is None or writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            # Воркер не успевает читать: сообщение пропускается, следующее снимок догонит
+            hot_log.warning("Воркер %d не успевает принимать сообщения, сообщение пропущено", peer)
+            return
+        data = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+        writer.write(_MAGIC + _SIZE.pack(len(data)) + data)
+
+    @staticmethod
+    async def _read_frame(reader: asyncio.StreamReader) -> Optional[dict]:
+        """Следующий кадр или None, если канал закрыт
+
+        Если воркер на другом конце перезапустился посреди кадра, поток
+        пропускается до метки начала следующего кадра.
+        """
+        try:
+            while True:
+                window = await reader.readexactly(len(_MAGIC))
+                if window != _MAGIC:
+                    hot_log.warning("Канал между воркерами рассинхронизирован, поиск следующего кадра")
+                    while window != _MAGIC:
+                        window = window[1:] + await reader.readexactly(1)
+                (size,) = _SIZE.unpack(await reader.readexactly(_SIZE.size))
+                if size > _MAX_FRAME:
+                    continue
+                payload = await reader.readexactly(size)
+                try:
+                    return pickle.loads(payload)
+                except Exception as e:
+                    hot_log.warning("Поврежденный кадр от другого воркера пропущен: %s", e)
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def _read_demands(self, peer: int, reader: asyncio.StreamReader, demand: DemandHandler):
+        while True:
+            frame = await self._read_frame(reader)
+            if frame is None:
+                return
+            if "invalidate" in frame:
+                self._apply_invalidate(frame["invalidate"])
+                self.invalidate(frame["invalidate"], origin=peer)
+                continue
+            if frame.get("reset"):
+                self.remote_subscribers[peer] = {}
+            groups = self.remote_subscribers.setdefault(peer, {})
+            for group, count in frame.get("subscribers", {}).items():
+                groups[group] = count
+                if count:
+                    try:
+                        await demand(group)
+                    except Exception as e:
+                        logger.error(f"Ошибка запуска рассылки группы {group} для воркера {peer}: {e}")
+
+    async def _read_messages(self, reader: asyncio.StreamReader, deliver: DeliverHandler,
+                             local_counts: Callable[[], Dict[str, int]]):
+        while True:
+            frame = await self._read_frame(reader)
+            if frame is None:
+                return
+            if frame.get("sync"):
+                self._write(0, {"subscribers": local_counts()})
+                continue
+            if "invalidate" in frame:
+                self._apply_invalidate(frame["invalidate"])
+                continue
+            try:
+                await deliver(frame["group"], frame["id"], frame["message"])
+            except Exception as e:
+                hot_log.error("Ошибка рассылки сообщения от ведущего воркера: %s", e)
+
+
+# Глобальный канал воркеров; без пред-форка (один воркер) не используется
+fanout = WorkerFanout(max_buffer=config.WEB_FANOUT_MAX_BUFFER)
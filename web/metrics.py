@@ -0,0 +1,77 @@
+import time
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from processing.metrics import CONTENT_TYPE, registry
+
+http_request_seconds = registry.histogram("http_request_duration_seconds", "Время обработки HTTP-запроса",
+                                          labelnames=("method", "route", "status"))
+websocket_connections = registry.gauge("websocket_connections", "Открытые WebSocket-подключения",
+                                       labelnames=("route",))
+
+# Метка для запросов, не попавших ни в один маршрут (чтобы не плодить серии по произвольным путям)
+UNMATCHED_ROUTE = "unmatched"
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: длительность HTTP-запросов по шаблону маршрута и число WebSocket-подключений
+
+    Чистый ASGI без BaseHTTPMiddleware, чтобы не добавлять задач и копирования тела ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_seconds.labels(scope["method"], _route_label(scope), str(status)).observe(
+                time.perf_counter() - started
+            )
+
+    async def _websocket(self, scope, receive, send):
+        gauge = None
+
+        async def send_tracking_accept(message):
+            nonlocal gauge
+            if message["type"] == "websocket.accept" and gauge is None:
+                gauge = websocket_connections.labels(_route_label(scope))
+                gauge.inc()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracking_accept)
+        finally:
+            if gauge is not None:
+                gauge.dec()
+
+
+async def _metrics_endpoint(request):
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+# Отдельное приложение /metrics для процессов без веб-роли (ingest, consumer)
+metrics_app = Starlette(routes=[Route("/metrics", _metrics_endpoint)])
@@ -1,55 +1,175 @@
 import asyncio
 import json
 import logging
-from typing import Dict, List, Set
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
 from fastapi import WebSocket, WebSocketDisconnect
+from web.encoding import ENCODING_JSON, accept_with_encoding, encode_message, send_encoded
+from processing.metrics import registry
+from processing.tracing import tracer
+from web.fanout import fanout
+from processing.log_limits import hot_logger
+from database.query_limits import ClientDisconnected, cancel_on_disconnect, is_statement_timeout
+from config import config
 
 logger = logging.getLogger(__name__)
+hot_log = hot_logger(__name__)
+
+websocket_fanout_seconds = registry.histogram("websocket_fanout_seconds",
+                                              "Время рассылки сообщения всем клиентам группы",
+                                              labelnames=("group",))
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, history_size: int = 100, sse_queue_size: int = 16):
         # Словарь подключений по группам
         self.active_connections: Dict[str, List[WebSocket]] = {}
         # Задачи для отправки данных
         self.tasks: Dict[str, asyncio.Task] = {}
-        
+        # Согласованная кодировка сообщений для каждого клиента
+        self.encodings: Dict[WebSocket, str] = {}
+        # Очереди SSE-подписчиков по группам
+        self.sse_subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # Последние сообщения групп для возобновления по Last-Event-ID
+        self.history: Dict[str, Deque[Tuple[int, dict]]] = {}
+        self.history_size = history_size
+        self.sse_queue_size = sse_queue_size
+        # Счетчики идентификаторов событий по группам
+        self.event_ids: Dict[str, int] = {}
+        # Генераторы данных групп: группа -> (интервал, генератор)
+        self.streams: Dict[str, Tuple[float, object]] = {}
+
     async def connect(self, websocket: WebSocket, group: str):
         """Подключение нового клиента"""
-        await websocket.accept()
+        self.encodings[websocket] = await accept_with_encoding(websocket)
         
         if group not in self.active_connections:
             self.active_connections[group] = []
         
         self.active_connections[group].append(websocket)
         logger.info(f"Клиент подключен к группе {group}, всего подключений: {len(self.active_connections[group])}")
+        self._report_subscribers(group)
         
     def disconnect(self, websocket: WebSocket, group: str):
         """Отключение клиента"""
         if group in self.active_connections:
             if websocket in self.active_connections[group]:
                 self.active_connections[group].remove(websocket)
+                self.encodings.pop(websocket, None)
                 logger.info(f"Клиент отключен от группы {group}, осталось подключений: {len(self.active_connections[group])}")
+                self._report_subscribers(group)
     
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Отправка сообщения конкретному клиенту"""
         try:
-            await websocket.send_json(message)
+            encoding = self.encodings.get(websocket, ENCODING_JSON)
+            await send_encoded(websocket, encode_message(message, encoding))
         except Exception as e:
-            logger.error(f"Ошибка отправки сообщения: {e}")
+            hot_log.error("Ошибка отправки сообщения: %s", e)
     
+    def has_subscribers(self, group: str) -> bool:
+        """Есть ли у группы WebSocket или SSE клиенты (с учетом других воркеров)"""
+        return self._local_count(group) > 0 or fanout.has_remote_subscribers(group)
+
+    def _local_count(self, group: str) -> int:
+        return len(self.active_connections.get(group, ())) + len(self.sse_subscribers.get(group, ()))
+
+    def _local_counts(self) -> Dict[str, int]:
+        groups = set(self.active_connections) | set(self.sse_subscribers)
+        return {group: self._local_count(group) for group in groups}
+
+    def _report_subscribers(self, group: str):
+        if fanout.enabled and not fanout.is_leader:
+            fanout.report_subscribers(group, self._local_count(group))
+
+    def subscribe_sse(self, group: str) -> asyncio.Queue:
+        """Регистрация SSE-подписчика, возвращает его очередь событий"""
+        queue = asyncio.Queue(maxsize=self.sse_queue_size)
+        self.sse_subscribers.setdefault(group, set()).add(queue)
+        logger.info(f"SSE клиент подключен к группе {group}, всего: {len(self.sse_subscribers[group])}")
+        self._report_subscribers(group)
+        return queue
+
+    def unsubscribe_sse(self, group: str, queue: asyncio.Queue):
+        """Отключение SSE-подписчика"""
+        if group in self.sse_subscribers:
+            self.sse_subscribers[group].discard(queue)
+            logger.info(f"SSE клиент отключен от группы {group}, осталось: {len(self.sse_subscribers[group])}")
+            self._report_subscribers(group)
+
+    def latest_event(self, group: str) -> Optional[Tuple[int, dict]]:
+        """Последнее отправленное сообщение группы (текущий снимок)"""
+        history = self.history.get(group)
+        return history[-1] if history else None
+
+    def events_since(self, group: str, last_event_id: int) -> Optional[List[Tuple[int, dict]]]:
+        """Сообщения после last_event_id или None, если буфер их уже не содержит"""
+        history = self.history.get(group)
+        current_id = self.event_ids.get(group, 0)
+        if last_event_id > current_id:
+            # Идентификатор из прошлого запуска сервера
+            return None
+        if last_event_id == current_id:
+            return []
+        if not history or last_event_id < history[0][0] - 1:
+            return None
+        return [event for event in history if event[0] > last_event_id]
+
+    def _record_event(self, message: dict, group: str, event_id: Optional[int] = None) -> int:
+        """Сохранение сообщения в истории группы с присвоением идентификатора
+
+        Сообщения от ведущего воркера приходят с уже присвоенным идентификатором.
+        """
+        if event_id is None:
+            event_id = self.event_ids.get(group, 0) + 1
+        self.event_ids[group] = event_id
+
+        if group not in self.history:
+            self.history[group] = deque(maxlen=self.history_size)
+        self.history[group].append((event_id, message))
+
+        for queue in self.sse_subscribers.get(group, ()):
+            if queue.full():
+                # Медленный клиент: отбрасываем самое старое событие
+                queue.get_nowait()
+            queue.put_nowait((event_id, message))
+
+        return event_id
+
     async def broadcast(self, message: dict, group: str):
-        """Отправка сообщения всем подключенным клиентам группы"""
+        """Отправка сообщения всем подключенным клиентам группы (во всех воркерах)"""
+        event_id = self._record_event(message, group)
+        if fanout.enabled:
+            fanout.publish(group, event_id, message)
+        await self._send(message, group)
+
+    async def deliver(self, group: str, event_id: int, message: dict):
+        """Сообщение группы, подготовленное ведущим воркером"""
+        self._record_event(message, group, event_id)
+        await self._send(message, group)
+
+    async def _send(self, message: dict, group: str):
         if group not in self.active_connections:
             return
             
+        # Кодируем сообщение один раз для каждой кодировки, а не для каждого клиента
+        started = time.perf_counter()
+        started_ns = time.time_ns()
+        payloads = {}
         disconnected = []
         for connection in self.active_connections[group]:
             try:
-                await connection.send_json(message)
+                encoding = self.encodings.get(connection, ENCODING_JSON)
+                if encoding not in payloads:
+                    payloads[encoding] = encode_message(message, encoding)
+                await send_encoded(connection, payloads[encoding])
             except Exception as e:
-                logger.error(f"Ошибка широковещательной отправки: {e}")
+                hot_log.error("Ошибка широковещательной отправки: %s", e)
                 disconnected.append(connection)
         
+        websocket_fanout_seconds.labels(group).observe(time.perf_counter() - started)
+        tracer.on_broadcast(group, started_ns, time.time_ns(), len(self.active_connections[group]))
+
         # Удаление отключенных соединений
         for connection in disconnected:
             self.disconnect(connection, group)
@@ -62,21 +182,37 @@ class ConnectionManager:
         task = asyncio.create_task(self._broadcast_task(group, interval, data_generator))
         self.tasks[group] = task
         return task
+
+    def register_stream(self, group: str, interval: float, data_generator):
+        """Генератор данных группы, который ведущий воркер запускает по запросу других воркеров"""
+        self.streams[group] = (interval, data_generator)
+
+    async def ensure_broadcast_task(self, group: str, interval: float, data_generator):
+        """Запуск задачи отправки данных, только если она еще не работает
+
+        В ведомом воркере задача не запускается: данные группы приходят от ведущего.
+        """
+        if fanout.enabled and not fanout.is_leader:
+            return None
+        if group in self.tasks and not self.tasks[group].done():
+            return self.tasks[group]
+        return await self.start_broadcast_task(group, interval, data_generator)
         
     async def _broadcast_task(self, group: str, interval: float, data_generator):
         """Периодическая отправка данных всем клиентам группы"""
         while True:
             try:
                 # Если нет подключений, просто ждем
-                if group not in self.active_connections or not self.active_connections[group]:
+                if not self.has_subscribers(group):
                     await asyncio.sleep(interval)
                     continue
                 
-                # Получаем данные от генератора
-                data = await data_generator()
+                # Получаем данные от генератора; запрос отменяется, если все подписчики ушли
+                data = await cancel_on_disconnect(data_generator(), self._wait_unsubscribed(group), group)
                 
                 # Отправляем данные всем клиентам группы
-                await self.broadcast(data, group)
+                if data is not None:
+                    await self.broadcast(data, group)
                 
                 # Ждем указанный интервал
                 await asyncio.sleep(interval)
@@ -84,10 +220,30 @@ class ConnectionManager:
             except asyncio.CancelledError:
                 logger.info(f"Задача трансляции для группы {group} отменена")
                 break
+            except ClientDisconnected:
+                logger.info(f"Подписчики группы {group} отключились, запрос данных отменен")
             except Exception as e:
-                logger.error(f"Ошибка в задаче трансляции для группы {group}: {e}")
+                if is_statement_timeout(e):
+                    # Снимок не рассылается, клиенты сохраняют предыдущий
+                    logger.warning(f"Запрос данных группы {group} прерван по лимиту времени, снимок пропущен")
+                else:
+                    logger.error(f"Ошибка в задаче трансляции для группы {group}: {e}")
                 await asyncio.sleep(interval)
     
+    async def _wait_unsubscribed(self, group: str):
+        """Ожидание отключения всех подписчиков группы (с учетом других воркеров)"""
+        while self.has_subscribers(group):
+            await asyncio.sleep(config.DB_DISCONNECT_POLL_INTERVAL)
+
+    async def _start_requested_stream(self, group: str):
+        if group in self.streams:
+            interval, data_generator = self.streams[group]
+            await self.ensure_broadcast_task(group, interval, data_generator)
+
+    async def run_fanout(self):
+        """Обмен сообщениями групп с другими воркерами веб-роли"""
+        await fanout.run(self.deliver, self._start_requested_stream, self._local_counts)
+
     def stop_all_tasks(self):
         """Остановка всех запущенных задач"""
         for group, task in self.tasks.items():